@@ -24,13 +24,30 @@ def create_app(config_class=Config):
                 "https://api.damareen.bbarni.hackclub.app",
             ],
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
+            "allow_headers": ["Content-Type", "Authorization", "Idempotency-Key"],
+            "expose_headers": ["Idempotent-Replayed", "X-Refreshed-Token"],
             "supports_credentials": True,  # cookie-k miatt kell
         }
     })
     
+    # Rate limit háttértár a configból
+    from app.ratelimit import limiter
+    limiter.init_app(app)
+    
+    # bcrypt szálkészlet
+    from app.passwords import password_hasher
+    password_hasher.init_app(app)
+    
     # API Blueprint regisztrálása
     from app.routes import api
     app.register_blueprint(api)
     
+    # Harc napló háttérszál
+    from app.battle_log import battle_log_writer
+    battle_log_writer.init_app(app)
+    
+    # Nagy világok darabonkénti törlése háttérszálon
+    from app.world_deletion import world_deleter
+    world_deleter.init_app(app)
+    
     return app
@@ -0,0 +1,139 @@
+"""Harc napló - háttérszál írja kötegekben a battle_log táblát és a battle_stats számlálókat"""
+import atexit
+import queue
+import threading
+from datetime import datetime
+
+from sqlalchemy import update
+
+from app.utils import retry_on_db_lock
+
+
+BATCH_SIZE = 200  # egy commitba ennyi bejegyzés fér
+FLUSH_INTERVAL = 1.0  # ennyi másodpercenként akkor is ír, ha nincs tele a köteg
+MAX_QUEUE = 10000  # ha ennél több vár, eldobjuk (a harc fontosabb mint a napló)
+WRITE_ATTEMPTS = 3  # ennyiszer próbálunk meg egy köteget, utána eldobjuk
+
+
+class BattleLogWriter:
+
+    def __init__(self):
+        self.app = None
+        self._queue = queue.Queue(maxsize=MAX_QUEUE)
+        self._thread = None
+        self._write_lock = threading.Lock()
+        self.dropped = 0
+
+    def init_app(self, app):
+        self.app = app
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='battle-log-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def record(self, user_id, world_id, dungeon_id, player_card_ids, results, winner,
+               upgrade_type=None, upgrade_amount=0):
+        """Egy harc sorba állítása - nem blokkol, nem ír adatbázist"""
+        entry = {
+            'user_id': user_id,
+            'world_id': str(world_id),
+            'dungeon_id': dungeon_id,
+            'player_card_ids': tuple(player_card_ids),
+            'outcomes': ''.join('p' if battle_winner == 'player' else 'd' for battle_winner, _ in results),
+            'winner': winner,
+            'upgrade_type': upgrade_type,
+            'upgrade_amount': upgrade_amount,
+            'created_at': datetime.utcnow(),
+        }
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Minden várakozó bejegyzés kiírása most - leállításnál és méréshez"""
+        while True:
+            batch = self._drain()
+            if not batch:
+                return
+            self._write(batch)
+
+    def _drain(self, first=None):
+        batch = [first] if first is not None else []
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                continue
+            self._write(self._drain(first))
+
+    def _write(self, batch):
+        from app.models import db, BattleLog, BattleStat, World
+
+        def write():
+            # a sorban állás közben törölt világok bejegyzései már nem kellenek
+            existing = {world_id for (world_id,) in db.session.query(World.world_id).filter(
+                World.world_id.in_({entry['world_id'] for entry in batch})
+            )}
+            entries = [entry for entry in batch if entry['world_id'] in existing]
+            if not entries:
+                return
+            db.session.execute(db.insert(BattleLog), [{
+                key: value for key, value in entry.items() if key != 'player_card_ids'
+            } for entry in entries])
+            for (world_id, scope, subject_id), (fights, wins) in _deltas(entries).items():
+                result = db.session.execute(
+                    update(BattleStat)
+                    .where(BattleStat.world_id == world_id, BattleStat.scope == scope,
+                           BattleStat.subject_id == subject_id)
+                    .values(fights=BattleStat.fights + fights, wins=BattleStat.wins + wins)
+                )
+                if result.rowcount == 0:
+                    db.session.add(BattleStat(world_id=world_id, scope=scope, subject_id=subject_id,
+                                              fights=fights, wins=wins))
+            db.session.commit()
+
+        with self._write_lock, self.app.app_context():
+            try:
+                # zárolásnál retry_on_db_lock vár; más hibánál (pl. egy másik folyamat
+                # közben beszúrta ugyanazt a BattleStat sort) az egész köteg újra
+                for attempt in range(WRITE_ATTEMPTS):
+                    try:
+                        retry_on_db_lock(write)
+                        return
+                    except Exception:
+                        db.session.rollback()
+                        if attempt == WRITE_ATTEMPTS - 1:
+                            self.dropped += len(batch)
+                            self.app.logger.exception('A harc napló írása sikertelen')
+            finally:
+                db.session.remove()
+
+
+def _deltas(entries):
+    """Számláló delták kulcsonként összegezve, így kulcsonként egy UPDATE"""
+    deltas = {}
+
+    def add(world_id, scope, subject_id, fights, wins):
+        key = (world_id, scope, subject_id)
+        current = deltas.get(key, (0, 0))
+        deltas[key] = (current[0] + fights, current[1] + wins)
+
+    for entry in entries:
+        won = 1 if entry['winner'] == 'player' else 0
+        add(entry['world_id'], 'dungeon', entry['dungeon_id'], 1, won)
+        add(entry['world_id'], 'user', entry['user_id'], 1, won)
+        for card_id, outcome in zip(entry['player_card_ids'], entry['outcomes']):
+            add(entry['world_id'], 'card', card_id, 1, 1 if outcome == 'p' else 0)
+    return deltas
+
+
+battle_log_writer = BattleLogWriter()
@@ -0,0 +1,110 @@
+"""
+Kazamata snapshot cache - a harcok a kazamata lapjait adatbázis olvasás nélkül kapják
+
+Érvénytelenítés a worlds.version-nel: minden kazamatát érintő változás a
+saját tranzakciójában bump_world_version-t hív.
+"""
+from collections import namedtuple
+
+from app import fight_engine
+from app.cache import BoundedCache
+
+
+DUNGEON_CACHE_SIZE = 512  # ennyi kazamata fér a cache-be
+
+
+CardStats = namedtuple('CardStats', [
+    'id', 'world_id', 'owner_id', 'name', 'health', 'damage', 'type', 'position', 'is_leader'
+])
+
+DungeonSnapshot = namedtuple('DungeonSnapshot', [
+    'id', 'world_id', 'name', 'card_ids', 'cards', 'side'
+])
+DungeonSnapshot.__doc__ = """
+Kazamata snapshot
+    card_ids - a tárolt kártya ID lista (ennek a hossza számít a jutalomnál)
+    cards - a létező kártyák CardStats-ként, harc sorrendben
+    side - ugyanezek fight_engine.Side formában
+"""
+
+# Kulcs: (dungeon_id, világ verzió) - a régi verziójú elemek maguktól kiesnek
+_snapshots = BoundedCache(maxsize=DUNGEON_CACHE_SIZE)
+_dungeon_worlds = {}  # dungeon_id -> world_id, hogy a verziót a kazamata nélkül le tudjuk kérdezni
+
+
+def world_version(world_id):
+    """A világ aktuális verziója, None ha a világ már nincs meg - egy PK lekérdezés"""
+    from app.models import db, World
+
+    return db.session.query(World.version).filter(World.world_id == str(world_id)).scalar()
+
+
+def bump_world_version(world_id):
+    """Világ verzió növelése - minden snapshot elavul ebben a világban; a változással együtt commitolandó"""
+    from app.models import World
+
+    World.query.filter(World.world_id == str(world_id)).update(
+        {World.version: World.version + 1}, synchronize_session=False
+    )
+
+
+def _load_snapshot(dungeon_id):
+    from app.models import db, Card, Dungeon, DungeonCard, World
+
+    # kazamata + világ verzió + lapjai sorrendben, egyetlen join-nal (így a verzió
+    # pontosan a betöltött lapokhoz tartozik); törölt világ kazamatája nincs
+    rows = db.session.query(
+        World.version, Dungeon.world_id.label('dungeon_world_id'), Dungeon.name.label('dungeon_name'),
+        DungeonCard.card_id, Card.id, Card.world_id, Card.owner_id, Card.name, Card.health,
+        Card.damage, Card.type, DungeonCard.position, Card.is_leader
+    ).join(
+        World, World.world_id == Dungeon.world_id
+    ).outerjoin(
+        DungeonCard, DungeonCard.dungeon_id == Dungeon.id
+    ).outerjoin(
+        Card, Card.id == DungeonCard.card_id
+    ).filter(Dungeon.id == str(dungeon_id)).order_by(DungeonCard.position).all()
+    if not rows:
+        return None, None
+
+    card_ids = tuple(row.card_id for row in rows if row.card_id is not None)
+    cards = [CardStats(*row[4:]) for row in rows if row.id is not None]
+
+    return rows[0].version, DungeonSnapshot(
+        id=str(dungeon_id),
+        world_id=rows[0].dungeon_world_id,
+        name=rows[0].dungeon_name,
+        card_ids=card_ids,
+        cards=tuple(cards),
+        side=fight_engine.make_side((c.id, c.damage, c.health, c.type) for c in cards)
+    )
+
+
+def get_dungeon_snapshot(dungeon_id):
+    """
+    Kazamata snapshot ID alapján, None ha nincs ilyen kazamata
+
+    Találatnál egyetlen PK lekérdezés van (a világ verziója).
+    """
+    dungeon_id = str(dungeon_id)
+    world_id = _dungeon_worlds.get(dungeon_id)
+    if world_id is not None:
+        version = world_version(world_id)
+        if version is None:
+            _dungeon_worlds.pop(dungeon_id, None)
+            return None
+        snapshot = _snapshots.get((dungeon_id, version))
+        if snapshot is not None:
+            return snapshot
+
+    version, snapshot = _load_snapshot(dungeon_id)
+    if snapshot is None:
+        _dungeon_worlds.pop(dungeon_id, None)
+        return None
+    _dungeon_worlds[dungeon_id] = snapshot.world_id
+    _snapshots.set((dungeon_id, version), snapshot)
+    return snapshot
+
+
+def cache_stats():
+    return _snapshots.stats()
@@ -0,0 +1,45 @@
+"""Kazamata kártyák - dungeon_cards tábla, pozíciónként egy sor (1-től, harc sorrendben)"""
+from app.models import db, DungeonCard
+
+
+def card_ids(dungeon_id):
+    """A kazamata lapjai harc sorrendben"""
+    rows = db.session.query(DungeonCard.card_id).filter(
+        DungeonCard.dungeon_id == str(dungeon_id)
+    ).order_by(DungeonCard.position).all()
+    return [card_id for (card_id,) in rows]
+
+
+def card_ids_by_dungeon(dungeon_ids):
+    """{dungeon_id: [card_id, ...]} több kazamatára egy lekérdezéssel"""
+    dungeon_ids = [str(d) for d in dungeon_ids]
+    result = {dungeon_id: [] for dungeon_id in dungeon_ids}
+    if not dungeon_ids:
+        return result
+    rows = db.session.query(DungeonCard.dungeon_id, DungeonCard.card_id).filter(
+        DungeonCard.dungeon_id.in_(dungeon_ids)
+    ).order_by(DungeonCard.dungeon_id, DungeonCard.position).all()
+    for dungeon_id, card_id in rows:
+        result[dungeon_id].append(card_id)
+    return result
+
+
+def set_cards(dungeon_id, ids):
+    """Egy új kazamata lapjainak beírása (egy több soros INSERT)"""
+    rows = [{'dungeon_id': str(dungeon_id), 'position': i + 1, 'card_id': str(card_id)}
+            for i, card_id in enumerate(ids)]
+    if rows:
+        db.session.execute(DungeonCard.__table__.insert(), rows)
+
+
+def remove_cards(ids):
+    """A lapok kivétele minden kazamatából - egy indexelt DELETE"""
+    ids = [str(card_id) for card_id in ids]
+    if not ids:
+        return 0
+    return DungeonCard.query.filter(DungeonCard.card_id.in_(ids)).delete(synchronize_session=False)
+
+
+def remove_dungeon(dungeon_id):
+    return DungeonCard.query.filter(DungeonCard.dungeon_id == str(dungeon_id)).delete(synchronize_session=False)
+
@@ -0,0 +1,224 @@
+"""Harc motor - a /game/fight szabályai tiszta függvényekként, Flask és adatbázis nélkül"""
+from collections import namedtuple
+
+
+# Típus kódok - t > f > v > l > t (kör)
+TYPE_CODES = {'t': 0, 'f': 1, 'v': 2, 'l': 3}
+UNKNOWN_TYPE = 4  # üres vagy ismeretlen típus
+_NUM_TYPES = 5
+
+PLAYER = 'player'
+DUNGEON = 'dungeon'
+
+REASON_DAMAGE = 'damage'
+REASON_TYPE = 'type'
+REASON_FALLBACK = 'dungeon_fallback'
+
+# Győzelem esetén járó fejlesztés a kazamata mérete alapján
+UPGRADES = {
+    1: ('damage', 1),
+    4: ('health', 2),
+    6: ('damage', 3),
+}
+
+
+Side = namedtuple('Side', ['ids', 'damage', 'health', 'types'])
+Side.__doc__ = """Egy oldal kártyái sorrendben - ids, damage, health, types (kódok)"""
+
+
+def _build_outcome_table():
+    """
+    Előre kiszámolt kimenet tábla
+
+    Index: [p_can_kill * 2 + d_can_kill][p_type * 5 + d_type] -> (győztes, ok)
+    Így egy párosítás eldöntése két listaindexelés, nincs elágazás.
+    """
+    beats = [TYPE_CODES['f'], TYPE_CODES['v'], TYPE_CODES['l'], TYPE_CODES['t']]
+
+    type_row = []
+    for p_type in range(_NUM_TYPES):
+        for d_type in range(_NUM_TYPES):
+            known = p_type != UNKNOWN_TYPE and d_type != UNKNOWN_TYPE
+            if known and p_type != d_type and beats[p_type] == d_type:
+                type_row.append((PLAYER, REASON_TYPE))
+            elif known and p_type != d_type and beats[d_type] == p_type:
+                type_row.append((DUNGEON, REASON_TYPE))
+            else:
+                type_row.append((DUNGEON, REASON_FALLBACK))
+
+    size = _NUM_TYPES * _NUM_TYPES
+    return [
+        type_row,  # egyik sem tudja megölni a másikat -> típus dönt
+        [(DUNGEON, REASON_DAMAGE)] * size,  # csak a kazamata öl
+        [(PLAYER, REASON_DAMAGE)] * size,  # csak a játékos öl
+        type_row,  # mindkettő öl -> típus dönt
+    ]
+
+
+_OUTCOMES = _build_outcome_table()
+
+
+def type_code(card_type):
+    """Típus betű -> kód, ismeretlenre UNKNOWN_TYPE"""
+    if not card_type:
+        return UNKNOWN_TYPE
+    return TYPE_CODES.get(card_type.lower(), UNKNOWN_TYPE)
+
+
+def make_side(rows):
+    """
+    Side összerakása (id, damage, health, type) sorokból
+
+    A sorok jöhetnek oszlop-szintű query-ből vagy ORM objektumokból is,
+    a sorrendjük a harc sorrendje.
+    """
+    ids = []
+    damage = []
+    health = []
+    types = []
+    for card_id, card_damage, card_health, card_type in rows:
+        ids.append(card_id)
+        damage.append(int(card_damage or 0))
+        health.append(int(card_health or 0))
+        types.append(type_code(card_type))
+    return Side(tuple(ids), tuple(damage), tuple(health), tuple(types))
+
+
+def side_from_cards(cards):
+    """Side Card objektumokból - to_dict() nélkül, a kép nem kell hozzá"""
+    return make_side((c.id, c.damage, c.health, c.type) for c in cards)
+
+
+def resolve(player, dungeon):
+    """
+    Párosítások eldöntése pozíciónként
+
+    Visszaad egy (győztes, ok) listát, a rövidebb oldal hosszáig.
+    1. Sebzés alapján - ki öli meg a másikat
+    2. Ha egyenlő, akkor típus alapján (t > f > v > l > t)
+    3. Ha az is egyenlő, dungeon nyer (fallback)
+    """
+    outcomes = _OUTCOMES
+    return [
+        outcomes[(p_dmg > d_hp) * 2 + (d_dmg > p_hp)][p_type * _NUM_TYPES + d_type]
+        for p_dmg, p_hp, p_type, d_dmg, d_hp, d_type in zip(
+            player.damage, player.health, player.types,
+            dungeon.damage, dungeon.health, dungeon.types,
+        )
+    ]
+
+
+def count_wins(results):
+    """(játékos győzelmek, kazamata győzelmek) egy resolve() eredményből"""
+    player_wins = sum(1 for winner, _ in results if winner == PLAYER)
+    return player_wins, len(results) - player_wins
+
+
+def overall_winner(results):
+    """Többségi rendszer - döntetlennél a játékos nyer"""
+    player_wins, dungeon_wins = count_wins(results)
+    return PLAYER if player_wins >= dungeon_wins else DUNGEON
+
+
+def upgrade_for(num_cards):
+    """(upgrade_type, upgrade_amount) a kazamata kártyaszáma alapján"""
+    return UPGRADES.get(num_cards, (None, 0))
+
+
+def simulate(player, dungeons):
+    """
+    Egy pakli több kazamata ellen, egy menetben
+
+    dungeons: {dungeon_id: Side}. Csak az azonos méretű kazamatákkal
+    harcol (a /game/fight is ezt követeli meg), a többire None jön.
+    Semmit nem módosít, csak kiszámolja az eredményt.
+    """
+    size = len(player.ids)
+    report = {}
+    for dungeon_id, dungeon in dungeons.items():
+        if len(dungeon.ids) != size:
+            report[dungeon_id] = None
+            continue
+        report[dungeon_id] = resolve(player, dungeon)
+    return report
+
+
+def _win_mask(card, dungeon):
+    """Bitmaszk: melyik kazamata pozíciókon nyer ez az egy kártya"""
+    damage, health, card_type = card
+    outcomes = _OUTCOMES
+    mask = 0
+    for pos, (d_dmg, d_hp, d_type) in enumerate(zip(dungeon.damage, dungeon.health, dungeon.types)):
+        winner, _ = outcomes[(damage > d_hp) * 2 + (d_dmg > health)][card_type * _NUM_TYPES + d_type]
+        if winner == PLAYER:
+            mask |= 1 << pos
+    return mask
+
+
+def best_deck(collection, dungeon):
+    """
+    A gyűjteményből a legtöbb párosítást nyerő pakli és sorrend
+
+    A pozíciók függetlenek egymástól, ezért ez egy hozzárendelési feladat:
+    maximális párosítás a pozíciók és az ott nyerő kártyák között.
+    Metszés: azonos nyerő-maszkú kártyákból elég a pakli méretnyi
+    (a legerősebbek), így a jelöltek száma legfeljebb 64 * 6, akármekkora
+    is a gyűjtemény. Utána augmentáló utas párosítás (Kuhn).
+
+    Visszaad egy indexlistát a collection-be pozíció sorrendben,
+    vagy None-t ha nincs elég kártya.
+    """
+    size = len(dungeon.ids)
+    if len(collection.ids) < size:
+        return None
+
+    # erősebb kártya előre, hogy a metszés azokat tartsa meg
+    order = sorted(
+        range(len(collection.ids)),
+        key=lambda i: (collection.damage[i] + collection.health[i], collection.damage[i]),
+        reverse=True
+    )
+    kept_per_mask = {}
+    candidates = []
+    for i in order:
+        mask = _win_mask((collection.damage[i], collection.health[i], collection.types[i]), dungeon)
+        if not mask or kept_per_mask.get(mask, 0) >= size:
+            continue
+        kept_per_mask[mask] = kept_per_mask.get(mask, 0) + 1
+        candidates.append((i, mask))
+
+    by_position = [[i for i, mask in candidates if mask & (1 << pos)] for pos in range(size)]
+    card_at = {}  # kártya index -> pozíció
+
+    def augment(pos, seen):
+        for i in by_position[pos]:
+            if i in seen:
+                continue
+            seen.add(i)
+            if i not in card_at or augment(card_at[i], seen):
+                card_at[i] = pos
+                return True
+        return False
+
+    for pos in range(size):
+        augment(pos, set())
+
+    deck = [None] * size
+    for i, pos in card_at.items():
+        deck[pos] = i
+    # amit nem lehet megnyerni, oda a maradék legerősebb kártyák kerülnek
+    leftovers = (i for i in order if i not in card_at)
+    for pos in range(size):
+        if deck[pos] is None:
+            deck[pos] = next(leftovers)
+    return deck
+
+
+def pick(side, indexes):
+    """Side részhalmaza a megadott indexekkel, ebben a sorrendben"""
+    return Side(
+        tuple(side.ids[i] for i in indexes),
+        tuple(side.damage[i] for i in indexes),
+        tuple(side.health[i] for i in indexes),
+        tuple(side.types[i] for i in indexes),
+    )
@@ -0,0 +1,79 @@
+"""
+Idempotency-Key támogatás - az ismételt kérés a tárolt választ kapja, a művelet nem fut újra
+
+IDEMPOTENCY_MAX_BODY feletti válaszból csak a lenyomat marad, az ismétlés 409-et kap.
+"""
+import hashlib
+import threading
+import zlib
+from functools import wraps
+
+from flask import request, make_response
+
+from app.cache import BoundedCache
+from app.utils import error_response
+
+
+IDEMPOTENCY_TTL = 24 * 60 * 60  # egy napig emlékszünk a válaszra
+IDEMPOTENCY_MAX_KEYS = 10000
+IDEMPOTENCY_MAX_BYTES = 64 * 1024 * 1024  # tömörített válaszok összesen, folyamatonként
+IDEMPOTENCY_MAX_BODY = 1024 * 1024  # ennél nagyobb (tömörített) választ nem tárolunk
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+
+_responses = BoundedCache(
+    maxsize=IDEMPOTENCY_MAX_KEYS, ttl=IDEMPOTENCY_TTL, maxbytes=IDEMPOTENCY_MAX_BYTES,
+    sizeof=lambda stored: len(stored[1] or b'')
+)
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+def idempotent(func):
+    """
+    Decorator - a require_auth után kell tenni (a kulcs userhez kötött)
+
+    Ugyanaz a kulcs más paraméterekkel 422-t ad, párhuzamosan futó
+    azonos kulcsú kérésre 409 jön. 5xx választ nem tárolunk, az újrapróbálható.
+    """
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key', '').strip()
+        if not key:
+            return func(*args, **kwargs)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return error_response('Az Idempotency-Key túl hosszú', 400)
+
+        store_key = (request.user_id, request.endpoint, key)
+        fingerprint = hashlib.sha1(request.full_path.encode('utf-8') + (request.get_data() or b'')).digest()
+
+        stored = _responses.get(store_key)
+        if stored is not None:
+            stored_fingerprint, body, status, mimetype = stored
+            if stored_fingerprint != fingerprint:
+                return error_response('Ez az Idempotency-Key már egy másik kéréshez tartozik', 422)
+            if body is None:
+                return error_response(
+                    'Ez a kérés már lefutott, de a válasza túl nagy volt a tároláshoz', 409,
+                    {'Idempotent-Replayed': 'true'}
+                )
+            response = make_response(zlib.decompress(body), status)
+            response.mimetype = mimetype
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        with _in_flight_lock:
+            if store_key in _in_flight:
+                return error_response('Ezzel az Idempotency-Key-jel már fut egy kérés', 409)
+            _in_flight.add(store_key)
+        try:
+            response = make_response(func(*args, **kwargs))
+            if response.status_code < 500 and not response.is_streamed:
+                body = zlib.compress(response.get_data(), 1)
+                if len(body) > IDEMPOTENCY_MAX_BODY:
+                    body = None
+                _responses.set(store_key, (fingerprint, body, response.status_code, response.mimetype))
+            return response
+        finally:
+            with _in_flight_lock:
+                _in_flight.discard(store_key)
+    return decorated_function
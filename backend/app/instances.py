@@ -0,0 +1,86 @@
+"""Kártya példányok - a játékos lapja egy kis sor a GM sablonjára (card_instances tábla)"""
+from app.models import db, BattleStat, Card, CardInstance
+from app.utils import generate_unique_id
+
+
+# fight_engine.make_side ebben a sorrendben várja
+SIDE_FIELDS = ('id', 'damage', 'health', 'type')
+
+
+def instance_columns():
+    """Példány oszlopok név szerint, úgy mintha teljes kártyák lennének"""
+    return {
+        'id': CardInstance.id.label('id'),
+        'owner_id': CardInstance.owner_id.label('owner_id'),
+        'world_id': CardInstance.world_id.label('world_id'),
+        'name': Card.name.label('name'),
+        'damage': (Card.damage + CardInstance.damage_bonus).label('damage'),
+        'health': (Card.health + CardInstance.health_bonus).label('health'),
+        'type': Card.type.label('type'),
+        'position': CardInstance.position.label('position'),
+        'template_id': CardInstance.template_id.label('template_id'),
+        'is_leader': Card.is_leader.label('is_leader'),
+    }
+
+
+def instance_rows(*filters, fields=SIDE_FIELDS):
+    """Oszlop-szintű példány lekérdezés (kép és ORM objektum nélkül) a sablonnal összekötve"""
+    columns = instance_columns()
+    return db.session.query(*(columns[field] for field in fields)).join(
+        Card, Card.id == CardInstance.template_id
+    ).filter(*filters)
+
+
+def hand_out(template, owner_ids):
+    """
+    A sablon kiosztása a megadott usereknek - egyetlen több soros INSERT
+
+    Visszaadja az új példányok dict-jeit (ugyanaz a forma mint a to_dict()).
+    """
+    template_dict = template.to_dict()
+    rows = [{
+        'id': generate_unique_id(),
+        'template_id': template.id,
+        'world_id': template.world_id,
+        'owner_id': owner_id,
+        'health_bonus': 0,
+        'damage_bonus': 0,
+        'position': 0,
+    } for owner_id in owner_ids]
+    if rows:
+        db.session.execute(CardInstance.__table__.insert(), rows)
+    return [dict(template_dict, id=row['id'], owner_id=row['owner_id'], template_id=template.id, position=0)
+            for row in rows]
+
+
+def owners_with(template_id, owner_ids):
+    """A megadott userek közül kinek van már példánya a sablonból"""
+    owner_ids = list(owner_ids)
+    if not owner_ids:
+        return set()
+    rows = db.session.query(CardInstance.owner_id).filter(
+        CardInstance.template_id == str(template_id),
+        CardInstance.owner_id.in_(owner_ids)
+    ).all()
+    return {owner_id for (owner_id,) in rows}
+
+
+def remove_instances(template_ids, owner_ids=None):
+    """A sablonok példányainak törlése (opcionálisan csak a megadott userektől) - törölt sorok száma"""
+    template_ids = list(template_ids)
+    if not template_ids:
+        return 0
+    query = CardInstance.query.filter(CardInstance.template_id.in_(template_ids))
+    if owner_ids is not None:
+        query = query.filter(CardInstance.owner_id.in_(list(owner_ids)))
+    return delete_rows(query)
+
+
+def delete_rows(query):
+    """Egy CardInstance query példányainak törlése a harc statisztikájukkal együtt - törölt sorok száma"""
+    BattleStat.query.filter(
+        BattleStat.world_id.in_(query.with_entities(CardInstance.world_id).distinct()),
+        BattleStat.scope == 'card',
+        BattleStat.subject_id.in_(query.with_entities(CardInstance.id)),
+    ).delete(synchronize_session=False)
+    return query.delete(synchronize_session=False)
@@ -0,0 +1,117 @@
+"""
+Lista endpointok - keyset lapozás (?limit, ?cursor) és mező szűrés (?fields)
+
+limit és cursor nélkül a teljes lista jön, mint régen (a web kliens így hívja).
+"""
+import base64
+import binascii
+import json
+
+from sqlalchemy import literal_column, tuple_
+
+from app.models import db
+
+
+MAX_LIMIT = 500
+
+
+class ListArgs:
+    """A kérés lapozás / mező paraméterei - parse() után érvényesek"""
+
+    def __init__(self, limit=None, cursor=None, fields=None):
+        self.limit = limit
+        self.cursor = cursor
+        self.fields = fields
+
+    @classmethod
+    def parse(cls, args, allowed_fields):
+        """request.args -> ListArgs, hibás értéknél ValueError (magyar üzenettel)"""
+        limit = args.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                raise ValueError('A limitnek pozitív egész számnak kell lennie')
+            if limit < 1:
+                raise ValueError('A limitnek pozitív egész számnak kell lennie')
+            limit = min(limit, MAX_LIMIT)
+        cursor = args.get('cursor')
+        if cursor:
+            cursor = decode_cursor(cursor)
+        fields = args.get('fields')
+        if fields:
+            fields = [f.strip() for f in fields.split(',') if f.strip()]
+            unknown = [f for f in fields if f not in allowed_fields]
+            if unknown:
+                raise ValueError(f'Ismeretlen mező: {", ".join(unknown)} (lehetséges: {", ".join(allowed_fields)})')
+        return cls(limit, cursor or None, fields or list(allowed_fields))
+
+
+def row_key(model):
+    """A tábla egyedi sor kulcsa a rendezés végére: SQLite-on rowid, máshol a PK oszlopai"""
+    table = model.__table__
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return (literal_column(f'{table.name}.rowid'),)
+    return tuple(table.primary_key.columns)
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise ValueError('Érvénytelen cursor')
+    if not isinstance(values, list) or not values or not all(isinstance(v, (str, int)) for v in values):
+        raise ValueError('Érvénytelen cursor')
+    return values
+
+
+def list_page(query_for, columns, list_args, keys, extras=None):
+    """
+    Egy lap a listából
+
+    query_for(*oszlopok) -> a szűrt query (join-okkal), columns: {mező: oszlop},
+    keys: az egyedi rendezési kulcs oszlopai, extras: {mező: (oszlop, betöltő)}
+    olyan mezőkre, amik a lap sorai alapján egy külön lekérdezésből jönnek
+    (betöltő: értékek -> {érték: eredmény}).
+
+    Visszaad: (elemek listája, next_cursor vagy None)
+    """
+    extras = extras or {}
+    fields = list_args.fields
+    selected = [f for f in fields if f in columns]
+    wanted_extras = [f for f in fields if f in extras]
+    query = query_for(*[columns[f] for f in selected], *[extras[f][0] for f in wanted_extras], *keys)
+    if list_args.cursor is not None:
+        if len(list_args.cursor) != len(keys):
+            raise ValueError('Érvénytelen cursor')
+        query = query.filter(tuple_(*keys) > tuple_(*list_args.cursor))
+    query = query.order_by(*keys)
+    if list_args.limit is not None:
+        query = query.limit(list_args.limit + 1)  # +1: van-e következő lap
+    rows = query.all()
+
+    next_cursor = None
+    if list_args.limit is not None and len(rows) > list_args.limit:
+        rows = rows[:list_args.limit]
+        next_cursor = encode_cursor(rows[-1][-len(keys):])
+
+    loaded = {}
+    for i, field in enumerate(wanted_extras):
+        values = {row[len(selected) + i] for row in rows if row[len(selected) + i] is not None}
+        loaded[field] = extras[field][1](values) if values else {}
+
+    position = {field: i for i, field in enumerate(selected + wanted_extras)}
+    items = []
+    for row in rows:
+        item = {}
+        for field in fields:
+            value = row[position[field]]
+            item[field] = value if field in columns else loaded[field].get(value)
+        items.append(item)
+    return items, next_cursor
@@ -0,0 +1,73 @@
+"""Világ tagságok - world_memberships tábla; tagság változásnál a user membership_version-je is nő"""
+from app.models import db, User, WorldMembership
+
+
+def world_roles(user_id):
+    """A user világai: {world_id: is_master}"""
+    rows = db.session.query(WorldMembership.world_id, WorldMembership.is_master).filter(
+        WorldMembership.user_id == str(user_id)
+    ).all()
+    return {world_id: bool(is_master) for world_id, is_master in rows}
+
+
+def get_role(user_id, world_id):
+    """None ha nem tag, különben is_master (True/False)"""
+    is_master = db.session.query(WorldMembership.is_master).filter_by(
+        user_id=str(user_id), world_id=str(world_id)
+    ).scalar()
+    return None if is_master is None else bool(is_master)
+
+
+def check_users(world_id, user_ids):
+    """
+    {user_id: (username, tag-e)} a megadott userekre - egy lekérdezés
+
+    Aki nincs a dict-ben, az nem létezik. Kiosztás előtti validáláshoz.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    rows = db.session.query(User.id, User.username, WorldMembership.user_id).outerjoin(
+        WorldMembership,
+        (WorldMembership.user_id == User.id) & (WorldMembership.world_id == str(world_id))
+    ).filter(User.id.in_(user_ids)).all()
+    return {user_id: (username, member is not None) for user_id, username, member in rows}
+
+
+def list_members(world_id):
+    """(user_id, username, is_master) a világ összes tagjára"""
+    return db.session.query(User.id, User.username, WorldMembership.is_master).join(
+        WorldMembership, WorldMembership.user_id == User.id
+    ).filter(WorldMembership.world_id == str(world_id)).order_by(User.username).all()
+
+
+def master_world_ids(user_id):
+    """Azok a világok, ahol a user game master"""
+    rows = db.session.query(WorldMembership.world_id).filter_by(user_id=str(user_id), is_master=True).all()
+    return [world_id for (world_id,) in rows]
+
+
+def add_member(user_id, world_id, is_master=False):
+    db.session.add(WorldMembership(user_id=str(user_id), world_id=str(world_id), is_master=is_master))
+    # 'evaluate': a sessionben lévő User objektum is az új verziót lássa (token claimhez)
+    User.query.filter(User.id == str(user_id)).update(
+        {User.membership_version: User.membership_version + 1}, synchronize_session='evaluate'
+    )
+
+
+def remove_world(world_id):
+    """A világ összes tagságának törlése - visszaadja az érintett user ID-kat"""
+    members = db.session.query(WorldMembership.user_id).filter(WorldMembership.world_id == str(world_id))
+    user_ids = [user_id for (user_id,) in members.all()]
+    if user_ids:
+        # egyetlen UPDATE + DELETE, akárhány tag van
+        User.query.filter(User.id.in_(members)).update(
+            {User.membership_version: User.membership_version + 1}, synchronize_session=False
+        )
+        WorldMembership.query.filter_by(world_id=str(world_id)).delete(synchronize_session=False)
+    return user_ids
+
+
+def remove_user(user_id):
+    """A user összes tagságának törlése (fiók törlésnél)"""
+    WorldMembership.query.filter_by(user_id=str(user_id)).delete(synchronize_session=False)
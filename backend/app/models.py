@@ -6,6 +6,11 @@ db = SQLAlchemy()
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # email megerősítés / jelszó reset linkek token alapján keresnek
+        db.Index('ix_users_verification_token', 'verification_token'),
+        db.Index('ix_users_password_reset_token', 'password_reset_token'),
+    )
     
     # Egyedi 32 karakteres ID minden userhez
     id = db.Column(db.String(32), primary_key=True, unique=True, nullable=False)
@@ -13,10 +18,12 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)  # bcrypt hash
     
-    # Világok, amikben részt vesz - JSON, mert dict-et tárolunk
-    # Formátum: {"world_id": True/False} - True = game master
-    world_ids = db.Column(db.JSON, nullable=True, default=list)
+    # Régi tagság tároló ({"world_id": True/False} JSON) - már csak a migráció olvassa,
+    # a tagság a world_memberships táblában van (lásd world_ids property)
+    legacy_world_ids = db.Column('world_ids', db.JSON, nullable=True)
     settings = db.Column(db.JSON, nullable=True, default=dict)  # user beállítások
+    # Tagság változásonként nő - a tokenben lévő tagság claim ehhez képest elavult-e
+    membership_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Email verifikáció - ha be van kapcsolva
     email_verified = db.Column(db.Boolean, default=False, nullable=False)
@@ -33,6 +40,12 @@ class User(db.Model):
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
+    @property
+    def world_ids(self):
+        """Világok, amikben részt vesz: {world_id: is_master} - True = game master"""
+        from app.memberships import world_roles
+        return world_roles(self.id)
+    
     def to_dict(self):
         """JSON serialization - érzékeny adatok nélkül"""
         return {
@@ -49,27 +62,64 @@ class User(db.Model):
         return f'<User {self.username}>'
 
 
+class WorldMembership(db.Model):
+    __tablename__ = 'world_memberships'
+    __table_args__ = (
+        # user_id szerint a PK eleje keres, world_id szerint ez az index
+        db.Index('ix_world_memberships_world_id', 'world_id', 'is_master'),
+    )
+
+    user_id = db.Column(db.String(32), primary_key=True)
+    world_id = db.Column(db.String(32), primary_key=True)
+    is_master = db.Column(db.Boolean, nullable=False, default=False)
+
+    def __repr__(self):
+        return f'<WorldMembership {self.user_id} {self.world_id} {self.is_master}>'
+
+
 class Card(db.Model):
+    # A GM által létrehozott kártya (sablon) - a játékosok példányai a card_instances-ben vannak
     __tablename__ = 'cards'
+    __table_args__ = (
+        # a GM lapjai egy világban - az owner_id önmagában is ezt használja
+        db.Index('ix_cards_owner_world_position', 'owner_id', 'world_id', 'position'),
+        # név egyediség világon belül, világ szintű listák
+        db.Index('ix_cards_world_name', 'world_id', 'name'),
+        # vezér lapok az eredeti lap ID-ja alapján
+        db.Index('ix_cards_is_leader', 'is_leader'),
+        # kép törlésnél: hivatkozik-e még rá kártya
+        db.Index('ix_cards_picture_hash', 'picture_hash'),
+    )
 
     id = db.Column(db.String(32), primary_key=True, unique=True, nullable=False)
     world_id = db.Column(db.String(32), nullable=False)  # melyik világban létezik
-    owner_id = db.Column(db.String(32), nullable=False)  # kié a kártya
+    owner_id = db.Column(db.String(32), nullable=False)  # a GM, aki létrehozta
     name = db.Column(db.String(16), nullable=False)
-    picture = db.Column(db.LargeBinary, nullable=True)  # base64 string binaryként tárolva
+    picture_hash = db.Column(db.String(64), nullable=True)  # card_pictures.hash, a másolatok közösen használják
+    # Régi kép oszlop (base64 string binaryként) - csak a migráció olvassa, utána üres
+    legacy_picture = db.deferred(db.Column('picture', db.LargeBinary, nullable=True))
     health = db.Column(db.Integer, nullable=False)  # életerő
     damage = db.Column(db.Integer, nullable=False)  # sebzés
     type = db.Column(db.String(6), nullable=False)  # t/f/v/l - tűz/föld/víz/levegő
-    position = db.Column(db.Integer, nullable=False)  # pozíció a pakliban (0 = nincs pakliban)
+    position = db.Column(db.Integer, nullable=False)  # sablonnál 0 - a pakli a card_instances-ben van
     is_leader = db.Column(db.String(32), nullable=False)  # ha vezér, akkor az eredeti kártya ID-ja, különben ""
 
+    stored_picture = db.relationship(
+        'CardPicture', primaryjoin='foreign(Card.picture_hash) == CardPicture.hash', viewonly=True
+    )
+
+    @property
+    def picture(self):
+        """A kép eredeti (data URL) formában, None ha nincs"""
+        return self.stored_picture.to_data_url() if self.stored_picture else None
+
     def to_dict(self):
         return {
             'id': self.id,
             'world_id': self.world_id,
             'owner_id': self.owner_id,
             'name': self.name,
-            'picture': self.picture.decode('utf-8') if self.picture else None,
+            'picture': self.picture,
             'health': self.health,
             'damage': self.damage,
             'type': self.type,
@@ -81,11 +131,106 @@ class Card(db.Model):
         return f'<Card {self.name} - World {self.world_id}>'
 
 
+class CardInstance(db.Model):
+    __tablename__ = 'card_instances'
+    __table_args__ = (
+        # user lapjai egy világban, pakli (position > 0)
+        db.Index('ix_card_instances_owner_world_position', 'owner_id', 'world_id', 'position'),
+        # sablon törlés / kiosztás ellenőrzés: kinek van már meg
+        db.Index('ix_card_instances_template_owner', 'template_id', 'owner_id'),
+        # világ törlés, balansz riport (minden pakli egy világban)
+        db.Index('ix_card_instances_world_position', 'world_id', 'position'),
+    )
+
+    # Egy játékos példánya egy GM kártyából (sablon) - csak ami játékosonként más
+    id = db.Column(db.String(32), primary_key=True)
+    template_id = db.Column(db.String(32), nullable=False)  # cards.id
+    world_id = db.Column(db.String(32), nullable=False)  # a sablon világa
+    owner_id = db.Column(db.String(32), nullable=False)  # kié a példány
+    health_bonus = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # harc fejlesztések
+    damage_bonus = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    position = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # pakli pozíció (0 = nincs)
+
+    template = db.relationship(
+        'Card', primaryjoin='foreign(CardInstance.template_id) == Card.id', viewonly=True, lazy='joined'
+    )
+
+    @property
+    def name(self):
+        return self.template.name
+
+    @property
+    def type(self):
+        return self.template.type
+
+    @property
+    def is_leader(self):
+        return self.template.is_leader
+
+    @property
+    def picture_hash(self):
+        return self.template.picture_hash
+
+    @property
+    def picture(self):
+        return self.template.picture
+
+    @property
+    def health(self):
+        return self.template.health + self.health_bonus
+
+    @property
+    def damage(self):
+        return self.template.damage + self.damage_bonus
+
+    def to_dict(self, pictures=None):
+        """
+        Ugyanaz a forma, mint a Card.to_dict() - a kliensnek nem kell tudnia a különbségről
+
+        pictures: előre betöltött {hash: data URL} (get_pictures), különben lapanként lekérdezi
+        """
+        return {
+            'id': self.id,
+            'world_id': self.world_id,
+            'owner_id': self.owner_id,
+            'template_id': self.template_id,
+            'name': self.name,
+            'picture': self.picture if pictures is None else pictures.get(self.picture_hash),
+            'health': self.health,
+            'damage': self.damage,
+            'type': self.type,
+            'position': self.position,
+            'is_leader': self.is_leader,
+        }
+
+    def __repr__(self):
+        return f'<CardInstance {self.template_id} - Owner {self.owner_id}>'
+
+
+class CardPicture(db.Model):
+    __tablename__ = 'card_pictures'
+
+    # Tartalom szerint címzett: ugyanaz a kép egyszer van tárolva, akárhány kártya használja
+    hash = db.Column(db.String(64), primary_key=True)  # sha256 (mime + nyers bájtok)
+    mime = db.Column(db.String(100), nullable=True)  # None = nem data URL volt, a data maga a szöveg
+    data = db.Column(db.LargeBinary, nullable=False)  # dekódolt, nyers bájtok
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def to_data_url(self):
+        from app.pictures import decode_picture
+        return decode_picture(self.mime, self.data)
+
+    def __repr__(self):
+        return f'<CardPicture {self.hash[:12]} {self.mime} {len(self.data)} B>'
+
+
 class World(db.Model):
     __tablename__ = 'worlds'
 
     world_id = db.Column(db.String(32), primary_key=True, unique=True, nullable=False)
     name = db.Column(db.String(120), nullable=False)  # a világ neve
+    # kazamata snapshot érvénytelenítéshez (dungeon_cache.py) - minden érintő változásnál nő
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     def to_dict(self):
         return {
@@ -97,21 +242,133 @@ class World(db.Model):
         return f'<World {self.name}>'
 
 
+class WorldDeletion(db.Model):
+    __tablename__ = 'world_deletions'
+
+    # Háttérben, darabokban törlődő világok (world_deletion.py) - a World sor már nincs meg
+    world_id = db.Column(db.String(32), primary_key=True)
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<WorldDeletion {self.world_id}>'
+
+
 class Dungeon(db.Model):
     __tablename__ = 'dungeons'
+    __table_args__ = (
+        db.Index('ix_dungeons_world_id', 'world_id'),
+    )
     
     id = db.Column(db.String(32), primary_key=True, unique=True, nullable=False)
     name = db.Column(db.String(120), nullable=False)
     world_id = db.Column(db.String(32), nullable=False)  # melyik világhoz tartozik
-    list_of_card_ids = db.Column(db.JSON, nullable=True, default=list)  # kártya ID lista
+    # Régi kártya ID lista (JSON) - már csak a migráció olvassa, a lapok a dungeon_cards táblában vannak
+    legacy_card_ids = db.Column('list_of_card_ids', db.JSON, nullable=True)
     
-    def to_dict(self):
+    @property
+    def list_of_card_ids(self):
+        """A kazamata lapjai harc sorrendben"""
+        from app.dungeon_cards import card_ids
+        return card_ids(self.id)
+    
+    def to_dict(self, card_ids=None):
+        """card_ids: előre betöltött lista (card_ids_by_dungeon), különben lekérdezi"""
         return {
             'id': self.id,
             'name': self.name,
             'world_id': self.world_id,
-            'list_of_card_ids': self.list_of_card_ids,
+            'list_of_card_ids': self.list_of_card_ids if card_ids is None else card_ids,
         }
     
     def __repr__(self):
         return f'<Dungeon {self.name} - World {self.world_id}>'
+
+
+class DungeonCard(db.Model):
+    __tablename__ = 'dungeon_cards'
+    __table_args__ = (
+        # kártya törlésnél: melyik kazamatákban van
+        db.Index('ix_dungeon_cards_card_id', 'card_id'),
+    )
+
+    dungeon_id = db.Column(db.String(32), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)  # harc sorrend, 1-től
+    card_id = db.Column(db.String(32), nullable=False)  # cards.id (GM sablon)
+
+    def __repr__(self):
+        return f'<DungeonCard {self.dungeon_id} #{self.position} {self.card_id}>'
+
+
+class BattleLog(db.Model):
+    __tablename__ = 'battle_log'
+    __table_args__ = (
+        # világ törlésnél
+        db.Index('ix_battle_log_world_id', 'world_id'),
+    )
+
+    # Csak hozzáfűzünk, soha nem módosítjuk
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.String(32), nullable=False)
+    world_id = db.Column(db.String(32), nullable=False)
+    dungeon_id = db.Column(db.String(32), nullable=False)
+    outcomes = db.Column(db.String(6), nullable=False)  # pozíciónként p/d, pl. "pdpp"
+    winner = db.Column(db.String(8), nullable=False)  # player/dungeon
+    upgrade_type = db.Column(db.String(8), nullable=True)  # damage/health ha volt fejlesztés
+    upgrade_amount = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'world_id': self.world_id,
+            'dungeon_id': self.dungeon_id,
+            'outcomes': self.outcomes,
+            'winner': self.winner,
+            'upgrade_type': self.upgrade_type,
+            'upgrade_amount': self.upgrade_amount,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+    def __repr__(self):
+        return f'<BattleLog {self.user_id} vs {self.dungeon_id}>'
+
+
+class BattleStat(db.Model):
+    __tablename__ = 'battle_stats'
+
+    # Inkrementálisan karbantartott számlálók a battle_log mellé
+    # scope: dungeon / card / user, subject_id: az adott dolog ID-ja
+    world_id = db.Column(db.String(32), primary_key=True)
+    scope = db.Column(db.String(8), primary_key=True)
+    subject_id = db.Column(db.String(32), primary_key=True)
+    fights = db.Column(db.Integer, nullable=False, default=0)  # kártyánál: párosítások száma
+    wins = db.Column(db.Integer, nullable=False, default=0)  # a játékos győzelmei
+
+    def to_dict(self):
+        return {
+            'subject_id': self.subject_id,
+            'fights': self.fights,
+            'wins': self.wins,
+            'win_rate': self.wins / self.fights if self.fights else None
+        }
+
+    def __repr__(self):
+        return f'<BattleStat {self.scope} {self.subject_id}>'
+
+
+class FightEpoch(db.Model):
+    __tablename__ = 'fight_epochs'
+    __table_args__ = (
+        # világ törlésnél - user szerint a PK eleje keres
+        db.Index('ix_fight_epochs_world_id', 'world_id'),
+    )
+
+    # Harc számláló user + világ párosra - minden harc után nő,
+    # ebből számoljuk determinisztikusan a felajánlott kazamatákat
+    user_id = db.Column(db.String(32), primary_key=True)
+    world_id = db.Column(db.String(32), primary_key=True)
+    epoch = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<FightEpoch {self.user_id} {self.world_id} {self.epoch}>'
@@ -0,0 +1,107 @@
+"""
+Jelszó hash-elés külön, korlátos szálkészleten - teli sornál PasswordBusy (503)
+
+Config: BCRYPT_ROUNDS, PASSWORD_WORKERS (0 = a request szálon), PASSWORD_QUEUE_LIMIT
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+DEFAULT_BCRYPT_ROUNDS = 12
+
+
+class PasswordBusy(Exception):
+    """Tele van a jelszó sor - retry_after másodperc múlva érdemes újra próbálni"""
+
+    def __init__(self, retry_after):
+        super().__init__('A jelszó feldolgozás túlterhelt')
+        self.retry_after = retry_after
+
+
+def hash_rounds(password_hash):
+    """A bcrypt hash költsége ('$2b$12$...' -> 12), None ha nem értelmezhető"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+
+    def __init__(self):
+        self.rounds = DEFAULT_BCRYPT_ROUNDS
+        self.workers = 0
+        self.queue_limit = 0
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._avg_seconds = 0.25  # mozgó átlag, a Retry-After becsléséhez
+        self.completed = 0
+        self.rejected = 0
+
+    def init_app(self, app):
+        self.rounds = int(app.config.get('BCRYPT_ROUNDS') or DEFAULT_BCRYPT_ROUNDS)
+        workers = app.config.get('PASSWORD_WORKERS')
+        self.workers = max(1, (os.cpu_count() or 2) // 2) if workers is None else int(workers)
+        self.queue_limit = int(app.config.get('PASSWORD_QUEUE_LIMIT') or max(1, self.workers) * 8)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt') \
+            if self.workers > 0 else None
+
+    def hash(self, password):
+        rounds = self.rounds
+        return self._run(
+            lambda: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+        )
+
+    def verify(self, password, password_hash):
+        return self._run(lambda: bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8')))
+
+    def needs_rehash(self, password_hash):
+        """Más költséggel készült-e a hash, mint a mostani BCRYPT_ROUNDS"""
+        return hash_rounds(password_hash) != self.rounds
+
+    def _run(self, work):
+        if self._executor is None:
+            return self._timed(work)
+
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                self.rejected += 1
+                # a sor kiürüléséhez kb. ennyi idő kell
+                raise PasswordBusy(self._pending * self._avg_seconds / self.workers)
+            self._pending += 1
+        try:
+            return self._executor.submit(self._timed, work).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _timed(self, work):
+        start = time.perf_counter()
+        result = work()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._avg_seconds = self._avg_seconds * 0.9 + elapsed * 0.1
+            self.completed += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rounds': self.rounds,
+                'workers': self.workers,
+                'queue_limit': self.queue_limit,
+                'pending': self._pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_seconds': round(self._avg_seconds, 4),
+            }
+
+
+password_hasher = PasswordHasher()
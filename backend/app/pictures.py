@@ -0,0 +1,101 @@
+"""
+Kártya képek - tartalom (sha256) szerint címzett card_pictures tábla
+
+Új kép upserttel kerül be a kártya tranzakciójában, így egy közben futó
+release_pictures nem törölheti ki a commit előtt.
+"""
+import base64
+import binascii
+import hashlib
+
+from sqlalchemy import exists
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.models import db, Card, CardPicture
+
+
+def encode_picture(value):
+    """data URL string -> (mime, nyers bájtok)"""
+    header, sep, payload = value.partition(',')
+    if sep and header.startswith('data:') and header.endswith(';base64'):
+        try:
+            raw = base64.b64decode(payload, validate=True)
+        except (binascii.Error, ValueError):
+            raw = None
+        # csak ha pontosan ugyanaz a string jön vissza (padding, sortörés)
+        if raw is not None and base64.b64encode(raw).decode('ascii') == payload:
+            return header[len('data:'):-len(';base64')], raw
+    return None, value.encode('utf-8')
+
+
+def decode_picture(mime, data):
+    """(mime, nyers bájtok) -> az eredeti string"""
+    if mime is None:
+        return data.decode('utf-8')
+    return f'data:{mime};base64,' + base64.b64encode(data).decode('ascii')
+
+
+def picture_hash(mime, data):
+    return hashlib.sha256((mime or '').encode('utf-8') + b'\n' + data).hexdigest()
+
+
+def store_picture(value):
+    """Kép eltárolása (ha még nincs) - visszaadja a hash-t, None ha nincs kép"""
+    if not isinstance(value, str) or not value:
+        return None
+    mime, data = encode_picture(value)
+    digest = picture_hash(mime, data)
+    insert_pictures([{'hash': digest, 'mime': mime, 'data': data}])
+    return digest
+
+
+def insert_pictures(rows):
+    """
+    Képek beszúrása, a már meglévők érintetlenül maradnak - azonnal fut, nem flush-kor
+
+    PostgreSQL-en a meglévő sort is zárolja (DO UPDATE), hogy egy párhuzamos
+    release_pictures a commitunkig ne törölhesse.
+    """
+    if not rows:
+        return
+    dialect = db.session.get_bind().dialect.name
+    table = CardPicture.__table__
+    if dialect == 'sqlite':
+        statement = sqlite.insert(table).on_conflict_do_nothing(index_elements=['hash'])
+    elif dialect == 'postgresql':
+        statement = postgresql.insert(table)
+        statement = statement.on_conflict_do_update(index_elements=['hash'], set_={'hash': statement.excluded.hash})
+    else:
+        raise NotImplementedError(f'A kép upsert nincs megírva ehhez az adatbázishoz: {dialect}')
+    db.session.execute(statement, rows)
+
+
+def get_pictures(hashes):
+    """{hash: data URL} a megadott hash-ekre, egy lekérdezéssel"""
+    hashes = {h for h in hashes if h}
+    if not hashes:
+        return {}
+    rows = db.session.query(CardPicture.hash, CardPicture.mime, CardPicture.data).filter(
+        CardPicture.hash.in_(hashes)
+    ).all()
+    return {digest: decode_picture(mime, data) for digest, mime, data in rows}
+
+
+def picture_hashes(query):
+    """Egy Card query kártyáinak kép hash-ei - törlés előtt kell lekérni"""
+    rows = query.with_entities(Card.picture_hash).filter(Card.picture_hash.isnot(None)).distinct()
+    return {digest for (digest,) in rows}
+
+
+def release_pictures(hashes):
+    """
+    A megadott képek közül azok törlése, amikre már egy kártya sem hivatkozik
+
+    A kártyák törlése után, ugyanabban a tranzakcióban kell hívni.
+    """
+    hashes = {h for h in hashes if h}
+    if not hashes:
+        return 0
+    db.session.flush()
+    unused = ~exists().where(Card.picture_hash == CardPicture.hash)
+    return CardPicture.query.filter(CardPicture.hash.in_(hashes), unused).delete(synchronize_session=False)
@@ -0,0 +1,138 @@
+"""
+Bejelentkezett user (principal) cache a require_auth-hoz
+
+Változás után invalidate_principal kell; más folyamatban legfeljebb
+PRINCIPAL_CACHE_TTL-ig elavult. Tagság claimes tokennél (wm, mv) csak a
+verziót egyeztetjük.
+"""
+import threading
+from collections import namedtuple
+
+from app.cache import BoundedCache
+
+
+PRINCIPAL_CACHE_SIZE = 10000
+PRINCIPAL_CACHE_TTL = 30  # másodperc
+TOKEN_MAX_WORLDS = 64  # ennél több világnál nem tesszük a tokenbe, túl nagy lenne
+
+
+Principal = namedtuple('Principal', ['id', 'username', 'world_ids', 'membership_version'])
+Principal.__doc__ = """
+Bejelentkezett user könnyű változata - csak olvasásra
+    world_ids - {world_id: is_master} mint a User.world_ids
+Ha a teljes sor kell (email, beállítások, módosítás), load_current_user().
+"""
+
+_principals = BoundedCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+_versions = BoundedCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+_lock = threading.Lock()
+_generation = 0  # minden érvénytelenítésnél nő
+
+
+def _load_principal(user_id):
+    from app.memberships import world_roles
+    from app.models import db, User
+
+    row = db.session.query(
+        User.id, User.username, User.membership_version
+    ).filter(User.id == str(user_id)).first()
+    if not row:
+        return None
+    return Principal(id=row.id, username=row.username, world_ids=world_roles(row.id),
+                     membership_version=row.membership_version or 0)
+
+
+def get_principal(user_id):
+    """Principal user id alapján, None ha nincs ilyen user"""
+    user_id = str(user_id)
+    principal = _principals.get(user_id)
+    if principal is not None:
+        return principal
+
+    generation = _generation
+    principal = _load_principal(user_id)
+    # Ha betöltés közben volt érvénytelenítés, nem tesszük el (lehet elavult)
+    if principal is not None and generation == _generation:
+        _principals.set(user_id, principal)
+    return principal
+
+
+def get_membership_version(user_id):
+    """A user aktuális tagság verziója, None ha nincs ilyen user"""
+    from app.models import db, User
+
+    user_id = str(user_id)
+    version = _versions.get(user_id)
+    if version is not None:
+        return version
+
+    generation = _generation
+    version = db.session.query(User.membership_version).filter(User.id == user_id).scalar()
+    if version is None:
+        return None
+    if generation == _generation:
+        _versions.set(user_id, version)
+    return version
+
+
+def membership_claims(user):
+    """
+    Token claimek a user tagságaiból (User vagy Principal)
+
+    None, ha ki van kapcsolva (TOKEN_MEMBERSHIP_CLAIMS) vagy túl sok a világ.
+    """
+    from flask import current_app
+
+    if not current_app.config.get('TOKEN_MEMBERSHIP_CLAIMS'):
+        return None
+    world_ids = user.world_ids if isinstance(user.world_ids, dict) else {}
+    if len(world_ids) > TOKEN_MAX_WORLDS:
+        return None
+    return {
+        'un': user.username,
+        'wm': {world_id: 1 if is_master is True else 0 for world_id, is_master in world_ids.items()},
+        'mv': user.membership_version or 0,
+    }
+
+
+def principal_from_token(payload):
+    """
+    Principal egy dekódolt token alapján
+
+    Visszaad: (principal vagy None, elavult-e a token tagság claimje)
+    """
+    user_id = str(payload['user_id'])
+    if 'mv' not in payload:
+        return get_principal(user_id), False
+
+    version = get_membership_version(user_id)
+    if version is None:
+        return None, False
+    if version == payload['mv']:
+        return Principal(
+            id=user_id,
+            username=payload.get('un'),
+            world_ids={world_id: master == 1 for world_id, master in payload.get('wm', {}).items()},
+            membership_version=version
+        ), False
+
+    principal = get_principal(user_id)
+    if principal is not None and principal.membership_version != version:
+        # a cache-elt principal is régebbi (másik worker változtatott)
+        invalidate_principal(user_id)
+        principal = get_principal(user_id)
+    return principal, True
+
+
+def invalidate_principal(*user_ids):
+    """A megadott userek kidobása - commit után kell hívni"""
+    global _generation
+    with _lock:
+        _generation += 1
+        for user_id in user_ids:
+            _principals.pop(str(user_id))
+            _versions.pop(str(user_id))
+
+
+def cache_stats():
+    return {'principals': _principals.stats(), 'membership_versions': _versions.stats()}
@@ -0,0 +1,437 @@
+"""
+Rate limiting - token bucket, cserélhető háttértárral (RATELIMIT_BACKEND: memory, sqlite, shm)
+
+Endpointonként saját policy (RATE_LIMIT_POLICIES); a drága endpointok költsége
+egy kliensenkénti közös CPU kvótából is fogy. Egy kérés vödreiből a háttértár
+vagy mindből levon, vagy egyikből sem.
+"""
+import abc
+import contextlib
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import request, current_app
+
+from app.utils import error_response, decode_token
+
+
+RATE_LIMIT_WINDOW = 10  # 10 másodperc
+RATE_LIMIT_MAX = 5  # max 5 kérés per window
+
+Policy = namedtuple('Policy', ['limit', 'window', 'burst', 'key', 'cost'], defaults=(None, 'ip', 0))
+Policy.__doc__ = """
+Endpoint limit
+    limit / window - ennyi kérés ennyi másodperc alatt (feltöltési sebesség)
+    burst - egyszerre max ennyi mehet át (vödör mérete), None = limit
+    key - 'ip', 'user' (token alapján, ha nincs token akkor IP) vagy 'ip_user'
+    cost - ennyi egység fogy a CPU kvótából, lehet függvény is (request -> szám)
+"""
+
+DEFAULT_POLICY = Policy(RATE_LIMIT_MAX, RATE_LIMIT_WINDOW, key='ip', cost=1)
+
+# Kliensenkénti közös kvóta a drága munkára (cost egységben)
+CPU_QUOTA = Policy(120, 60, burst=40)
+
+
+def _json_list_cost(single_field, list_field, base=1):
+    """Költség = base + ahány címzettnek másolatot készítünk"""
+    def cost(req):
+        data = req.get_json(silent=True)
+        if not isinstance(data, dict):
+            return base
+        if isinstance(data.get(single_field), str) and data[single_field].strip():
+            return base + 1
+        targets = data.get(list_field)
+        return base + (len(targets) if isinstance(targets, list) else 0)
+    return cost
+
+
+# Endpoint név -> policy, ami nincs itt az DEFAULT_POLICY-t kapja
+RATE_LIMIT_POLICIES = {
+    # olcsó olvasások - a kliens ezeket pollozza
+    'api.health_check': Policy(120, 60, burst=20, key='ip'),
+    'api.get_user': Policy(60, 60, burst=15, key='user'),
+    'api.is_master': Policy(60, 60, burst=15, key='user'),
+    'api.list_user_worlds': Policy(60, 60, burst=15, key='user'),
+    'api.get_game_dungeon': Policy(60, 60, burst=15, key='user'),
+    'api.list_world_dungeons': Policy(60, 60, burst=15, key='user'),
+    'api.list_world_users': Policy(60, 60, burst=15, key='user'),
+    'api.user_stats': Policy(60, 60, burst=15, key='user'),
+    'api.world_stats': Policy(60, 60, burst=15, key='user'),
+    'api.get_card_picture': Policy(120, 60, burst=40, key='user'),
+    'api.list_world_cards': Policy(30, 60, burst=10, key='user', cost=1),
+    'api.list_user_cards': Policy(30, 60, burst=10, key='user', cost=1),
+    # bcrypt - IP-hez kötve, mert itt még nincs token
+    'api.login': Policy(10, 60, burst=5, key='ip', cost=8),
+    'api.register': Policy(5, 300, burst=3, key='ip', cost=8),
+    'api.reset_password': Policy(5, 300, burst=3, key='ip', cost=8),
+    'api.delete_account': Policy(3, 60, burst=2, key='ip_user', cost=8),
+    # email küldés
+    'api.request_password_reset': Policy(3, 300, burst=2, key='ip', cost=2),
+    'api.resend_verification': Policy(3, 300, burst=2, key='ip', cost=2),
+    'api.verify_email': Policy(10, 300, burst=5, key='ip'),
+    # címzettenként egy másolat
+    'api.create_card': Policy(20, 60, burst=10, key='user', cost=_json_list_cost('give_to_user_id', 'give_to_user_ids')),
+    'api.add_card_to_user': Policy(20, 60, burst=10, key='user', cost=_json_list_cost('user_id', 'user_ids', base=0)),
+    # játék
+    'api.fight': Policy(5, 10, key='user', cost=1),
+    'api.simulate_fights': Policy(10, 60, burst=5, key='user', cost=5),
+    'api.optimize_deck': Policy(10, 60, burst=5, key='user', cost=5),
+    'api.world_balance_report': Policy(3, 60, burst=2, key='user', cost=20),
+    # világ mentés / betöltés - soronként sok adat
+    'api.export_world': Policy(5, 60, burst=2, key='user', cost=10),
+    'api.import_world': Policy(3, 60, burst=2, key='user', cost=20),
+    'api.clone_world': Policy(3, 60, burst=2, key='user', cost=10),
+}
+
+
+def _refill(tokens, updated, now, capacity, rate):
+    """Vödör feltöltése az eltelt idővel, capacity-nél nem több"""
+    if now > updated:
+        tokens = min(capacity, tokens + (now - updated) * rate)
+    return tokens
+
+
+def _take(tokens, capacity, rate, cost):
+    """(engedélyezve, új token szám, ennyi mp múlva próbálkozzon)"""
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    return False, tokens, (min(cost, capacity) - tokens) / rate
+
+
+class RateLimitBackend(abc.ABC):
+    """Háttértár interfész - egy kérés elszámolása a vödrein"""
+
+    @abc.abstractmethod
+    def hit(self, buckets, now=None):
+        """
+        buckets: [(kulcs, capacity, rate, cost)] - vagy mindből levon, vagy egyikből sem
+
+        Visszaad: (az első elutasító vödör indexe vagy None, retry_after másodperc)
+        """
+
+
+class MemoryBackend(RateLimitBackend):
+    """
+    Folyamaton belüli tár
+
+    A kulcsok shardokra vannak osztva, mindegyiknek saját lockja van, így a
+    szálak ritkán várnak egymásra. Shardonként LRU sorrend: ha a legrégebben
+    használt kulcs vödre már tele lenne, az a kulcs nem hordoz információt,
+    kidobjuk. Shardonként max_keys felett a legrégebbi mindenképp kiesik.
+    """
+
+    def __init__(self, shards=16, max_keys=100000):
+        self._shards = [(OrderedDict(), threading.Lock()) for _ in range(shards)]
+        self._max_keys_per_shard = max(1, max_keys // shards)
+
+    def hit(self, buckets, now=None):
+        now = time.time() if now is None else now
+        shards = [zlib.crc32(key.encode('utf-8')) % len(self._shards) for key, _, _, _ in buckets]
+        with contextlib.ExitStack() as stack:
+            for shard in sorted(set(shards)):  # mindig ugyanabban a sorrendben, így nincs deadlock
+                stack.enter_context(self._shards[shard][1])
+            taken = []
+            for i, ((key, capacity, rate, cost), shard) in enumerate(zip(buckets, shards)):
+                state = self._shards[shard][0].get(key)
+                tokens = capacity if state is None else _refill(state[0], state[1], now, capacity, rate)
+                allowed, tokens, retry_after = _take(tokens, capacity, rate, cost)
+                if not allowed:
+                    return i, retry_after
+                taken.append(tokens)
+            for (key, capacity, rate, _), shard, tokens in zip(buckets, shards, taken):
+                states = self._shards[shard][0]
+                states[key] = (tokens, now, now + (capacity - tokens) / rate)
+                states.move_to_end(key)
+                self._evict(states, now)
+        return None, 0.0
+
+    def _evict(self, buckets, now):
+        while buckets:
+            oldest_key, (_, _, full_at) = next(iter(buckets.items()))
+            if full_at > now and len(buckets) <= self._max_keys_per_shard:
+                break
+            del buckets[oldest_key]
+
+    def __len__(self):
+        return sum(len(buckets) for buckets, _ in self._shards)
+
+
+class SQLiteBackend(RateLimitBackend):
+    """
+    SQLite fájl alapú tár - több worker folyamat ugyanazt a limitet látja
+
+    Kérésenként egy rövid BEGIN IMMEDIATE tranzakció. A tétlen kulcsokat
+    időnként egy DELETE takarítja.
+    """
+
+    _SWEEP_EVERY = 1000  # ennyi kérésenként takarítunk
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._hits = 0
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS rate_limits ('
+                'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_rate_limits_full_at ON rate_limits (full_at)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')  # elvesző limit állapot nem baj
+            self._local.conn = conn
+        return conn
+
+    def hit(self, buckets, now=None):
+        now = time.time() if now is None else now
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = []
+            for i, (key, capacity, rate, cost) in enumerate(buckets):
+                row = conn.execute('SELECT tokens, updated FROM rate_limits WHERE key = ?', (key,)).fetchone()
+                tokens = capacity if row is None else _refill(row[0], row[1], now, capacity, rate)
+                allowed, tokens, retry_after = _take(tokens, capacity, rate, cost)
+                if not allowed:
+                    conn.execute('ROLLBACK')
+                    return i, retry_after
+                rows.append((key, tokens, now, now + (capacity - tokens) / rate))
+            conn.executemany(
+                'INSERT OR REPLACE INTO rate_limits (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)', rows
+            )
+            self._hits += 1
+            if self._hits % self._SWEEP_EVERY == 0:
+                conn.execute('DELETE FROM rate_limits WHERE full_at <= ?', (now,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return None, 0.0
+
+
+class SharedMemoryBackend(RateLimitBackend):
+    """
+    Memóriába mappelt fájl fix számú slottal - több folyamat közösen
+
+    Slot: (kulcs hash, tokenek, utolsó frissítés, tele lesz ekkor) = 32 byte.
+    A slotok csíkokra (stripe) vannak osztva, egy kulcs csak a saját csíkján
+    belül keres helyet (max PROBES lépés). Egy csíkot folyamaton belül
+    threading.Lock, folyamatok között fcntl bájt-tartomány zár véd.
+    Tétlen (már tele vödrű) slotot más kulcs átvehet. Ha minden próbált slot
+    foglalt, a kulcs az első slot tulajdonosával közös vödröt használ (a slot
+    a tulajdonosé marad) - ez legfeljebb szigorúbb limit.
+    """
+
+    _SLOT = struct.Struct('<Qddd')
+    _PROBES = 8
+
+    def __init__(self, path, slots=65536, stripes=64):
+        import fcntl  # csak Unix-on van, ezért itt importáljuk
+        self._fcntl = fcntl
+        self.path = path
+        self.stripes = stripes
+        self.slots_per_stripe = max(self._PROBES, slots // stripes)
+        size = self._SLOT.size * self.slots_per_stripe * stripes
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def hit(self, buckets, now=None):
+        now = time.time() if now is None else now
+        stripe_bytes = self._SLOT.size * self.slots_per_stripe
+        hashes = []
+        for key, _, _, _ in buckets:
+            digest = zlib.crc32(key.encode('utf-8')) | (zlib.adler32(key.encode('utf-8')) << 32)
+            hashes.append(digest or 1)  # a 0 az üres slot jele
+
+        with contextlib.ExitStack() as stack:
+            for stripe in sorted({key_hash % self.stripes for key_hash in hashes}):
+                stack.enter_context(self._locks[stripe])
+                self._fcntl.lockf(self._fd, self._fcntl.LOCK_EX, stripe_bytes, stripe * stripe_bytes, os.SEEK_SET)
+                stack.callback(self._fcntl.lockf, self._fd, self._fcntl.LOCK_UN, stripe_bytes,
+                               stripe * stripe_bytes, os.SEEK_SET)
+            pending = {}  # slot offset -> új állapot, a végén írjuk ki, ha minden vödör enged
+            for i, ((_, capacity, rate, cost), key_hash) in enumerate(zip(buckets, hashes)):
+                base = (key_hash % self.stripes) * stripe_bytes
+                start = (key_hash // self.stripes) % self.slots_per_stripe
+                offset, state = self._find_slot(base, start, key_hash, now, pending)
+                if state is None:
+                    owner, tokens = key_hash, capacity
+                else:
+                    owner, tokens = state[0], _refill(state[1], state[2], now, capacity, rate)
+                allowed, tokens, retry_after = _take(tokens, capacity, rate, cost)
+                if not allowed:
+                    return i, retry_after
+                pending[offset] = (owner, tokens, now, now + (capacity - tokens) / rate)
+            for offset, state in pending.items():
+                self._SLOT.pack_into(self._map, offset, *state)
+        return None, 0.0
+
+    def _find_slot(self, base, start, key_hash, now, pending):
+        """
+        (slot offset, meglévő állapot vagy None ha új) - a pending a még ki nem írt slotok
+
+        Ha nincs se saját, se szabad slot, az első slot állapota jön vissza a
+        tulajdonosa hash-ével, így a hívó nem veszi el tőle, hanem osztozik rajta.
+        """
+        free = None
+        for probe in range(self._PROBES):
+            offset = base + ((start + probe) % self.slots_per_stripe) * self._SLOT.size
+            state = pending.get(offset) or self._SLOT.unpack_from(self._map, offset)
+            if state[0] == key_hash:
+                return offset, state
+            if free is None and (state[0] == 0 or state[3] <= now):
+                free = offset
+        if free is not None:
+            return free, None
+        first = base + start * self._SLOT.size
+        return first, pending.get(first) or self._SLOT.unpack_from(self._map, first)
+
+
+class RateLimiter:
+
+    def __init__(self):
+        self.backend = None
+        self._counters = {}  # endpoint -> [átengedve, endpoint limit, kvóta limit, elfogyasztott cost]
+        self._counters_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.backend = create_backend(
+            app.config.get('RATELIMIT_BACKEND', 'memory'),
+            app.config.get('RATELIMIT_STORAGE_PATH') or os.path.join(app.instance_path, 'ratelimit'),
+        )
+
+    def hit(self, buckets):
+        if self.backend is None:
+            self.backend = MemoryBackend()
+        return self.backend.hit(buckets)
+
+    def count(self, endpoint, outcome, cost=0):
+        """outcome: 0 = átengedve, 1 = endpoint limit, 2 = kvóta limit"""
+        with self._counters_lock:
+            counters = self._counters.get(endpoint)
+            if counters is None:
+                counters = self._counters[endpoint] = [0, 0, 0, 0]
+            counters[outcome] += 1
+            counters[3] += cost
+
+    def metrics(self):
+        """Policyk és számlálók - ez a folyamat saját számlálói"""
+        with self._counters_lock:
+            counters = {endpoint: list(values) for endpoint, values in self._counters.items()}
+        endpoints = {}
+        for endpoint in sorted(set(RATE_LIMIT_POLICIES) | set(counters)):
+            policy = get_policy(endpoint)
+            allowed, limited, quota_limited, cost_spent = counters.get(endpoint, (0, 0, 0, 0))
+            endpoints[endpoint] = {
+                'limit': policy.limit,
+                'window': policy.window,
+                'burst': policy.burst or policy.limit,
+                'key': policy.key,
+                'cost': policy.cost if not callable(policy.cost) else 'dynamic',
+                'allowed': allowed,
+                'limited': limited,
+                'quota_limited': quota_limited,
+                'cost_spent': cost_spent,
+            }
+        return {
+            'backend': type(self.backend).__name__ if self.backend else None,
+            'default': DEFAULT_POLICY._asdict(),
+            'cpu_quota': {'limit': CPU_QUOTA.limit, 'window': CPU_QUOTA.window, 'burst': CPU_QUOTA.burst},
+            'endpoints': endpoints,
+        }
+
+
+def create_backend(name, path):
+    """Háttértár név alapján - a fájlos tárak mappáját is létrehozza"""
+    if name == 'memory':
+        return MemoryBackend()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if name == 'sqlite':
+        return SQLiteBackend(path + '.db' if not path.endswith('.db') else path)
+    if name == 'shm':
+        return SharedMemoryBackend(path + '.shm' if not path.endswith('.shm') else path)
+    raise ValueError(f'Ismeretlen rate limit háttértár: {name}')
+
+
+limiter = RateLimiter()
+
+
+def get_policy(endpoint):
+    """Endpoint policy - az app config RATE_LIMIT_POLICIES-e felülírhatja"""
+    overrides = current_app.config.get('RATE_LIMIT_POLICIES')
+    if overrides and endpoint in overrides:
+        return overrides[endpoint]
+    return RATE_LIMIT_POLICIES.get(endpoint, DEFAULT_POLICY)
+
+
+def _client_key(mode):
+    """Kliens azonosító a policy key módja szerint"""
+    ip = request.remote_addr or 'unknown'
+    if mode == 'ip':
+        return ip
+    user_id = None
+    parts = request.headers.get('Authorization', '').split()
+    if len(parts) == 2 and parts[0].lower() == 'bearer':
+        payload = decode_token(parts[1], current_app.config['SECRET_KEY'])
+        user_id = payload.get('user_id') if payload else None
+    if mode == 'user':
+        return f'u:{user_id}' if user_id else ip
+    return f'{ip}|u:{user_id}' if user_id else ip
+
+
+def _retry_after_header(retry_after):
+    return {'Retry-After': str(max(1, round(retry_after)))}
+
+
+def ratelimit(func):
+    """
+    Rate limiting decorator
+
+    Az endpoint policy-ja szerint limitál (token bucket), alapból
+    IP + endpoint, 5 request / 10 sec. Ha a policy-nak van költsége,
+    az a kliens közös CPU kvótájából is fogy.
+    Ha túllépi, 429-et dob Retry-After fejléccel
+
+    A két vödröt a háttértár egy zár alatt nézi meg és vonja le - a kvótán
+    elakadó kérés nem fogyasztja az endpoint vödrét, párhuzamos kérésnél sem.
+    """
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        endpoint = request.endpoint
+        policy = get_policy(endpoint)
+        client = _client_key(policy.key)
+        buckets = [(f'{client}:{endpoint}', policy.burst or policy.limit, policy.limit / policy.window, 1)]
+
+        cost = policy.cost(request) if callable(policy.cost) else policy.cost
+        # a vödörnél nagyobb költség sosem férne bele - ilyenkor az egészet elviszi
+        cost = min(cost, CPU_QUOTA.burst)
+        if cost > 0:
+            quota_client = client if policy.key == 'user' else _client_key('user')
+            buckets.append((f'{quota_client}:*', CPU_QUOTA.burst, CPU_QUOTA.limit / CPU_QUOTA.window, cost))
+
+        refused, retry_after = limiter.hit(buckets)
+        if refused == 0:
+            limiter.count(endpoint, 1)
+            return error_response('Kéréskorlát túllépve', 429, _retry_after_header(retry_after))
+        if refused == 1:
+            limiter.count(endpoint, 2)
+            return error_response('A drága műveletek kvótája elfogyott', 429, _retry_after_header(retry_after))
+
+        limiter.count(endpoint, 0, cost)
+        return func(*args, **kwargs)
+    return decorated_function
@@ -1,14 +1,25 @@
-from flask import Blueprint, jsonify, request
-import time
-import random
-from functools import wraps
+from flask import Blueprint, jsonify, request, Response, stream_with_context, current_app
+import hashlib
+import hmac
+import json
 from datetime import datetime, timedelta
-from app.models import db, User, World, Card, Dungeon
+from app.models import db, User, World, WorldMembership, Card, CardInstance, Dungeon, DungeonCard, BattleStat, FightEpoch
+from app import fight_engine
+from app.dungeon_cache import get_dungeon_snapshot, bump_world_version, cache_stats as dungeon_cache_stats
+from app.battle_log import battle_log_writer
+from app.idempotency import idempotent
+from app.passwords import PasswordBusy, password_hasher
+from app import dungeon_cards, instances, listing, memberships, pictures, world_transfer
+from app.world_clone import clone_world as copy_world
+from app.world_deletion import delete_world as remove_world_rows, world_deleter
+from app.principals import invalidate_principal, membership_claims, cache_stats as principal_cache_stats
+from app.ratelimit import ratelimit, limiter
 from app.utils import (
     success_response, error_response, validate_email, 
     validate_username, validate_password, hash_password,
     verify_password, generate_token, require_auth, generate_unique_id,
-    require_master, is_master_of_world, check_master_status
+    require_master, is_master_of_world, check_master_status, retry_on_db_lock,
+    load_current_user
 )
 from app.email_service import (
     send_verification_email, send_login_notification_email,
@@ -17,42 +28,22 @@ from app.email_service import (
 )
 from app.email_config import EmailConfig
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm.attributes import flag_modified
 
 
 
 api = Blueprint('api', __name__)
 
-# Rate limiting - egyszerű in-memory tárolás
-# Production-ben Redis kellene, de ez egyelőre elég
-_rate_limit_store = {}
-_RATE_LIMIT_WINDOW = 10  # 10 másodperc
-_RATE_LIMIT_MAX = 5  # max 5 kérés per window
+# Ennyi kazamatát ajánlunk fel egyszerre
+_DUNGEON_OFFER_COUNT = 2
 
-# Dungeon választási cache - hogy ne mindig random legyen
-_dungeon_selection_cache = {}
 
-def ratelimit(func):
-    """
-    Rate limiting decorator
-    
-    IP + endpoint alapján limitál - 5 request / 10 sec
-    Ha túllépi, 429-et dob
-    """
-    @wraps(func)
-    def decorated_function(*args, **kwargs):
-        ip = request.remote_addr or 'unknown'
-        key = f"{ip}:{request.endpoint}"
-        now = time.time()
-        window_start = now - _RATE_LIMIT_WINDOW
-        reqs = _rate_limit_store.get(key, [])
-        reqs = [t for t in reqs if t > window_start]  # régi kérések kiszűrése
-        if len(reqs) >= _RATE_LIMIT_MAX:
-            return error_response('Kéréskorlát túllépve', 429)
-        reqs.append(now)
-        _rate_limit_store[key] = reqs
-        return func(*args, **kwargs)
-    return decorated_function
+@api.after_request
+def attach_refreshed_token(response):
+    """Ha a require_auth új tokent adott (elavult tagság claim), fejlécben visszaküldjük"""
+    token = getattr(request, 'refreshed_token', None)
+    if token:
+        response.headers['X-Refreshed-Token'] = token
+    return response
 
 
 @api.route('/user/register', methods=['POST'])
@@ -100,8 +91,10 @@ def register():
         if existing_user.email == email:
             return error_response('Az e-mail már létezik', 409)
     
+    # a try előtt, hogy a PasswordBusy 503-ként menjen ki, ne 500-ként
+    password_hash = hash_password(password)
+    
     try:
-        password_hash = hash_password(password)
         verification_token = generate_verification_token()
         verification_expires = get_verification_expiry()
         
@@ -113,7 +106,6 @@ def register():
                     username=username,
                     email=email,
                     password_hash=password_hash,
-                    world_ids=[],
                     settings={},
                     email_verified=not EmailConfig.REQUIRE_EMAIL_VERIFICATION,
                     verification_token=verification_token,
@@ -135,7 +127,8 @@ def register():
                     }, 201)
                 else:
                     from flask import current_app
-                    token = generate_token(new_user.id, current_app.config['SECRET_KEY'])
+                    token = generate_token(new_user.id, current_app.config['SECRET_KEY'],
+                                           claims=membership_claims(new_user))
                     return success_response({
                         'message': 'Regisztráció sikeres.',
                         'user': new_user.to_dict(),
@@ -180,6 +173,14 @@ def login():
     if not verify_password(password, user.password_hash):
         return error_response('Érvénytelen hitelesítő adatok', 401)
     
+    # Ha azóta változott a BCRYPT_ROUNDS, most tudjuk újrahash-elni (itt van a jelszó)
+    if password_hasher.needs_rehash(user.password_hash):
+        try:
+            user.password_hash = hash_password(password)
+            db.session.commit()
+        except PasswordBusy:
+            pass  # majd a következő loginnál
+    
     if EmailConfig.REQUIRE_EMAIL_VERIFICATION:
         if not user.email_verified:
             verification_token = generate_verification_token()
@@ -192,7 +193,7 @@ def login():
             return error_response('Az e-mail cím még nincs megerősítve. Új megerősítő e-mailt küldtünk.', 403)
     
     from flask import current_app
-    token = generate_token(user.id, current_app.config['SECRET_KEY'])
+    token = generate_token(user.id, current_app.config['SECRET_KEY'], claims=membership_claims(user))
     
     send_login_notification_email(user.email, user.username)
     
@@ -207,7 +208,9 @@ def login():
 @ratelimit
 @require_auth
 def delete_account():
-    user = request.current_user
+    user = load_current_user()
+    if not user:
+        return error_response('Felhasználó nem található', 401)
     
     data = request.get_json()
     if not data:
@@ -222,34 +225,39 @@ def delete_account():
     
     try:
         
-        user_world_map = user.world_ids or {}
-        worlds_to_delete = []
-        
-        if isinstance(user_world_map, dict):
-            for world_id, is_master in user_world_map.items():
-                if is_master is True:
-                    worlds_to_delete.append(world_id)
-        
-        
+        worlds_to_delete = memberships.master_world_ids(user.id)
+        changed_user_ids = [user.id]
+        background = False
         for world_id in worlds_to_delete:
-            Card.query.filter_by(world_id=world_id).delete()
-            Dungeon.query.filter_by(world_id=world_id).delete()
-            
-            users = User.query.all()
-            for u in users:
-                if u.world_ids and world_id in u.world_ids:
-                    del u.world_ids[world_id]
-                    u.world_ids = dict(u.world_ids)
-        
-        
-        if worlds_to_delete:
-            World.query.filter(World.world_id.in_(worlds_to_delete)).delete(synchronize_session=False)
+            changed, in_background = remove_world_rows(world_id, current_app.config['WORLD_DELETE_BACKGROUND_ROWS'])
+            changed_user_ids.extend(changed)
+            background = background or in_background
         
-        
-        Card.query.filter_by(owner_id=user.id).delete()
+        # más világokban lévő saját lapok és példányok - owner_id indexen;
+        # a törölt világok sorai a remove_world_rows / world_deleter dolga
+        own_cards = Card.query.filter(Card.owner_id == user.id, Card.world_id.notin_(worlds_to_delete))
+        own_ids = db.session.query(Card.id).filter(Card.owner_id == user.id, Card.world_id.notin_(worlds_to_delete))
+        picture_hashes = pictures.picture_hashes(own_cards)
+        DungeonCard.query.filter(DungeonCard.card_id.in_(own_ids)).delete(synchronize_session=False)
+        instances.delete_rows(CardInstance.query.filter(CardInstance.template_id.in_(own_ids)))
+        instances.delete_rows(CardInstance.query.filter(
+            CardInstance.owner_id == user.id, CardInstance.world_id.notin_(worlds_to_delete)
+        ))
+        own_cards.delete(synchronize_session=False)
+        pictures.release_pictures(picture_hashes)
+        # a maradék (nem GM) világokban a user harc számlálói
+        BattleStat.query.filter(
+            BattleStat.world_id.in_(list(memberships.world_roles(user.id))),
+            BattleStat.scope == 'user', BattleStat.subject_id == user.id
+        ).delete(synchronize_session=False)
+        FightEpoch.query.filter(FightEpoch.user_id == user.id).delete(synchronize_session=False)
+        memberships.remove_user(user.id)
         
         db.session.delete(user)
         db.session.commit()
+        if background:
+            world_deleter.wake()
+        invalidate_principal(*changed_user_ids)
         return success_response({'message': 'A fiók sikeresen törölve'})
     except Exception as e:
         db.session.rollback()
@@ -260,7 +268,9 @@ def delete_account():
 @ratelimit
 @require_auth
 def get_user():
-    user = request.current_user
+    user = load_current_user()
+    if not user:
+        return error_response('Felhasználó nem található', 401)
     
     return success_response({
         'username': user.username,
@@ -334,6 +344,7 @@ def reset_password():
     user.password_reset_token = None
     user.password_reset_token_expires = None
     db.session.commit()
+    invalidate_principal(user.id)
     
     return success_response({
         'message': 'A jelszó sikeresen megváltoztatva'
@@ -367,7 +378,7 @@ def verify_email():
     db.session.commit()
     
     from flask import current_app
-    access_token = generate_token(user.id, current_app.config['SECRET_KEY'])
+    access_token = generate_token(user.id, current_app.config['SECRET_KEY'], claims=membership_claims(user))
     
     return success_response({
         'message': 'E-mail cím sikeresen megerősítve',
@@ -443,20 +454,18 @@ def create_world():
                 db.session.add(new_world)
                 db.session.flush()
                 
-                if not isinstance(user.world_ids, dict):
-                    user.world_ids = {}
-                
-                updated_worlds = dict(user.world_ids)
-                updated_worlds[new_world.world_id] = is_master
-                user.world_ids = updated_worlds
-                
-                flag_modified(user, 'world_ids')
+                memberships.add_member(user.id, new_world.world_id, is_master=is_master)
                 
                 db.session.commit()
-                return success_response({
+                invalidate_principal(user.id)
+                response = {
                     'message': 'Világ sikeresen létrehozva',
                     'world': new_world.to_dict()
-                }, 201)
+                }
+                if user.id == request.user_id:
+                    response['token'] = generate_token(user.id, current_app.config['SECRET_KEY'],
+                                                       claims=membership_claims(user))
+                return success_response(response, 201)
             except IntegrityError:
                 db.session.rollback()
                 continue
@@ -466,6 +475,39 @@ def create_world():
         return error_response('A világ létrehozása sikertelen', 500)
 
 
+def _target_ids(single, many):
+    """give_to_user_id / user_id vagy a lista - ismétlés nélkül, sorrendtartóan"""
+    if isinstance(single, str) and single.strip():
+        return [single.strip()]
+    if not isinstance(many, list):
+        return []
+    return list(dict.fromkeys(str(x).strip() for x in many if str(x).strip()))
+
+
+def _check_targets(world_id, targets, template_id=None):
+    """
+    Kiosztás előtti validálás fix számú lekérdezéssel (akárhány célpont)
+
+    None ha minden rendben, különben a hiba válasz.
+    """
+    found = memberships.check_users(world_id, targets)
+    if len(found) != len(targets):
+        return error_response('Felhasználó nem található', 404)
+    if not all(is_member for _, is_member in found.values()):
+        return error_response('Felhasználó nincs ebben a világban', 400)
+    if template_id is None:
+        return None
+    users_with_card = instances.owners_with(template_id, targets)
+    if not users_with_card:
+        return None
+    user_names = [found[uid][0] for uid in targets if uid in users_with_card]
+    if len(user_names) == 1:
+        msg = f'A felhasználó ({user_names[0]}) már rendelkezik ezzel a kártyával'
+    else:
+        msg = f'Egyes felhasználók már rendelkeznek ezzel a kártyával: {", ".join(user_names)}'
+    return error_response(msg, 409)
+
+
 @api.route('/create/card', methods=['POST'])
 @ratelimit
 @require_auth
@@ -488,8 +530,7 @@ def create_card():
         world_id = data.get('world_id', '0') if isinstance(data.get('world_id', '0'), str) else str(data.get('world_id', '0'))
         user_id = user.id
         name = data.get('name', '0') if isinstance(data.get('name', '0'), str) else str(data.get('name', '0'))
-        give_to_user_id = data.get('give_to_user_id', '').strip() if isinstance(data.get('give_to_user_id'), str) else ''
-        give_to_user_ids = data.get('give_to_user_ids', []) if isinstance(data.get('give_to_user_ids', []), list) else []
+        targets = _target_ids(data.get('give_to_user_id'), data.get('give_to_user_ids'))
         raw_type = data.get('type', '')
         if isinstance(raw_type, str):
             card_type = raw_type.strip().lower()
@@ -499,10 +540,6 @@ def create_card():
         if card_type not in ('t', 'f', 'v', 'l'):
             return error_response('Érvénytelen típus. Csak a következők engedélyezettek: t, f, v, l', 400)
         picture_val = data.get('picture', None)
-        if isinstance(picture_val, str):
-            picture_bytes = picture_val.encode('utf-8')
-        else:
-            picture_bytes = None
         
         def to_int(v, default=0):
             try:
@@ -557,15 +594,22 @@ def create_card():
         existing_card = Card.query.filter_by(world_id=world_id, name=name).first()
         if existing_card:
             return error_response('Már létezik kártya ezzel a névvel ebben a világban', 409)
+        # a célpontokat a sablon előtt validáljuk, így hibánál nem marad félkész kártya
+        if targets:
+            failed = _check_targets(world_id, targets)
+            if failed:
+                return failed
 
         for _ in range(5):
             try:
+                # a képet egyszer tároljuk, a másolatok ugyanerre a hash-re mutatnak
+                picture_hash = pictures.store_picture(picture_val)
                 new_card = Card(
                     id=generate_unique_id(),
                     world_id=world_id,
                     owner_id=user_id,
                     name=name,
-                    picture=picture_bytes,
+                    picture_hash=picture_hash,
                     health=health,
                     damage=damage,
                     type=card_type,
@@ -573,49 +617,10 @@ def create_card():
                     is_leader=is_leader,
                 )
                 db.session.add(new_card)
+                db.session.flush()
+                # sablon + példányok (egy INSERT akárhány játékosra) egyetlen commitban
+                assigned_cards = instances.hand_out(new_card, targets)
                 db.session.commit()
-                assigned_cards = []
-                targets = []
-                if give_to_user_id:
-                    targets = [give_to_user_id]
-                elif give_to_user_ids:
-                    targets = [str(x).strip() for x in give_to_user_ids if str(x).strip()]
-                if targets:
-                    users = User.query.filter(User.id.in_(targets)).all()
-                    found_ids = {u.id for u in users}
-                    if len(found_ids) != len(targets):
-                        return error_response('Felhasználó nem található', 404)
-                    wm_map = {u.id: (u.world_ids or {}) for u in users}
-                    for uid in targets:
-                        wm = wm_map.get(uid, {})
-                        if not (isinstance(wm, dict) and str(world_id) in wm):
-                            return error_response('Felhasználó nincs ebben a világban', 400)
-                    for uid in targets:
-                        created = False
-                        for _dup in range(5):
-                            try:
-                                dup_card = Card(
-                                    id=generate_unique_id(),
-                                    world_id=world_id,
-                                    owner_id=uid,
-                                    name=name,
-                                    picture=picture_bytes,
-                                    health=health,
-                                    damage=damage,
-                                    type=card_type,
-                                    position=position,
-                                    is_leader=is_leader,
-                                )
-                                db.session.add(dup_card)
-                                db.session.commit()
-                                assigned_cards.append(dup_card.to_dict())
-                                created = True
-                                break
-                            except IntegrityError:
-                                db.session.rollback()
-                                continue
-                        if not created:
-                            return error_response('Nem sikerült egyedi azonosítót generálni a kártyához', 500)
                 return success_response({
                     'message': 'Kártya sikeresen létrehozva',
                     'card': new_card.to_dict(),
@@ -639,81 +644,23 @@ def add_card_to_user():
         return error_response('A kérés törzse kötelező', 400)
     world_id = data.get('world_id', '').strip() if isinstance(data.get('world_id'), str) else ''
     card_id = data.get('card_id', '').strip() if isinstance(data.get('card_id'), str) else ''
-    user_id = data.get('user_id', '').strip() if isinstance(data.get('user_id'), str) else ''
-    user_ids = data.get('user_ids', []) if isinstance(data.get('user_ids', []), list) else []
     if not world_id:
         return error_response('A világ azonosítója kötelező', 400)
     if not card_id:
         return error_response('A kártya azonosítója kötelező', 400)
-    targets = []
-    if user_id:
-        targets = [user_id]
-    elif user_ids:
-        targets = [str(x).strip() for x in user_ids if str(x).strip()]
-    else:
+    targets = _target_ids(data.get('user_id'), data.get('user_ids'))
+    if not targets:
         return error_response('A felhasználó azonosítója kötelező', 400)
-    users = User.query.filter(User.id.in_(targets)).all()
-    found_ids = {u.id for u in users}
-    if len(found_ids) != len(targets):
-        return error_response('Felhasználó nem található', 404)
-    for u in users:
-        wm = u.world_ids or {}
-        if not (isinstance(wm, dict) and str(world_id) in wm):
-            return error_response('Felhasználó nincs ebben a világban', 400)
-    original_card = Card.query.get(card_id)
+    original_card = db.session.get(Card, card_id)
     if not original_card or original_card.world_id != world_id:
         return error_response('Nem található kártya a megadott azonosítóval', 404)
-    
-    users_with_card = []
-    for uid in targets:
-        existing = Card.query.filter_by(
-            world_id=world_id,
-            owner_id=uid,
-            name=original_card.name
-        ).first()
-        if existing:
-            users_with_card.append(uid)
-    
-    if users_with_card:
-        user_names = []
-        for uid in users_with_card:
-            u = User.query.get(uid)
-            if u:
-                user_names.append(u.username)
-        if len(users_with_card) == 1:
-            msg = f'A felhasználó ({user_names[0]}) már rendelkezik ezzel a kártyával'
-        else:
-            msg = f'Egyes felhasználók már rendelkeznek ezzel a kártyával: {", ".join(user_names)}'
-        return error_response(msg, 409)
-    
+    failed = _check_targets(world_id, targets, template_id=original_card.id)
+    if failed:
+        return failed
+
     try:
-        created_cards = []
-        for uid in targets:
-            success = False
-            for _ in range(5):
-                try:
-                    new_card = Card(
-                        id=generate_unique_id(),
-                        world_id=original_card.world_id,
-                        owner_id=uid,
-                        name=original_card.name,
-                        picture=original_card.picture,
-                        health=original_card.health,
-                        damage=original_card.damage,
-                        type=original_card.type,
-                        position=original_card.position,
-                        is_leader=original_card.is_leader
-                    )
-                    db.session.add(new_card)
-                    db.session.commit()
-                    created_cards.append(new_card.to_dict())
-                    success = True
-                    break
-                except IntegrityError:
-                    db.session.rollback()
-                    continue
-            if not success:
-                return error_response('Nem sikerült egyedi azonosítót generálni', 500)
+        created_cards = instances.hand_out(original_card, targets)
+        db.session.commit()
         if len(created_cards) == 1:
             return success_response({'message': 'Kártya hozzáadva a felhasználóhoz', 'card': created_cards[0], 'cards': created_cards}, 201)
         return success_response({'message': 'Kártyák hozzáadva a felhasználókhoz', 'cards': created_cards}, 201)
@@ -746,37 +693,23 @@ def create_dungeon():
     if len(list_ids) not in [1, 4, 6]:
         return error_response('A kazamata 1, 4 vagy 6 kártyából kell álljon', 400)
     
-    if list_ids:
-        cards = Card.query.filter(Card.id.in_(list_ids)).all()
-        card_dict = {card.id: card for card in cards}
-        
-        if len(card_dict) != len(list_ids):
-            return error_response('Egy vagy több kártya azonosító nem található', 404)
-        
-        ordered_cards = [card_dict[card_id] for card_id in list_ids]
-        
-        if len(list_ids) == 1:
-
-            if ordered_cards[0].is_leader != "":
-                return error_response('Az egyszerű találkozás típusú kazamatában csak sima kártya lehet', 400)
-        
-        elif len(list_ids) in [4, 6]:
-            if ordered_cards[-1].is_leader == "":
-                return error_response('A kazamata utolsó kártyája vezér kell legyen', 400)
-            
-            
-            for i in range(len(ordered_cards) - 1):
-                if ordered_cards[i].is_leader != "":
-                    return error_response('A kazamata kártyái közül csak az utolsó lehet vezér', 400)
-        
-        try:
-            for position, card_id in enumerate(list_ids):
-                card = card_dict[card_id]
-                card.position = position + 1
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            return error_response('A kártyák pozíciójának frissítése sikertelen', 500)
+    list_ids = [str(card_id) for card_id in list_ids]
+    # vezér-e pozíciónként, egy oszlop-szintű lekérdezéssel
+    leader_flags = dict(db.session.query(Card.id, Card.is_leader != '').filter(
+        Card.id.in_(list_ids), Card.world_id == world_id
+    ).all())
+    if len(leader_flags) != len(list_ids):
+        return error_response('Egy vagy több kártya azonosító nem található', 404)
+    ordered_leaders = [bool(leader_flags[card_id]) for card_id in list_ids]
+    
+    if len(list_ids) == 1:
+        if ordered_leaders[0]:
+            return error_response('Az egyszerű találkozás típusú kazamatában csak sima kártya lehet', 400)
+    else:
+        if not ordered_leaders[-1]:
+            return error_response('A kazamata utolsó kártyája vezér kell legyen', 400)
+        if any(ordered_leaders[:-1]):
+            return error_response('A kazamata kártyái közül csak az utolsó lehet vezér', 400)
     
     try:
         for _ in range(5):
@@ -784,14 +717,15 @@ def create_dungeon():
                 new_dungeon = Dungeon(
                     id=generate_unique_id(),
                     name=name,
-                    world_id=str(world_id).strip(),
-                    list_of_card_ids=list_ids
+                    world_id=str(world_id).strip()
                 )
                 db.session.add(new_dungeon)
+                dungeon_cards.set_cards(new_dungeon.id, list_ids)
+                bump_world_version(new_dungeon.world_id)
                 db.session.commit()
                 return success_response({
                     'message': 'Dungeon sikeresen létrehozva',
-                    'dungeon': new_dungeon.to_dict()
+                    'dungeon': new_dungeon.to_dict(card_ids=list_ids)
                 }, 201)
             except IntegrityError:
                 db.session.rollback()
@@ -830,41 +764,14 @@ def create_collection():
             return error_response('Nem található kártya a megadott azonosítókkal', 404)
         
         duplicated_cards = []
-        
         for original_card in original_cards:
-            success = False
-            for _ in range(5):
-                try:
-                    new_card = Card(
-                        id=generate_unique_id(),
-                        world_id=original_card.world_id,
-                        owner_id=owner_id,
-                        name=original_card.name,
-                        picture=original_card.picture,
-                        health=original_card.health,
-                        damage=original_card.damage,
-                        type=original_card.type,
-                        position=original_card.position,
-                        is_leader=original_card.is_leader
-                    )
-                    db.session.add(new_card)
-                    db.session.flush()
-                    duplicated_cards.append(new_card)
-                    success = True
-                    break
-                except IntegrityError:
-                    db.session.rollback()
-                    continue
-            
-            if not success:
-                db.session.rollback()
-                return error_response('Nem sikerült egyedi azonosítót generálni a kártyához', 500)
+            duplicated_cards.extend(instances.hand_out(original_card, [owner_id]))
         
         db.session.commit()
         
         return success_response({
             'message': 'Kollekció sikeresen létrehozva',
-            'duplicated_cards': [card.to_dict() for card in duplicated_cards],
+            'duplicated_cards': duplicated_cards,
             'count': len(duplicated_cards)
         }, 201)
     except Exception as e:
@@ -922,7 +829,7 @@ def create_leader():
                     world_id=original_card.world_id,
                     owner_id=original_card.owner_id,
                     name=leader_name,
-                    picture=original_card.picture,
+                    picture_hash=original_card.picture_hash,
                     health=new_health,
                     damage=new_damage,
                     type=original_card.type,
@@ -968,7 +875,7 @@ def set_deck():
         return error_response('Pontosan 1, 4 vagy 6 kártyát kell megadni', 400)
     if len(set(cards_list)) != len(cards_list):
         return error_response('Ismétlődő kártya azonosítók', 400)
-    cards = Card.query.filter(Card.id.in_(cards_list)).all()
+    cards = CardInstance.query.filter(CardInstance.id.in_(cards_list)).all()
     if len(cards) != len(cards_list):
         return error_response('Nem található kártya a megadott azonosítókkal', 404)
     for c in cards:
@@ -981,10 +888,10 @@ def set_deck():
     world_id = world_ids.pop()
     
     try:
-        old_deck_cards = Card.query.filter_by(
+        old_deck_cards = CardInstance.query.filter_by(
             owner_id=user.id,
             world_id=world_id
-        ).filter(Card.position > 0).all()
+        ).filter(CardInstance.position > 0).all()
         
         for old_card in old_deck_cards:
             old_card.position = 0
@@ -1004,7 +911,9 @@ def set_deck():
 @ratelimit
 @require_auth
 def join_game():
-    user = request.current_user
+    user = load_current_user()
+    if not user:
+        return error_response('Felhasználó nem található', 401)
     
     data = request.get_json()
     
@@ -1021,29 +930,22 @@ def join_game():
     if not world:
         return error_response('A világ nem található', 404)
     
-    if not isinstance(user.world_ids, dict):
-        user.world_ids = {}
-    
-    if invite_code in user.world_ids:
-        if user.world_ids[invite_code] is True:
+    role = memberships.get_role(user.id, invite_code)
+    if role is not None:
+        if role is True:
             return error_response('Már játék mester vagy ebben a világban', 409)
         return error_response('Már csatlakoztál ehhez a világhoz', 409)
     
     try:
-        wm = user.world_ids or {}
-        if not isinstance(wm, dict):
-            wm = {}
-        updated = dict(wm)
-        updated[str(invite_code)] = False
-        user.world_ids = updated
-
-        flag_modified(user, 'world_ids')
+        memberships.add_member(user.id, invite_code, is_master=False)
 
         db.session.commit()
+        invalidate_principal(user.id)
 
         return success_response({
             'message': 'Sikeresen csatlakoztál a világhoz',
-            'world': world.to_dict()
+            'world': world.to_dict(),
+            'token': generate_token(user.id, current_app.config['SECRET_KEY'], claims=membership_claims(user))
         })
     except Exception as e:
         print(e)
@@ -1051,6 +953,42 @@ def join_game():
         return error_response('A csatlakozás sikertelen', 500)
 
 
+def _select_dungeons(user_id, world_id, epoch, dungeons):
+    """
+    Felajánlott kazamaták - determinisztikusan, közös állapot nélkül
+
+    Kulcsolt hash (user, világ, harc epoch) alapján minden kazamata kap egy
+    pontszámot, a legkisebbek nyernek (rendezvous hashing). Bármelyik worker
+    ugyanazt számolja, és ha egy kazamata törlődik, csak az ő helye cserélődik.
+    """
+    secret = current_app.config['SECRET_KEY'].encode('utf-8')
+    seed = hmac.new(secret, f'{user_id}:{world_id}:{epoch}'.encode('utf-8'), hashlib.sha256).digest()
+    ranked = sorted(dungeons, key=lambda d: hmac.new(seed, d.id.encode('utf-8'), hashlib.sha256).digest())
+    return ranked[:_DUNGEON_OFFER_COUNT]
+
+
+def _advance_fight_epoch(user_id, world_id):
+    """Harc epoch léptetése egy utasításban (upsert) - commitot nem csinál"""
+    values = {'user_id': user_id, 'world_id': str(world_id), 'epoch': 1}
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(FightEpoch).values(**values).on_conflict_do_update(
+            index_elements=['user_id', 'world_id'],
+            set_={'epoch': FightEpoch.epoch + 1}
+        )
+        db.session.execute(stmt)
+        return
+    updated = FightEpoch.query.filter_by(user_id=user_id, world_id=str(world_id)).update(
+        {FightEpoch.epoch: FightEpoch.epoch + 1}, synchronize_session=False
+    )
+    if not updated:
+        db.session.add(FightEpoch(**values))
+
+
 @api.route('/game/dungeon', methods=['GET'])
 @ratelimit
 @require_auth
@@ -1062,35 +1000,20 @@ def get_game_dungeon():
         return error_response('A világ azonosítója kötelező', 400)
 
     world_id_str = str(world_id)
-    cache_key = f"{user.id}:{world_id_str}"
 
     dungeons = Dungeon.query.filter_by(world_id=world_id_str).all()
     if not dungeons:
         return error_response('A játékmester még nem hozott létre kazamatát ebben a világban', 404)
 
-    cached_ids = _dungeon_selection_cache.get(cache_key)
-    selected_dungeons = None
-
-    if cached_ids:
-        existing_map = {d.id: d for d in dungeons}
-        if all(did in existing_map for did in cached_ids):
-            selected_dungeons = [existing_map[did] for did in cached_ids]
-        else:
-            _dungeon_selection_cache.pop(cache_key, None)
-
-    if selected_dungeons is None:
-        if len(dungeons) == 1:
-            selected_dungeons = dungeons
-        else:
-            count = min(2, len(dungeons))
-            selected_dungeons = random.sample(dungeons, count)
-        _dungeon_selection_cache[cache_key] = [d.id for d in selected_dungeons]
+    epoch = db.session.query(FightEpoch.epoch).filter_by(user_id=user.id, world_id=world_id_str).scalar() or 0
+    selected_dungeons = _select_dungeons(user.id, world_id_str, epoch, dungeons)
 
+    card_ids = dungeon_cards.card_ids_by_dungeon([d.id for d in selected_dungeons])
     result = []
     for dungeon in selected_dungeons:
         result.append({
             'id': dungeon.id,
-            'number_of_cards': len(dungeon.list_of_card_ids)
+            'number_of_cards': len(card_ids[dungeon.id])
         })
 
     return success_response({'dungeons': result})
@@ -1103,31 +1026,50 @@ def is_master():
     return check_master_status()
 
 
+# A lista endpointok mezői (fields=) - alapból mind, ugyanaz a forma mint a to_dict()
+CARD_FIELDS = ('id', 'world_id', 'owner_id', 'name', 'picture', 'health', 'damage', 'type', 'position', 'is_leader')
+INSTANCE_FIELDS = CARD_FIELDS[:3] + ('template_id',) + CARD_FIELDS[3:]
+DUNGEON_FIELDS = ('id', 'name', 'world_id', 'list_of_card_ids')
+MEMBER_FIELDS = ('id', 'username', 'is_master')
+
+
 @api.route('/user/list/worlds', methods=['GET'])
 @ratelimit
 @require_auth
 def list_user_worlds():
+    """
+    Minden világ (id -> név) + a user világai
+
+    limit / cursor esetén a 'worlds' csak egy lap (world_id szerint), a saját
+    világok mindig teljesek (azok a user tagságaiból jönnek).
+    """
     user = request.current_user
-    
-    
-    all_worlds = World.query.all()
-    worlds_dict = {w.world_id: w.name for w in all_worlds}
-    
-    user_world_map = user.world_ids or {}
-    where_user_is_master = []
-    already_joined_worlds = {}
-    
-    if isinstance(user_world_map, dict):
-        for world_id, is_master in user_world_map.items():
-            already_joined_worlds[world_id] = worlds_dict.get(world_id, world_id)
-            if is_master is True:
-                where_user_is_master.append(world_id)
+    try:
+        list_args = listing.ListArgs.parse(request.args, ('world_id', 'name'))
+    except ValueError as e:
+        return error_response(str(e), 400)
+    list_args.fields = ['world_id', 'name']
+    page, next_cursor = listing.list_page(
+        lambda *columns: db.session.query(*columns),
+        {'world_id': World.world_id, 'name': World.name}, list_args, keys=(World.world_id,)
+    )
+    worlds_dict = {w['world_id']: w['name'] for w in page}
+    
+    user_world_map = user.world_ids if isinstance(user.world_ids, dict) else {}
+    joined_names = dict(db.session.query(World.world_id, World.name).filter(
+        World.world_id.in_(list(user_world_map))
+    ).all()) if user_world_map else {}
+    where_user_is_master = [world_id for world_id, is_master in user_world_map.items() if is_master is True]
+    already_joined_worlds = {world_id: joined_names.get(world_id, world_id) for world_id in user_world_map}
     
     return success_response({
         'worlds': worlds_dict,
         'where_user_is_master': where_user_is_master,
-        'already_joined_worlds': already_joined_worlds
+        'already_joined_worlds': already_joined_worlds,
+        'next_cursor': next_cursor
     })
+
+
 @api.route('/world/list/dungeons', methods=['GET'])
 @ratelimit
 @require_auth
@@ -1136,8 +1078,16 @@ def list_world_dungeons():
     world_id = request.args.get('world_id')
     if not world_id:
         return error_response('A világ azonosítója kötelező', 400)
-    dungeons = Dungeon.query.filter_by(world_id=world_id).all()
-    return success_response({'dungeons': [d.to_dict() for d in dungeons]})
+    try:
+        list_args = listing.ListArgs.parse(request.args, DUNGEON_FIELDS)
+        dungeons, next_cursor = listing.list_page(
+            lambda *columns: db.session.query(*columns).filter(Dungeon.world_id == str(world_id)),
+            {'id': Dungeon.id, 'name': Dungeon.name, 'world_id': Dungeon.world_id}, list_args,
+            keys=listing.row_key(Dungeon), extras={'list_of_card_ids': (Dungeon.id, dungeon_cards.card_ids_by_dungeon)}
+        )
+    except ValueError as e:
+        return error_response(str(e), 400)
+    return success_response({'dungeons': dungeons, 'next_cursor': next_cursor})
 
 
 @api.route('/world/list/cards', methods=['GET'])
@@ -1145,12 +1095,23 @@ def list_world_dungeons():
 @require_auth
 @require_master
 def list_world_cards():
+    """A GM lapjai név szerint - limit / cursor / fields"""
     current_user = request.current_user
     world_id = request.args.get('world_id')
     if not world_id:
         return error_response('A világ azonosítója kötelező', 400)
-    cards = Card.query.filter_by(world_id=str(world_id), owner_id=current_user.id).all()
-    return success_response({'cards': [c.to_dict() for c in cards]})
+    columns = {field: getattr(Card, field) for field in CARD_FIELDS if field != 'picture'}
+    try:
+        list_args = listing.ListArgs.parse(request.args, CARD_FIELDS)
+        cards, next_cursor = listing.list_page(
+            lambda *selected: db.session.query(*selected).filter(
+                Card.world_id == str(world_id), Card.owner_id == current_user.id
+            ),
+            columns, list_args, keys=(Card.name, *listing.row_key(Card)), extras={'picture': (Card.picture_hash, pictures.get_pictures)}
+        )
+    except ValueError as e:
+        return error_response(str(e), 400)
+    return success_response({'cards': cards, 'next_cursor': next_cursor})
 
 
 @api.route('/world/user/removecard', methods=['DELETE'])
@@ -1164,51 +1125,32 @@ def remove_card_from_user():
 
     world_id = data.get('world_id', '').strip() if isinstance(data.get('world_id'), str) else ''
     card_id = data.get('card_id', '').strip() if isinstance(data.get('card_id'), str) else ''
-    user_id = data.get('user_id', '').strip() if isinstance(data.get('user_id'), str) else ''
-    user_ids = data.get('user_ids', []) if isinstance(data.get('user_ids', []), list) else []
 
     if not world_id:
         return error_response('A világ azonosítója kötelező', 400)
     if not card_id:
         return error_response('A kártya azonosítója kötelező', 400)
 
-    targets = []
-    if user_id:
-        targets = [user_id]
-    elif user_ids:
-        targets = [str(x).strip() for x in user_ids if str(x).strip()]
-    else:
+    targets = _target_ids(data.get('user_id'), data.get('user_ids'))
+    if not targets:
         return error_response('A felhasználó azonosítója kötelező', 400)
 
-    users = User.query.filter(User.id.in_(targets)).all()
-    found_ids = {u.id for u in users}
-    if len(found_ids) != len(targets):
+    found = memberships.check_users(world_id, targets)
+    if len(found) != len(targets):
         return error_response('Felhasználó nem található', 404)
+    if not all(is_member for _, is_member in found.values()):
+        return error_response('A felhasználó nincs ebben a világban', 403)
 
-    for u in users:
-        wm = u.world_ids or {}
-        if not (isinstance(wm, dict) and str(world_id) in wm):
-            return error_response('A felhasználó nincs ebben a világban', 403)
-
-    original_card = Card.query.get(card_id)
+    original_card = db.session.get(Card, card_id)
     if not original_card or str(original_card.world_id) != str(world_id):
         return error_response('Nem található kártya a megadott azonosítóval', 404)
 
     try:
-        total_removed = 0
-        for uid in targets:
-            user_copies = Card.query.filter_by(world_id=str(world_id), owner_id=uid, name=original_card.name).all()
-            if not user_copies:
-                continue
-            copy_ids = [c.id for c in user_copies]
-            leader_copies = []
-            if copy_ids:
-                leader_copies = Card.query.filter(Card.world_id == str(world_id), Card.owner_id == uid, Card.is_leader.in_(copy_ids)).all()
-            for c in leader_copies:
-                db.session.delete(c)
-            for c in user_copies:
-                db.session.delete(c)
-            total_removed += len(user_copies) + len(leader_copies)
+        # a lap és a belőle készült vezérek példányai - a sablonok maradnak
+        template_ids = [original_card.id] + [
+            cid for (cid,) in db.session.query(Card.id).filter(Card.is_leader == original_card.id)
+        ]
+        total_removed = instances.remove_instances(template_ids, targets)
         db.session.commit()
         return success_response({'message': 'Kártya(k) eltávolítva a felhasználóktól', 'removed': total_removed})
     except Exception:
@@ -1221,35 +1163,47 @@ def remove_card_from_user():
 @require_auth
 @require_master
 def list_world_users():
+    """A világ tagjai (a kérő nélkül) felhasználónév szerint - limit / cursor / fields"""
     current_user = request.current_user
     world_id = request.args.get('world_id')
     if not world_id:
         return error_response('A világ azonosítója kötelező', 400)
-    users = User.query.all()
-    result = []
-    for u in users:
-        if u.id == current_user.id:
-            continue
-        wm = u.world_ids or {}
-        if isinstance(wm, dict) and str(world_id) in wm:
-            result.append({
-                'id': u.id,
-                'username': u.username,
-                'is_master': bool(wm.get(str(world_id)))
-            })
-    return success_response({'users': result})
+    try:
+        list_args = listing.ListArgs.parse(request.args, MEMBER_FIELDS)
+        users, next_cursor = listing.list_page(
+            lambda *columns: db.session.query(*columns).select_from(WorldMembership).join(
+                User, User.id == WorldMembership.user_id
+            ).filter(WorldMembership.world_id == str(world_id), WorldMembership.user_id != current_user.id),
+            {'id': User.id, 'username': User.username, 'is_master': WorldMembership.is_master},
+            list_args, keys=(User.username,)
+        )
+    except ValueError as e:
+        return error_response(str(e), 400)
+    return success_response({'users': users, 'next_cursor': next_cursor})
 
 
 @api.route('/user/list/cards', methods=['GET'])
 @ratelimit
 @require_auth
 def list_user_cards():
+    """A user lapjai egy világban, pakli sorrendben - limit / cursor / fields"""
     user = request.current_user
     world_id = request.args.get('world_id')
     if not world_id:
         return error_response('A világ azonosítója kötelező', 400)
-    cards = Card.query.filter_by(owner_id=user.id, world_id=str(world_id)).all()
-    return success_response({'cards': [c.to_dict() for c in cards]})
+    columns = instances.instance_columns()
+    try:
+        list_args = listing.ListArgs.parse(request.args, INSTANCE_FIELDS)
+        cards, next_cursor = listing.list_page(
+            lambda *selected: db.session.query(*selected).select_from(CardInstance).join(
+                Card, Card.id == CardInstance.template_id
+            ).filter(CardInstance.owner_id == user.id, CardInstance.world_id == str(world_id)),
+            columns, list_args, keys=(CardInstance.position, *listing.row_key(CardInstance)),
+            extras={'picture': (Card.picture_hash, pictures.get_pictures)}
+        )
+    except ValueError as e:
+        return error_response(str(e), 400)
+    return success_response({'cards': cards, 'next_cursor': next_cursor})
 
 
 
@@ -1264,29 +1218,62 @@ def delete_card():
     card_id = data.get('card_id', '').strip() if isinstance(data.get('card_id'), str) else ''
     if not card_id:
         return error_response('A kártya azonosítója kötelező', 400)
-    card = Card.query.get(card_id)
-    if not card:
+    world_id = data.get('world_id') or request.args.get('world_id')
+    card = db.session.get(Card, card_id)
+    if not card or str(card.world_id) != str(world_id):
         return error_response('Kártya nem található', 404)
-    cards_to_delete = Card.query.filter_by(name=card.name, world_id=card.world_id).all()
-    card_ids_to_delete = [c.id for c in cards_to_delete]
-    leader_cards = Card.query.filter(Card.world_id == card.world_id, Card.is_leader.in_(card_ids_to_delete)).all()
-    leader_card_ids = [c.id for c in leader_cards]
-    all_ids_to_delete = set(card_ids_to_delete + leader_card_ids)
+    # a sablon és a belőle készült vezérek - a példányok template_id szerint mennek velük
+    all_ids_to_delete = [card.id] + [cid for (cid,) in db.session.query(Card.id).filter(Card.is_leader == card.id)]
     try:
-        dungeons = Dungeon.query.filter(Dungeon.list_of_card_ids != None, Dungeon.world_id == card.world_id).all()
-        for dungeon in dungeons:
-            if hasattr(dungeon, 'list_of_card_ids') and isinstance(dungeon.list_of_card_ids, list):
-                dungeon.list_of_card_ids = [cid for cid in dungeon.list_of_card_ids if cid not in all_ids_to_delete]
-        for c in cards_to_delete:
-            db.session.delete(c)
-        for c in leader_cards:
-            db.session.delete(c)
+        dungeon_cards.remove_cards(all_ids_to_delete)
+        instances.remove_instances(all_ids_to_delete)
+        cards_to_delete = Card.query.filter(Card.id.in_(all_ids_to_delete))
+        picture_hashes = pictures.picture_hashes(cards_to_delete)
+        cards_to_delete.delete(synchronize_session=False)
+        pictures.release_pictures(picture_hashes)
+        bump_world_version(world_id)
         db.session.commit()
         return success_response({'message': 'Kártyák (és vezérek) sikeresen törölve minden felhasználótól'})
     except Exception as e:
         db.session.rollback()
         return error_response('A kártyák törlése sikertelen', 500)
 
+@api.route('/edit/card', methods=['PUT'])
+@ratelimit
+@require_auth
+@require_master
+def edit_card():
+    """
+    Kártya átnevezése - a játékosok példányai a sablonból olvassák a nevet,
+    így ez egyetlen sor módosítása, akárhány játékosnak van meg
+    """
+    data = request.get_json()
+    if not data:
+        return error_response('A kérés törzse kötelező', 400)
+    world_id = data.get('world_id', '').strip() if isinstance(data.get('world_id'), str) else ''
+    card_id = data.get('card_id', '').strip() if isinstance(data.get('card_id'), str) else ''
+    new_name = data.get('name', '').strip() if isinstance(data.get('name'), str) else ''
+    if not card_id:
+        return error_response('A kártya azonosítója kötelező', 400)
+    if not new_name:
+        return error_response('Az új név kötelező', 400)
+    if len(new_name) > 16:
+        return error_response('A kártya neve legfeljebb 16 karakter lehet', 400)
+    card = db.session.get(Card, card_id)
+    if not card or str(card.world_id) != world_id:
+        return error_response('Kártya nem található', 404)
+    existing_card = Card.query.filter(Card.world_id == world_id, Card.name == new_name, Card.id != card.id).first()
+    if existing_card:
+        return error_response('Már létezik kártya ezzel a névvel ebben a világban', 409)
+    try:
+        card.name = new_name
+        bump_world_version(world_id)
+        db.session.commit()
+        return success_response({'message': 'A kártya neve frissítve', 'card': card.to_dict()})
+    except Exception:
+        db.session.rollback()
+        return error_response('A kártya frissítése sikertelen', 500)
+
 @api.route('/edit/world', methods=['PUT'])
 @ratelimit
 @require_auth
@@ -1306,6 +1293,7 @@ def edit_world():
         return error_response('A világ nem található', 404)
     try:
         world.name = new_name
+        bump_world_version(world_id)
         db.session.commit()
         return success_response({'message': 'A világ neve frissítve', 'world': world.to_dict()})
     except Exception as e:
@@ -1333,18 +1321,17 @@ def delete_world():
         return error_response('A világ nem található', 404)
     
     try:
-        Card.query.filter_by(world_id=world_id).delete()
-        Dungeon.query.filter_by(world_id=world_id).delete()
-        
-        users = User.query.all()
-        for user in users:
-            if user.world_ids and world_id in user.world_ids:
-                del user.world_ids[world_id]
-                user.world_ids = dict(user.world_ids)
-        
-        db.session.delete(world)
+        changed_user_ids, background = remove_world_rows(world_id, current_app.config['WORLD_DELETE_BACKGROUND_ROWS'])
         db.session.commit()
+        if background:
+            world_deleter.wake()
+        invalidate_principal(*changed_user_ids)
         
+        if background:
+            return success_response({
+                'message': 'A világ törölve, a kártyái a háttérben törlődnek',
+                'background': True
+            }, 202)
         return success_response({
             'message': 'A világ sikeresen törölve'
         })
@@ -1353,6 +1340,97 @@ def delete_world():
         return error_response('A világ törlése sikertelen', 500)
 
 
+@api.route('/world/clone', methods=['POST'])
+@ratelimit
+@require_auth
+@require_master
+def clone_world():
+    """
+    Világ másolása - lapok, vezérek, kazamaták, opcionálisan a játékosok és lapjaik
+
+    { world_id, name?, include_players? } - a másolat GM-je a kérő lesz.
+    Táblánként egy INSERT ... SELECT egy tranzakcióban (world_clone.py).
+    """
+    data = request.get_json()
+    if not data:
+        return error_response('A kérés törzse kötelező', 400)
+    world_id = data.get('world_id', '').strip() if isinstance(data.get('world_id'), str) else ''
+    name = data.get('name', '').strip() if isinstance(data.get('name'), str) else ''
+    include_players = data.get('include_players', False)
+    if not world_id:
+        return error_response('A világ azonosítója kötelező', 400)
+    if not isinstance(include_players, bool):
+        return error_response('Az include_players értéknek boolean-nak kell lennie', 400)
+    source = db.session.get(World, world_id)
+    if not source:
+        return error_response('A világ nem található', 404)
+    name = (name or f'{source.name} (másolat)')[:120]
+    try:
+        world, counts = copy_world(world_id, request.user_id, name, include_players=include_players)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        return error_response('A világ másolása sikertelen', 500)
+    invalidate_principal(*(user_id for user_id, _, _ in memberships.list_members(world.world_id)))
+    user = db.session.get(User, request.user_id)
+    return success_response({
+        'message': 'Világ sikeresen másolva',
+        'world': world.to_dict(),
+        'copied': counts,
+        'token': generate_token(user.id, current_app.config['SECRET_KEY'], claims=membership_claims(user)),
+    }, 201)
+
+
+@api.route('/world/export', methods=['GET'])
+@ratelimit
+@require_auth
+@require_master
+def export_world():
+    """
+    Világ mentése NDJSON folyamként (világ, tagok, képek, lapok, példányok, kazamaták)
+
+    Kötegenként olvas és ír, így a memória akkora világnál is állandó.
+    Visszatölteni a /world/import-tal lehet.
+    """
+    world_id = request.args.get('world_id')
+    if not db.session.get(World, world_id):
+        return error_response('A világ nem található', 404)
+    response = Response(stream_with_context(world_transfer.export_world(world_id)), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename="world-{world_id}.ndjson"'
+    return response
+
+
+@api.route('/world/import', methods=['POST'])
+@ratelimit
+@require_auth
+def import_world():
+    """
+    /world/export folyam betöltése új világként - a feltöltő lesz a game master
+
+    A törzs maga az NDJSON (nem JSON objektum), a nevet ?name=... felülírhatja.
+    Minden ID új lesz; a fájl tagjai nem kerülnek át (meghívó kóddal csatlakoznak),
+    és csak a feltöltő saját lapjai.
+    """
+    name = request.args.get('name', '').strip()[:120]
+    try:
+        world, counts = world_transfer.import_world(
+            request.stream, request.user_id, name=name or None,
+            background_rows=current_app.config['WORLD_DELETE_BACKGROUND_ROWS']
+        )
+    except world_transfer.ImportFailed as e:
+        return error_response(str(e), 400)
+    except Exception:
+        return error_response('A világ importálása sikertelen', 500)
+    invalidate_principal(request.user_id)
+    user = db.session.get(User, request.user_id)
+    return success_response({
+        'message': 'Világ sikeresen importálva',
+        'world': world.to_dict(),
+        'imported': counts,
+        'token': generate_token(user.id, current_app.config['SECRET_KEY'], claims=membership_claims(user)),
+    }, 201)
+
+
 @api.route('/delete/dungeon', methods=['DELETE'])
 @ratelimit
 @require_auth
@@ -1376,7 +1454,9 @@ def delete_dungeon():
         return error_response('Dungeon nem található', 404)
     
     try:
+        dungeon_cards.remove_dungeon(dungeon.id)
         db.session.delete(dungeon)
+        bump_world_version(world_id)
         db.session.commit()
         return success_response({'message': 'Dungeon sikeresen törölve'})
     except Exception as e:
@@ -1386,6 +1466,7 @@ def delete_dungeon():
 @api.route('/game/fight', methods=['GET'])
 @ratelimit
 @require_auth
+@idempotent
 def fight():
     """
     Harc logika - ez a játék szíve
@@ -1401,12 +1482,19 @@ def fight():
       - 4 kártyás: +2 health
       - 6 kártyás: +3 damage
     
-    Végén törli a cache-ből a dungeon választást (új választás lesz legközelebb)
+    ?view=lean - a kártyákból csak id, név, típus és statok jönnek, kép nélkül
+    (a képeket a kliens a /card/picture-ről kéri le és cache-eli)
+    
+    Idempotency-Key fejléccel az ismételt kérés a tárolt eredményt kapja,
+    nem harcol és nem fejleszt újra.
+    
+    Végén lépteti a harc epoch-ot (új kazamata választás lesz legközelebb)
     """
     user = request.current_user
     world_id = request.args.get('world_id')
     dungeon_id = request.args.get('dungeon_id')
     selected_card_id = request.args.get('selected_card_id')
+    lean = request.args.get('view') == 'lean'
     
     if not dungeon_id:
         return error_response('A dungeon azonosítója kötelező', 400)
@@ -1414,138 +1502,98 @@ def fight():
     if not selected_card_id:
         return error_response('A kiválasztott kártya azonosítója kötelező', 400)
     
-    dungeon = Dungeon.query.filter_by(id=str(dungeon_id)).first()
+    dungeon = get_dungeon_snapshot(dungeon_id)
     if not dungeon:
         return error_response('Dungeon nem található', 404)
     if world_id and str(dungeon.world_id) != str(world_id):
         return error_response('A dungeon nem ebben a világban található', 400)
     
-    selected_card = Card.query.filter_by(id=str(selected_card_id), owner_id=user.id, world_id=dungeon.world_id).first()
+    selected_card = CardInstance.query.filter_by(
+        id=str(selected_card_id), owner_id=user.id, world_id=dungeon.world_id
+    ).first()
     if not selected_card:
         return error_response('A kiválasztott kártya nem található vagy nem a tiéd', 404)
     
-    dungeon_card_ids = dungeon.list_of_card_ids or []
-    dungeon_cards = []
-    if dungeon_card_ids:
-        cards = Card.query.filter(Card.id.in_(dungeon_card_ids)).all()
-        card_map = {c.id: c for c in cards}
-        for cid in dungeon_card_ids:
-            if cid in card_map:
-                dungeon_cards.append(card_map[cid].to_dict())
-    player_cards = Card.query.filter(
-        Card.owner_id == user.id,
-        Card.world_id == dungeon.world_id,
-        Card.position != 0
-    ).order_by(Card.position).all()
-    player_deck = []
-    for idx, c in enumerate(player_cards):
-        d = c.to_dict()
-        d['position'] = idx + 1
-        player_deck.append(d)
-
-    if len(player_deck) != len(dungeon_cards):
+    dungeon_card_ids = dungeon.card_ids
+    deck_filters = (
+        CardInstance.owner_id == user.id,
+        CardInstance.world_id == dungeon.world_id,
+        CardInstance.position != 0
+    )
+    if lean:
+        player_query = instances.instance_rows(*deck_filters, fields=('id', 'name', 'type', 'damage', 'health'))
+    else:
+        player_query = CardInstance.query.filter(*deck_filters)
+    player_cards = player_query.order_by(CardInstance.position).all()
+
+    if len(player_cards) != len(dungeon.cards):
         return error_response('A pakli kártyáinak száma nem egyezik a kazamata kártyáinak számával', 400)
 
+    results = fight_engine.resolve(fight_engine.side_from_cards(player_cards), dungeon.side)
+
+    if not lean:
+        # A snapshotban nincs kép, a teljes válaszhoz külön kérjük le - a paklié is egy lekérdezés
+        picture_hashes = dict(db.session.query(Card.id, Card.picture_hash).filter(Card.id.in_(dungeon.side.ids)).all())
+        picture_urls = pictures.get_pictures(
+            set(picture_hashes.values()) | {c.picture_hash for c in player_cards} | {selected_card.picture_hash}
+        )
+
     battles = []
-    beats = {'t': 'f', 'f': 'v', 'v': 'l', 'l': 't'}
-    pairs = min(len(dungeon_cards), len(player_deck))
-    for i in range(pairs):
-        dc = dungeon_cards[i]
-        pc = player_deck[i]
-        try:
-            p_damage = int(pc.get('damage', 0))
-        except Exception:
-            p_damage = 0
-        try:
-            d_damage = int(dc.get('damage', 0))
-        except Exception:
-            d_damage = 0
-        try:
-            p_health = int(pc.get('health', 0))
-        except Exception:
-            p_health = 0
-        try:
-            d_health = int(dc.get('health', 0))
-        except Exception:
-            d_health = 0
-
-        p_can_kill = p_damage > d_health
-        d_can_kill = d_damage > p_health
-
-        winner = None
-        reason = None
-        if p_can_kill and not d_can_kill:
-            winner = 'player'
-            reason = 'damage'
-        elif d_can_kill and not p_can_kill:
-            winner = 'dungeon'
-            reason = 'damage'
+    for i, (battle_winner, reason) in enumerate(results):
+        if lean:
+            pc = _lean_card(player_cards[i], i + 1)
+            dc = _lean_card(dungeon.cards[i], i + 1)
         else:
-            p_type = (pc.get('type') or '').lower()
-            d_type = (dc.get('type') or '').lower()
-            if p_type and d_type and p_type != d_type:
-                if beats.get(p_type) == d_type:
-                    winner = 'player'
-                    reason = 'type'
-                elif beats.get(d_type) == p_type:
-                    winner = 'dungeon'
-                    reason = 'type'
-                else:
-                    winner = 'dungeon'
-                    reason = 'dungeon_fallback'
-            else:
-                winner = 'dungeon'
-                reason = 'dungeon_fallback'
-
+            pc = player_cards[i].to_dict(pictures=picture_urls)
+            pc['position'] = i + 1
+            dc = dungeon.cards[i]._asdict()
+            dc['picture'] = picture_urls.get(picture_hashes.get(dc['id']))
         battles.append({
             'position': i + 1,
             'player_card': pc,
             'dungeon_card': dc,
-            'winner': winner,
+            'winner': battle_winner,
             'reason': reason
         })
 
-    player_wins = sum(1 for b in battles if b.get('winner') == 'player')
-    dungeon_wins = sum(1 for b in battles if b.get('winner') == 'dungeon')
-    winner = 'player' if player_wins >= dungeon_wins else 'dungeon'
+    winner = fight_engine.overall_winner(results)
+
+    upgrade_type, upgrade_amount = None, 0
+    if winner == fight_engine.PLAYER:
+        upgrade_type, upgrade_amount = fight_engine.upgrade_for(len(dungeon_card_ids))
+
+    def commit_fight():
+        # Egyetlen UPDATE ... SET x = x + n, így párhuzamos harcoknál sem vész el fejlesztés
+        if upgrade_type:
+            column = getattr(CardInstance, upgrade_type + '_bonus')
+            CardInstance.query.filter_by(id=selected_card.id).update(
+                {column: column + upgrade_amount}, synchronize_session=False
+            )
+        # Új epoch = új kazamata ajánlat a következő /game/dungeon hívásnál
+        _advance_fight_epoch(user.id, dungeon.world_id)
+        db.session.commit()
 
     upgraded_card = None
-    if winner == 'player':
-        try:
-            num_cards = len(dungeon_card_ids)
-            
-            if num_cards == 1:
-                selected_card.damage += 1
-                upgrade_type = 'damage'
-                upgrade_amount = 1
-            elif num_cards == 4:
-                selected_card.health += 2
-                upgrade_type = 'health'
-                upgrade_amount = 2
-            elif num_cards == 6:
-                selected_card.damage += 3
-                upgrade_type = 'damage'
-                upgrade_amount = 3
-            else:
-                upgrade_type = None
-                upgrade_amount = 0
-            
-            if upgrade_type:
-                db.session.commit()
-                upgraded_card = {
-                    'card': selected_card.to_dict(),
-                    'upgrade_type': upgrade_type,
-                    'upgrade_amount': upgrade_amount
-                }
-        except Exception:
-            db.session.rollback()
-
     try:
-        world_id_for_key = str(dungeon.world_id)
-        cache_key = f"{user.id}:{world_id_for_key}"
-        _dungeon_selection_cache.pop(cache_key, None)
+        retry_on_db_lock(commit_fight)
+        if upgrade_type:
+            db.session.refresh(selected_card)
+            upgraded_card = {
+                'card': _lean_card(selected_card, selected_card.position) if lean else selected_card.to_dict(
+                    pictures=picture_urls
+                ),
+                'upgrade_type': upgrade_type,
+                'upgrade_amount': upgrade_amount
+            }
     except Exception:
-        pass
+        db.session.rollback()
+        current_app.logger.exception('A harc mentése sikertelen: %s', selected_card.id)
+        upgrade_type, upgrade_amount = None, 0
+
+    battle_log_writer.record(
+        user.id, dungeon.world_id, dungeon.id, [c.id for c in player_cards], results, winner,
+        upgrade_type, upgrade_amount
+    )
 
     return success_response({
         'winner': winner,
@@ -1553,12 +1601,421 @@ def fight():
         'upgraded_card': upgraded_card
     })
 
+
+def _stats_response(world_id, scope, subject_ids=None):
+    """battle_stats sorok egy scope-ra, opcionálisan szűrve"""
+    query = BattleStat.query.filter_by(world_id=str(world_id), scope=scope)
+    if subject_ids is not None:
+        query = query.filter(BattleStat.subject_id.in_(subject_ids))
+    return [s.to_dict() for s in query.all()]
+
+
+@api.route('/world/stats', methods=['GET'])
+@ratelimit
+@require_auth
+@require_master
+def world_stats():
+    """
+    Harc statisztika egy világra - a battle_stats számlálókból
+
+    scope: dungeon (alapból) / card / user
+    A napló kötegekben íródik, így pár másodperc késés lehet.
+    """
+    world_id = request.args.get('world_id')
+    scope = request.args.get('scope', 'dungeon')
+    if scope not in ('dungeon', 'card', 'user'):
+        return error_response('Érvénytelen scope. Csak a következők engedélyezettek: dungeon, card, user', 400)
+
+    stats = _stats_response(world_id, scope)
+    ids = [s['subject_id'] for s in stats]
+    names = {}
+    if ids and scope == 'dungeon':
+        names = dict(db.session.query(Dungeon.id, Dungeon.name).filter(Dungeon.id.in_(ids)).all())
+    elif ids and scope == 'card':
+        # a játékosok kártyái példányok, a név a sablonból jön
+        names = dict(db.session.query(CardInstance.id, Card.name).join(
+            Card, Card.id == CardInstance.template_id
+        ).filter(CardInstance.id.in_(ids)).all())
+    elif ids and scope == 'user':
+        names = dict(db.session.query(User.id, User.username).filter(User.id.in_(ids)).all())
+    for s in stats:
+        s['name'] = names.get(s['subject_id'])
+    return success_response({'world_id': world_id, 'scope': scope, 'stats': stats})
+
+
+@api.route('/user/stats', methods=['GET'])
+@ratelimit
+@require_auth
+def user_stats():
+    """Saját harc statisztika egy világban - összesítve és kártyánként"""
+    user = request.current_user
+    world_id = request.args.get('world_id')
+    if not world_id:
+        return error_response('A világ azonosítója kötelező', 400)
+
+    overall = _stats_response(world_id, 'user', [user.id])
+    card_ids = [cid for (cid,) in db.session.query(CardInstance.id).filter_by(owner_id=user.id, world_id=str(world_id))]
+    cards = _stats_response(world_id, 'card', card_ids) if card_ids else []
+    return success_response({
+        'world_id': world_id,
+        'overall': overall[0] if overall else {'subject_id': user.id, 'fights': 0, 'wins': 0, 'win_rate': None},
+        'cards': cards
+    })
+
+
+def _lean_card(card, position):
+    """Kártya kép nélkül - a lean harc válaszhoz"""
+    return {
+        'id': card.id,
+        'name': card.name,
+        'type': card.type,
+        'damage': card.damage,
+        'health': card.health,
+        'position': position
+    }
+
+
+@api.route('/card/picture', methods=['GET'])
+@ratelimit
+@require_auth
+def get_card_picture():
+    """
+    Egy kártya képe külön
+
+    ETag-et küld, így a kliens If-None-Match-csel 304-et kap ha már megvan neki.
+    Csak a kártya világának tagjai kérhetik le.
+    """
+    user = request.current_user
+    card_id = request.args.get('card_id')
+    if not card_id:
+        return error_response('A kártya azonosítója kötelező', 400)
+
+    row = db.session.query(Card.world_id, Card.picture_hash).filter(Card.id == str(card_id)).first()
+    if not row:
+        # játékos példány - a kép a sablonjáé
+        row = db.session.query(CardInstance.world_id, Card.picture_hash).join(
+            Card, Card.id == CardInstance.template_id
+        ).filter(CardInstance.id == str(card_id)).first()
+    if not row:
+        return error_response('Kártya nem található', 404)
+    if not (isinstance(user.world_ids, dict) and str(row.world_id) in user.world_ids):
+        return error_response('Nincs jogosultságod ehhez a művelethez', 403)
+
+    # a kép hash-e a tartalomból jön, így ETag-nek is jó (a másolatok ugyanazt kapják)
+    etag = row.picture_hash or hashlib.sha1(b'').hexdigest()
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'private, max-age=86400'}
+    if etag in request.if_none_match:
+        return '', 304, headers
+
+    response, status = success_response({
+        'card_id': str(card_id),
+        'picture': pictures.get_pictures([row.picture_hash]).get(row.picture_hash)
+    })
+    return response, status, headers
+
+
+def _load_dungeon_sides(dungeons):
+    """
+    Kazamaták kártyái Side formában, egyetlen oszlop-szintű query-vel
+
+    Képet és teljes Card objektumot nem tölt be, csak a harchoz kellő számokat.
+    """
+    rows_by_dungeon = {d.id: [] for d in dungeons}
+    if rows_by_dungeon:
+        rows = db.session.query(
+            DungeonCard.dungeon_id, Card.id, Card.damage, Card.health, Card.type
+        ).join(Card, Card.id == DungeonCard.card_id).filter(
+            DungeonCard.dungeon_id.in_(list(rows_by_dungeon))
+        ).order_by(DungeonCard.dungeon_id, DungeonCard.position)
+        for dungeon_id, *row in rows:
+            rows_by_dungeon[dungeon_id].append(row)
+    return {dungeon_id: fight_engine.make_side(rows) for dungeon_id, rows in rows_by_dungeon.items()}
+
+
+@api.route('/game/simulate', methods=['POST'])
+@ratelimit
+@require_auth
+@require_master
+def simulate_fights():
+    """
+    Szimuláció - egy pakli a világ összes kazamatája ellen
+
+    Game mastereknek balanszoláshoz. Vagy egy játékos aktuális paklija
+    (user_id, alapból a sajátod), vagy egy tetszőleges card_ids lista.
+    Csak olvas: nincs fejlesztés, nincs commit.
+    """
+    user = request.current_user
+    data = request.get_json()
+    if not data:
+        return error_response('A kérés törzse kötelező', 400)
+
+    world_id = str(data.get('world_id'))
+    card_ids = data.get('card_ids')
+    deck_owner_id = data.get('user_id', '').strip() if isinstance(data.get('user_id'), str) else ''
+
+    if card_ids is not None:
+        if not isinstance(card_ids, list):
+            return error_response('A card_ids-nak listának kell lennie', 400)
+        card_ids = [str(x).strip() for x in card_ids if str(x).strip()]
+        if len(card_ids) not in (1, 4, 6):
+            return error_response('Pontosan 1, 4 vagy 6 kártyát kell megadni', 400)
+        if len(set(card_ids)) != len(card_ids):
+            return error_response('Ismétlődő kártya azonosítók', 400)
+        # játékos példányok és a GM saját lapjai (sablonok) is lehetnek benne
+        rows = instances.instance_rows(CardInstance.id.in_(card_ids), CardInstance.world_id == world_id).all()
+        rows += db.session.query(Card.id, Card.damage, Card.health, Card.type).filter(
+            Card.id.in_(card_ids), Card.world_id == world_id
+        ).all()
+        if len(rows) != len(card_ids):
+            return error_response('Nem található kártya a megadott azonosítókkal', 404)
+        row_map = {row.id: row for row in rows}
+        deck_rows = [row_map[cid] for cid in card_ids]
+    else:
+        deck_rows = instances.instance_rows(
+            CardInstance.owner_id == (deck_owner_id or user.id),
+            CardInstance.world_id == world_id,
+            CardInstance.position != 0
+        ).order_by(CardInstance.position).all()
+        if not deck_rows:
+            return error_response('A játékosnak nincs paklija ebben a világban', 404)
+
+    dungeons = Dungeon.query.filter_by(world_id=world_id).all()
+    if not dungeons:
+        return error_response('A játékmester még nem hozott létre kazamatát ebben a világban', 404)
+
+    deck = fight_engine.make_side(deck_rows)
+    sides = _load_dungeon_sides(dungeons)
+    report = fight_engine.simulate(deck, sides)
+
+    results = []
+    wins = 0
+    losses = 0
+    for dungeon in dungeons:
+        side = sides[dungeon.id]
+        outcome = report[dungeon.id]
+        entry = {
+            'dungeon_id': dungeon.id,
+            'name': dungeon.name,
+            'number_of_cards': len(side.ids),
+            'comparable': outcome is not None,
+        }
+        if outcome is not None:
+            player_wins, dungeon_wins = fight_engine.count_wins(outcome)
+            winner = fight_engine.overall_winner(outcome)
+            upgrade_type, upgrade_amount = fight_engine.upgrade_for(len(side.ids))
+            entry.update({
+                'winner': winner,
+                'player_wins': player_wins,
+                'dungeon_wins': dungeon_wins,
+                'battles': [{
+                    'position': i + 1,
+                    'player_card_id': deck.ids[i],
+                    'dungeon_card_id': side.ids[i],
+                    'winner': battle_winner,
+                    'reason': reason
+                } for i, (battle_winner, reason) in enumerate(outcome)],
+                'would_upgrade': {'upgrade_type': upgrade_type, 'upgrade_amount': upgrade_amount} if winner == fight_engine.PLAYER and upgrade_type else None
+            })
+            if winner == fight_engine.PLAYER:
+                wins += 1
+            else:
+                losses += 1
+        results.append(entry)
+
+    return success_response({
+        'deck': list(deck.ids),
+        'results': results,
+        'summary': {
+            'wins': wins,
+            'losses': losses,
+            'skipped': len(results) - wins - losses
+        }
+    })
+
+@api.route('/game/optimize', methods=['GET'])
+@ratelimit
+@require_auth
+def optimize_deck():
+    """
+    Pakli optimalizáló - a saját gyűjteményből a legjobb pakli egy kazamata ellen
+
+    Visszaadja a kártyákat pozíció sorrendben és a várható eredményt.
+    Nem állítja be a paklit, azt a kliens a /deck-kel teheti meg.
+    """
+    user = request.current_user
+    world_id = request.args.get('world_id')
+    dungeon_id = request.args.get('dungeon_id')
+
+    if not dungeon_id:
+        return error_response('A dungeon azonosítója kötelező', 400)
+
+    dungeon = Dungeon.query.filter_by(id=str(dungeon_id)).first()
+    if not dungeon:
+        return error_response('Dungeon nem található', 404)
+    if world_id and str(dungeon.world_id) != str(world_id):
+        return error_response('A dungeon nem ebben a világban található', 400)
+
+    rows = instances.instance_rows(
+        CardInstance.owner_id == user.id,
+        CardInstance.world_id == dungeon.world_id
+    ).all()
+    collection = fight_engine.make_side(rows)
+    dungeon_side = _load_dungeon_sides([dungeon])[dungeon.id]
+
+    indexes = fight_engine.best_deck(collection, dungeon_side)
+    if indexes is None:
+        return error_response('Nincs elég kártyád ehhez a kazamatához', 400)
+
+    deck = fight_engine.pick(collection, indexes)
+    results = fight_engine.resolve(deck, dungeon_side)
+    player_wins, dungeon_wins = fight_engine.count_wins(results)
+
+    return success_response({
+        'dungeon_id': dungeon.id,
+        'card_ids': list(deck.ids),
+        'winner': fight_engine.overall_winner(results),
+        'player_wins': player_wins,
+        'dungeon_wins': dungeon_wins,
+        'battles': [{
+            'position': i + 1,
+            'player_card_id': deck.ids[i],
+            'dungeon_card_id': dungeon_side.ids[i],
+            'winner': battle_winner,
+            'reason': reason
+        } for i, (battle_winner, reason) in enumerate(results)]
+    })
+
+@api.route('/world/balance', methods=['GET'])
+@ratelimit
+@require_auth
+@require_master
+def world_balance_report():
+    """
+    Balansz riport - minden játékos aktuális paklija minden kazamata ellen
+
+    NDJSON-t streamel (egy JSON objektum soronként), így a válasz azonnal
+    elindul és nem tartja a workert amíg az egész kész lesz:
+      - header: kazamaták listája
+      - player: játékosonként az eredmények kazamatánként
+      - summary: győzelmi arány kazamatánként + kártyánkénti "carry" statisztika
+
+    Ugyanazt a fight_engine-t használja mint a /game/fight.
+    """
+    current_user = request.current_user
+    world_id = str(request.args.get('world_id'))
+
+    dungeons = Dungeon.query.filter_by(world_id=world_id).all()
+    sides = _load_dungeon_sides(dungeons)
+
+    deck_rows = instances.instance_rows(
+        CardInstance.world_id == world_id,
+        CardInstance.position > 0,
+        CardInstance.owner_id != current_user.id,
+        fields=('owner_id', 'id', 'damage', 'health', 'type', 'name')
+    ).order_by(CardInstance.owner_id, CardInstance.position).all()
+
+    decks = {}
+    card_names = {}
+    for row in deck_rows:
+        decks.setdefault(row.owner_id, []).append((row.id, row.damage, row.health, row.type))
+        card_names[row.id] = row.name
+    usernames = {}
+    if decks:
+        usernames = dict(db.session.query(User.id, User.username).filter(User.id.in_(list(decks))).all())
+
+    def generate():
+        yield json.dumps({
+            'type': 'header',
+            'world_id': world_id,
+            'players': len(decks),
+            'dungeons': [{'id': d.id, 'name': d.name, 'number_of_cards': len(sides[d.id].ids)} for d in dungeons]
+        }) + '\n'
+
+        dungeon_stats = {d.id: {'fights': 0, 'wins': 0} for d in dungeons}
+        card_stats = {}
+        for owner_id, rows in decks.items():
+            deck = fight_engine.make_side(rows)
+            report = fight_engine.simulate(deck, sides)
+            results = {}
+            for dungeon_id, outcome in report.items():
+                if outcome is None:
+                    results[dungeon_id] = None
+                    continue
+                winner = fight_engine.overall_winner(outcome)
+                results[dungeon_id] = winner
+                dungeon_stats[dungeon_id]['fights'] += 1
+                for card_id, (battle_winner, _) in zip(deck.ids, outcome):
+                    stats = card_stats.setdefault(card_names[card_id], {
+                        'battles': 0, 'battle_wins': 0, 'fights_won': 0, 'carried': 0
+                    })
+                    stats['battles'] += 1
+                    if battle_winner == fight_engine.PLAYER:
+                        stats['battle_wins'] += 1
+                    if winner == fight_engine.PLAYER:
+                        stats['fights_won'] += 1
+                        if battle_winner == fight_engine.PLAYER:
+                            stats['carried'] += 1
+                if winner == fight_engine.PLAYER:
+                    dungeon_stats[dungeon_id]['wins'] += 1
+            yield json.dumps({
+                'type': 'player',
+                'user_id': owner_id,
+                'username': usernames.get(owner_id),
+                'deck': list(deck.ids),
+                'results': results
+            }) + '\n'
+
+        for stats in dungeon_stats.values():
+            stats['win_rate'] = stats['wins'] / stats['fights'] if stats['fights'] else None
+        cards = []
+        for name, stats in sorted(card_stats.items()):
+            cards.append({
+                'name': name,
+                'battles': stats['battles'],
+                'battle_wins': stats['battle_wins'],
+                'battle_win_rate': stats['battle_wins'] / stats['battles'],
+                # a megnyert harcok hány százalékában nyerte meg a saját párosítását
+                'carry': stats['carried'] / stats['fights_won'] if stats['fights_won'] else None
+            })
+        yield json.dumps({'type': 'summary', 'dungeons': dungeon_stats, 'cards': cards}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@api.route('/metrics', methods=['GET'])
+@ratelimit
+def metrics():
+    """
+    Működési számok - rate limit policyk és számlálók, cache találati arányok
+
+    Üzemeltetői végpont: X-Metrics-Token fejléc kell (METRICS_TOKEN), a
+    játékosok tokenje nem elég. METRICS_TOKEN nélkül 404.
+    A számlálók ennek a worker folyamatnak a sajátjai, újraindításkor nulláznak.
+    """
+    expected = current_app.config.get('METRICS_TOKEN')
+    if not expected:
+        return error_response('Nem található', 404)
+    given = request.headers.get('X-Metrics-Token', '')
+    if not hmac.compare_digest(given.encode('utf-8'), expected.encode('utf-8')):
+        return error_response('Nincs jogosultságod ehhez a művelethez', 403)
+    return success_response({
+        'ratelimit': limiter.metrics(),
+        'dungeon_cache': dungeon_cache_stats(),
+        'principal_cache': principal_cache_stats(),
+        'passwords': password_hasher.stats()
+    })
+
 @api.route('/health', methods=['GET'])
 @ratelimit
 def health_check():
     """Health check endpoint - deployment-hez hasznos"""
     return success_response({'status': 'egészséges'})
 
+@api.errorhandler(PasswordBusy)
+def password_busy(error):
+    """Tele a bcrypt sor - 503, a kliens Retry-After után próbálja újra"""
+    return error_response('A szerver túlterhelt, próbáld újra később', 503,
+                          {'Retry-After': str(max(1, round(error.retry_after)))})
+
 @api.errorhandler(404)
 def not_found(error):
     """404-es hibák kezelése"""
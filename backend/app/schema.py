@@ -0,0 +1,269 @@
+"""
+Adatbázis séma karbantartás - számozott migrációk (MIGRATIONS, schema_migrations tábla)
+
+Minden lépés egy zárolt tranzakció a DDL-lel együtt, és csak a saját változását
+írja le - a régieket ne módosítsd, új változás a lista végére.
+"""
+import json
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+
+def add_column(conn, table, column, ddl):
+    """Egy oszlop hozzáadása, ha még nincs - ddl: típus (+ NOT NULL DEFAULT ...)"""
+    inspector = inspect(conn)
+    if not inspector.has_table(table):
+        return False
+    if column in {c['name'] for c in inspector.get_columns(table)}:
+        return False
+    conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+    return True
+
+
+def create_indexes(conn, indexes):
+    """(név, tábla, oszlopok) indexek létrehozása, ha még nincsenek"""
+    for name, table, columns in indexes:
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})'))
+    return len(indexes)
+
+
+def add_membership_version(db, conn):
+    # NOT NULL csak alapértékkel adható hozzá, különben a meglévő sorok sértenék
+    return add_column(conn, 'users', 'membership_version', 'INTEGER NOT NULL DEFAULT 0')
+
+
+def add_world_version(db, conn):
+    return add_column(conn, 'worlds', 'version', 'INTEGER NOT NULL DEFAULT 0')
+
+
+def add_battle_history_indexes(db, conn):
+    return create_indexes(conn, [
+        ('ix_battle_log_world_id', 'battle_log', ('world_id',)),
+        ('ix_fight_epochs_world_id', 'fight_epochs', ('world_id',)),
+    ])
+
+
+def add_query_indexes(db, conn):
+    return create_indexes(conn, [
+        ('ix_cards_owner_world_position', 'cards', ('owner_id', 'world_id', 'position')),
+        ('ix_cards_world_name', 'cards', ('world_id', 'name')),
+        ('ix_cards_is_leader', 'cards', ('is_leader',)),
+        ('ix_dungeons_world_id', 'dungeons', ('world_id',)),
+        ('ix_users_verification_token', 'users', ('verification_token',)),
+        ('ix_users_password_reset_token', 'users', ('password_reset_token',)),
+    ])
+
+
+def copy_world_memberships(db, conn):
+    """users.world_ids JSON -> world_memberships sorok (törölt világokra mutatók kimaradnak)"""
+    from app.models import WorldMembership
+
+    table = WorldMembership.__table__
+    table.create(conn, checkfirst=True)
+    worlds = {world_id for (world_id,) in conn.execute(text('SELECT world_id FROM worlds'))}
+    existing = {tuple(row) for row in conn.execute(text('SELECT user_id, world_id FROM world_memberships'))}
+    rows = []
+    for user_id, raw in conn.execute(text('SELECT id, world_ids FROM users WHERE world_ids IS NOT NULL')):
+        world_map = json.loads(raw) if isinstance(raw, str) else raw
+        if not isinstance(world_map, dict):
+            continue  # régen [] volt az alapérték
+        for world_id, is_master in world_map.items():
+            if world_id in worlds and (user_id, world_id) not in existing:
+                rows.append({'user_id': user_id, 'world_id': world_id, 'is_master': is_master is True})
+    if rows:
+        conn.execute(table.insert(), rows)
+    return len(rows)
+
+
+def move_card_pictures(db, conn, batch_size=500):
+    """
+    cards.picture (base64 string soronként) -> card_pictures (egyszer, nyers bájtként)
+
+    Kötegekben halad, hogy a nagy képek ne legyenek egyszerre a memóriában.
+    A régi oszlopot kiüríti - a fájl a VACUUM után lesz kisebb.
+    """
+    from app.models import CardPicture
+    from app.pictures import encode_picture, picture_hash
+
+    CardPicture.__table__.create(conn, checkfirst=True)
+    add_column(conn, 'cards', 'picture_hash', 'VARCHAR(64)')
+    create_indexes(conn, [('ix_cards_picture_hash', 'cards', ('picture_hash',))])
+    known = {digest for (digest,) in conn.execute(text('SELECT hash FROM card_pictures'))}
+    moved = 0
+    while True:
+        rows = conn.execute(text(
+            'SELECT id, picture FROM cards WHERE picture IS NOT NULL LIMIT :limit'
+        ), {'limit': batch_size}).fetchall()
+        if not rows:
+            return moved
+        pictures, updates = [], []
+        for card_id, raw in rows:
+            value = raw.decode('utf-8') if isinstance(raw, bytes) else str(raw)
+            digest = None
+            if value:
+                mime, data = encode_picture(value)
+                digest = picture_hash(mime, data)
+                if digest not in known:
+                    known.add(digest)
+                    pictures.append({'hash': digest, 'mime': mime, 'data': data, 'created_at': datetime.utcnow()})
+            updates.append({'card_id': card_id, 'digest': digest})
+        if pictures:
+            conn.execute(CardPicture.__table__.insert(), pictures)
+        conn.execute(text(
+            'UPDATE cards SET picture_hash = :digest, picture = NULL WHERE id = :card_id'
+        ), updates)
+        moved += len(rows)
+
+
+def split_card_instances(db, conn):
+    """
+    Játékos másolatok (cards sorok) -> card_instances
+
+    Világonként és név szerint csoportosít (régen a másolatot a név kötötte
+    az eredetihez). A sablon a csoport legrégebbi GM-es lapja, a többi sor
+    példány lesz ugyanazzal az ID-val (pakli, statisztika, kliens hivatkozás
+    megmarad), a stat különbség bónuszként. Ha a csoportban nincs GM lap,
+    a legrégebbi sorból új sablon készül.
+    """
+    from app.models import CardInstance
+    from app.utils import generate_unique_id
+
+    CardInstance.__table__.create(conn, checkfirst=True)  # az indexeivel együtt
+    masters = {tuple(row) for row in conn.execute(text(
+        'SELECT user_id, world_id FROM world_memberships WHERE is_master'
+    ))}
+    groups = {}
+    for row in conn.execute(text(
+        'SELECT id, world_id, owner_id, name, health, damage, position FROM cards ORDER BY rowid'
+    )):
+        groups.setdefault((row.world_id, row.name), []).append(row)
+
+    instances, moved_to = [], {}
+    for rows in groups.values():
+        template = next((r for r in rows if (r.owner_id, r.world_id) in masters), None)
+        if template is not None:
+            template_id = template.id
+        else:
+            template, template_id = rows[0], generate_unique_id()
+            conn.execute(text(
+                'INSERT INTO cards (id, world_id, owner_id, name, picture_hash, health, damage, type, position, is_leader) '
+                'SELECT :new_id, world_id, owner_id, name, picture_hash, health, damage, type, 0, is_leader '
+                'FROM cards WHERE id = :card_id'
+            ), {'new_id': template_id, 'card_id': template.id})
+        for r in rows:
+            if r.id == template_id:
+                continue
+            moved_to[r.id] = template_id
+            instances.append({
+                'id': r.id, 'template_id': template_id, 'world_id': r.world_id, 'owner_id': r.owner_id,
+                'health_bonus': r.health - template.health, 'damage_bonus': r.damage - template.damage,
+                'position': r.position,
+            })
+    if not instances:
+        return 0
+
+    conn.execute(CardInstance.__table__.insert(), instances)
+    conn.execute(text('UPDATE cards SET position = 0'))
+    conn.execute(text('DELETE FROM cards WHERE id = :id'), [{'id': card_id} for card_id in moved_to])
+    # ha egy kazamata másolatra mutatott, ezentúl a sablonra mutat
+    for dungeon_id, raw in conn.execute(text('SELECT id, list_of_card_ids FROM dungeons')).fetchall():
+        card_ids = json.loads(raw) if isinstance(raw, str) else raw
+        if isinstance(card_ids, list) and any(cid in moved_to for cid in card_ids):
+            conn.execute(text('UPDATE dungeons SET list_of_card_ids = :ids WHERE id = :id'), {
+                'id': dungeon_id, 'ids': json.dumps([moved_to.get(cid, cid) for cid in card_ids])
+            })
+    return len(instances)
+
+
+def copy_dungeon_cards(db, conn):
+    """dungeons.list_of_card_ids JSON -> dungeon_cards sorok (törölt lapokra mutatók kimaradnak)"""
+    from app.models import DungeonCard
+
+    DungeonCard.__table__.create(conn, checkfirst=True)
+    cards = {card_id for (card_id,) in conn.execute(text('SELECT id FROM cards'))}
+    done = {dungeon_id for (dungeon_id,) in conn.execute(text('SELECT DISTINCT dungeon_id FROM dungeon_cards'))}
+    rows = []
+    for dungeon_id, raw in conn.execute(text('SELECT id, list_of_card_ids FROM dungeons')):
+        card_ids = json.loads(raw) if isinstance(raw, str) else raw
+        if dungeon_id in done or not isinstance(card_ids, list):
+            continue
+        kept = [card_id for card_id in card_ids if card_id in cards]
+        rows += [{'dungeon_id': dungeon_id, 'position': i + 1, 'card_id': card_id} for i, card_id in enumerate(kept)]
+    if rows:
+        conn.execute(DungeonCard.__table__.insert(), rows)
+    return len(rows)
+
+
+MIGRATION_LOCK_TIMEOUT = 600  # másodperc - ennyit vár a másik folyamat migrációjára
+
+# (verzió, leírás, lépés(db, conn)) - sorrendben futnak, a régieket ne módosítsd
+MIGRATIONS = [
+    (1, 'users.membership_version oszlop', add_membership_version),
+    (2, 'indexek a gyakori lekérdezésekhez', add_query_indexes),
+    (3, 'users.world_ids JSON -> world_memberships tábla', copy_world_memberships),
+    (4, 'cards.picture -> card_pictures tábla (hash szerint)', move_card_pictures),
+    (5, 'játékos másolatok -> card_instances (sablon + példány)', split_card_instances),
+    (6, 'dungeons.list_of_card_ids JSON -> dungeon_cards tábla', copy_dungeon_cards),
+    (7, 'worlds.version oszlop (kazamata cache érvénytelenítés)', add_world_version),
+    (8, 'battle_log / fight_epochs world_id indexek (világ törlés)', add_battle_history_indexes),
+]
+
+
+@contextmanager
+def _locked(conn):
+    """Egy tranzakció a migrációs zárral - SQLite-on írási zár, PostgreSQL-en tábla zár"""
+    dialect = conn.dialect.name
+    conn.exec_driver_sql('BEGIN IMMEDIATE' if dialect == 'sqlite' else 'BEGIN')
+    try:
+        if dialect == 'postgresql':
+            conn.exec_driver_sql('LOCK TABLE schema_migrations IN EXCLUSIVE MODE')
+        yield
+        conn.exec_driver_sql('COMMIT')
+    except Exception:
+        conn.exec_driver_sql('ROLLBACK')
+        raise
+
+
+def migrate(db):
+    """
+    Hiányzó táblák létrehozása (create_all) és a még le nem futott migrációk
+
+    Induláskor ezt kell hívni a db.create_all() helyett: a táblák létrehozása
+    is a zár alatt fut, így párhuzamosan induló folyamatok sem ütköznek.
+    Visszaadja a most lefuttatott verziók listáját.
+    """
+    applied = []
+    # AUTOCOMMIT: a driver nem nyit magától tranzakciót, a BEGIN / COMMIT a miénk
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'version INTEGER PRIMARY KEY, description VARCHAR(200) NOT NULL, applied_at TIMESTAMP NOT NULL)'
+        ))
+        sqlite = conn.dialect.name == 'sqlite'
+        if sqlite:
+            # egy hosszú migráció alatt a másik folyamat várjon, ne dobjon "database is locked"-ot
+            busy_timeout = conn.exec_driver_sql('PRAGMA busy_timeout').scalar()
+            conn.exec_driver_sql(f'PRAGMA busy_timeout = {MIGRATION_LOCK_TIMEOUT * 1000}')
+        try:
+            with _locked(conn):
+                db.metadata.create_all(conn)
+            for version, description, step in MIGRATIONS:
+                with _locked(conn):
+                    done = conn.execute(
+                        text('SELECT 1 FROM schema_migrations WHERE version = :version'), {'version': version}
+                    ).first()
+                    if done:
+                        continue
+                    step(db, conn)
+                    conn.execute(
+                        text('INSERT INTO schema_migrations (version, description, applied_at) '
+                             'VALUES (:version, :description, :applied_at)'),
+                        {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+                    )
+                    applied.append(version)
+        finally:
+            if sqlite:
+                conn.exec_driver_sql(f'PRAGMA busy_timeout = {busy_timeout}')
+    return applied
@@ -1,4 +1,6 @@
 import uuid
+import time
+import random
 
 def generate_unique_id():
     """32 karakteres hex ID generálás - ezzel azonosítunk mindent"""
@@ -6,12 +8,13 @@ def generate_unique_id():
 
 from flask import jsonify
 import re
-import bcrypt
 import jwt
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import request
 
+from app.passwords import password_hasher
+
 
 def success_response(data, status_code=200):
     """
@@ -27,37 +30,44 @@ def success_response(data, status_code=200):
     return jsonify(response), status_code
 
 
-def error_response(message, status_code=400):
+def error_response(message, status_code=400, headers=None):
     """
     Szabványos error válasz JSON formátumban
     
     Példa:
         return error_response('Valami elromlott', 500)
+        return error_response('Túl sok kérés', 429, {'Retry-After': '5'})
     """
     response = {
         'success': False,
         'error': message
     }
+    if headers:
+        return jsonify(response), status_code, headers
     return jsonify(response), status_code
 
 
-def paginate_query(query, page=1, per_page=10):
+def retry_on_db_lock(func, attempts=5, base_delay=0.05, max_delay=1.0):
     """
-    SQLAlchemy query lapozása
-    
-    Ez még nincs használva, de ha sok adat lenne jó lenne
+    Adatbázis művelet újrapróbálása SQLite zárolásnál
+
+    Ha a func "database is locked" hibát dob, rollback után újrapróbálja
+    exponenciálisan növő (jitteres) várakozással. Más hibát továbbdob,
+    és az utolsó próbálkozás hibáját is.
     """
-    paginated = query.paginate(page=page, per_page=per_page, error_out=False)
-    
-    return {
-        'items': [item.to_dict() for item in paginated.items],
-        'total': paginated.total,
-        'pages': paginated.pages,
-        'current_page': page,
-        'per_page': per_page,
-        'has_next': paginated.has_next,
-        'has_prev': paginated.has_prev
-    }
+    from sqlalchemy.exc import OperationalError
+    from app.models import db
+
+    for attempt in range(attempts):
+        try:
+            return func()
+        except OperationalError as e:
+            db.session.rollback()
+            locked = 'locked' in str(e).lower() or 'busy' in str(e).lower()
+            if not locked or attempt == attempts - 1:
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            time.sleep(delay * (0.5 + random.random() / 2))
 
 
 def validate_email(email):
@@ -96,22 +106,32 @@ def validate_password(password):
 
 
 def hash_password(password):
-    """bcrypt hash - biztonságos jelszó tárolás"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    """
+    bcrypt hash - biztonságos jelszó tárolás
+
+    A bcrypt szálkészleten fut, tele sornál PasswordBusy-t dob (app.passwords)
+    """
+    return password_hasher.hash(password)
 
 
 def verify_password(password, password_hash):
     """Jelszó ellenőrzés hash-el szemben"""
-    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    return password_hasher.verify(password, password_hash)
 
 
-def generate_token(user_id, secret_key, expiration_hours=24):
-    """JWT token generálás - 24 óra lejárattal"""
+def generate_token(user_id, secret_key, expiration_hours=24, claims=None):
+    """
+    JWT token generálás - 24 óra lejárattal
+
+    claims: extra mezők, pl. a tagság claim (principals.membership_claims)
+    """
     payload = {
         'user_id': user_id,
         'exp': datetime.utcnow() + timedelta(hours=expiration_hours),
         'iat': datetime.utcnow()  # issued at
     }
+    if claims:
+        payload.update(claims)
     return jwt.encode(payload, secret_key, algorithm='HS256')
 
 
@@ -134,11 +154,15 @@ def require_auth(f):
         @require_auth
         def protected_endpoint():
             user = request.current_user
+
+    A request.current_user egy cache-elt Principal (id, username, world_ids),
+    nem ORM objektum - módosításhoz load_current_user() kell.
+    Ha a token tagság claimje elavult, request.refreshed_token-be új token kerül.
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
         from flask import current_app
-        from app.models import User
+        from app.principals import principal_from_token, membership_claims
         
         auth_header = request.headers.get('Authorization')
         if not auth_header:
@@ -155,11 +179,16 @@ def require_auth(f):
             return error_response('Érvénytelen vagy lejárt token', 401)
         
         user_id = payload['user_id']
-        user = User.query.get(user_id)
+        user, stale = principal_from_token(payload)
         
         if not user:
             return error_response('Felhasználó nem található', 401)
         
+        if stale:
+            request.refreshed_token = generate_token(
+                user.id, current_app.config['SECRET_KEY'], claims=membership_claims(user)
+            )
+        
         # Requestbe rakjuk a user adatokat
         request.user_id = user_id
         request.current_user = user
@@ -167,6 +196,16 @@ def require_auth(f):
     return decorated_function
 
 
+def load_current_user():
+    """
+    A bejelentkezett user teljes ORM sora - csak ott kell, ahol a Principal kevés
+
+    None ha közben törölték.
+    """
+    from app.models import db, User
+    return db.session.get(User, request.user_id)
+
+
 def is_master_of_world(user, world_id):
     """Megnézi hogy a user game master-e az adott világban"""
     if not user or not user.world_ids:
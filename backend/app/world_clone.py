@@ -0,0 +1,86 @@
+"""
+Világ klónozás - táblánként egy INSERT ... SELECT, egy tranzakcióban
+
+Az új ID-k SQL-ben készülnek (NEW_ID, adatbázisonként) egy régi -> új táblán
+(clone_id_map) át; commit után az érintett userekre invalidate_principal kell.
+"""
+from sqlalchemy import text
+
+from app import memberships
+from app.models import db, World
+from app.utils import generate_unique_id
+
+
+# adatbázis (dialect) -> új 32 hex karakteres ID SQL kifejezése
+NEW_ID = {
+    'sqlite': 'lower(hex(randomblob(16)))',
+    'postgresql': "replace(gen_random_uuid()::text, '-', '')",
+}
+
+
+def clone_world(source_id, gm_id, name, include_players=False):
+    """
+    A forrás világ másolata új világként, gm_id lesz a GM
+
+    Visszaad: (új World, {tábla: másolt sorok száma})
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in NEW_ID:
+        raise NotImplementedError(f'A klónozás ID kiosztása nincs megírva ehhez az adatbázishoz: {dialect}')
+    new_id = NEW_ID[dialect]
+    params = {'source': str(source_id), 'target': generate_unique_id(), 'gm': str(gm_id)}
+    world = World(world_id=params['target'], name=name)
+    db.session.add(world)
+    db.session.flush()
+    memberships.add_member(gm_id, world.world_id, is_master=True)
+
+    def run(sql):
+        return db.session.execute(text(sql), params).rowcount
+
+    run('CREATE TEMP TABLE IF NOT EXISTS clone_id_map (old_id VARCHAR(32) PRIMARY KEY, new_id VARCHAR(32) NOT NULL)')
+    run('DELETE FROM clone_id_map')
+    run(f'INSERT INTO clone_id_map (old_id, new_id) SELECT id, {new_id} FROM cards WHERE world_id = :source')
+    run(f'INSERT INTO clone_id_map (old_id, new_id) SELECT id, {new_id} FROM dungeons WHERE world_id = :source')
+
+    counts = {}
+    counts['cards'] = run(
+        'INSERT INTO cards (id, world_id, owner_id, name, picture_hash, health, damage, type, position, is_leader) '
+        'SELECT m.new_id, :target, :gm, c.name, c.picture_hash, c.health, c.damage, c.type, 0, '
+        "COALESCE(leader.new_id, '') "
+        'FROM cards c JOIN clone_id_map m ON m.old_id = c.id '
+        "LEFT JOIN clone_id_map leader ON leader.old_id = c.is_leader AND c.is_leader != '' "
+        'WHERE c.world_id = :source'
+    )
+    counts['dungeons'] = run(
+        'INSERT INTO dungeons (id, name, world_id) '
+        'SELECT m.new_id, d.name, :target FROM dungeons d JOIN clone_id_map m ON m.old_id = d.id '
+        'WHERE d.world_id = :source'
+    )
+    counts['dungeon_cards'] = run(
+        'INSERT INTO dungeon_cards (dungeon_id, position, card_id) '
+        'SELECT dm.new_id, dc.position, cm.new_id FROM dungeons d '
+        'JOIN dungeon_cards dc ON dc.dungeon_id = d.id '
+        'JOIN clone_id_map dm ON dm.old_id = dc.dungeon_id '
+        'JOIN clone_id_map cm ON cm.old_id = dc.card_id '
+        'WHERE d.world_id = :source'
+    )
+    counts['members'] = counts['instances'] = 0
+    if include_players:
+        # a többiek játékosként kerülnek át, a klón GM-je csak a klónozó
+        counts['members'] = run(
+            'INSERT INTO world_memberships (user_id, world_id, is_master) '
+            'SELECT user_id, :target, FALSE FROM world_memberships WHERE world_id = :source AND user_id != :gm'
+        )
+        run(
+            'UPDATE users SET membership_version = membership_version + 1 WHERE id IN '
+            '(SELECT user_id FROM world_memberships WHERE world_id = :target AND user_id != :gm)'
+        )
+        counts['instances'] = run(
+            'INSERT INTO card_instances (id, template_id, world_id, owner_id, health_bonus, damage_bonus, position) '
+            f'SELECT {new_id}, m.new_id, :target, i.owner_id, i.health_bonus, i.damage_bonus, i.position '
+            'FROM card_instances i JOIN clone_id_map m ON m.old_id = i.template_id '
+            'WHERE i.world_id = :source AND i.owner_id IN '
+            '(SELECT user_id FROM world_memberships WHERE world_id = :target AND user_id != :gm)'
+        )
+    run('DELETE FROM clone_id_map')
+    return world, counts
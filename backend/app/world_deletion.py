@@ -0,0 +1,173 @@
+"""
+Világ törlés - halmaz alapú DELETE-ek, nagy világnál háttérben, darabokban
+
+Háttér törlésnél a világ és a tagságok azonnal eltűnnek, a többit a
+world_deletions sor alapján a world_deleter takarítja (commit után wake()).
+"""
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+
+from app import memberships, pictures
+from app.models import (
+    db, World, WorldDeletion, Card, CardInstance, Dungeon, DungeonCard, BattleLog, BattleStat, FightEpoch
+)
+
+
+POLL_INTERVAL = 30.0  # ennyi másodpercenként akkor is ránéz, ha nem ébresztették (más folyamat kérése)
+CHUNK_PAUSE = 0.05  # két darab között elengedjük az írási zárat
+
+
+def world_row_count(world_id):
+    """Lapok + példányok száma a világban - két indexelt COUNT"""
+    cards = db.session.query(func.count(Card.id)).filter(Card.world_id == str(world_id)).scalar()
+    owned = db.session.query(func.count(CardInstance.id)).filter(CardInstance.world_id == str(world_id)).scalar()
+    return cards + owned
+
+
+def delete_worlds(world_ids):
+    """
+    A világok minden sorának törlése azonnal - táblánként egy DELETE
+
+    Visszaadja azokat a user ID-kat, akiknek a tagsága változott.
+    """
+    world_ids = [str(w) for w in world_ids]
+    if not world_ids:
+        return []
+    cards = Card.query.filter(Card.world_id.in_(world_ids))
+    picture_hashes = pictures.picture_hashes(cards)
+    dungeons = db.session.query(Dungeon.id).filter(Dungeon.world_id.in_(world_ids))
+    CardInstance.query.filter(CardInstance.world_id.in_(world_ids)).delete(synchronize_session=False)
+    DungeonCard.query.filter(DungeonCard.dungeon_id.in_(dungeons)).delete(synchronize_session=False)
+    Dungeon.query.filter(Dungeon.world_id.in_(world_ids)).delete(synchronize_session=False)
+    cards.delete(synchronize_session=False)
+    BattleStat.query.filter(BattleStat.world_id.in_(world_ids)).delete(synchronize_session=False)
+    BattleLog.query.filter(BattleLog.world_id.in_(world_ids)).delete(synchronize_session=False)
+    FightEpoch.query.filter(FightEpoch.world_id.in_(world_ids)).delete(synchronize_session=False)
+    pictures.release_pictures(picture_hashes)
+    return _detach(world_ids)
+
+
+def schedule_delete(world_id):
+    """
+    A világ azonnal eltűnik (World sor + tagságok), a lapjai háttérben törlődnek
+
+    Visszaadja azokat a user ID-kat, akiknek a tagsága változott.
+    """
+    if db.session.get(WorldDeletion, str(world_id)) is None:
+        db.session.add(WorldDeletion(world_id=str(world_id)))
+    return _detach([str(world_id)])
+
+
+def delete_world(world_id, background_rows):
+    """
+    Kis világot azonnal, nagyot (background_rows lap + példány felett) háttérben töröl
+
+    Visszaad: (változott tagságú user ID-k, háttérben fut-e)
+    """
+    if world_row_count(world_id) > background_rows:
+        return schedule_delete(world_id), True
+    return delete_worlds([world_id]), False
+
+
+def _detach(world_ids):
+    changed_user_ids = []
+    for world_id in world_ids:
+        changed_user_ids.extend(memberships.remove_world(world_id))
+    World.query.filter(World.world_id.in_(world_ids)).delete(synchronize_session=False)
+    return changed_user_ids
+
+
+def _chunk(model, world_id, chunk_size):
+    """Egy darab ID-k lekérdezése (subquery) - a world_id index szerint"""
+    return db.session.query(model.id).filter(model.world_id == world_id).limit(chunk_size)
+
+
+def delete_chunk(world_id, chunk_size):
+    """
+    Egy darab (legfeljebb chunk_size sor) törlése a világból - False, ha már nincs mit
+
+    Darabonként kell commitolni.
+    """
+    world_id = str(world_id)
+    if CardInstance.query.filter(CardInstance.id.in_(_chunk(CardInstance, world_id, chunk_size))).delete(
+            synchronize_session=False):
+        return True
+    dungeon_ids = [dungeon_id for (dungeon_id,) in _chunk(Dungeon, world_id, max(1, chunk_size // 10))]
+    if dungeon_ids:
+        DungeonCard.query.filter(DungeonCard.dungeon_id.in_(dungeon_ids)).delete(synchronize_session=False)
+        Dungeon.query.filter(Dungeon.id.in_(dungeon_ids)).delete(synchronize_session=False)
+        return True
+    rows = db.session.query(Card.id, Card.picture_hash).filter(Card.world_id == world_id).limit(chunk_size).all()
+    if rows:
+        Card.query.filter(Card.id.in_([card_id for card_id, _ in rows])).delete(synchronize_session=False)
+        pictures.release_pictures({digest for _, digest in rows})
+        return True
+    subjects = db.session.query(BattleStat.subject_id).filter(BattleStat.world_id == world_id).limit(chunk_size)
+    if BattleStat.query.filter(
+            BattleStat.world_id == world_id, BattleStat.subject_id.in_(subjects)
+    ).delete(synchronize_session=False):
+        return True
+    if BattleLog.query.filter(BattleLog.id.in_(_chunk(BattleLog, world_id, chunk_size))).delete(
+            synchronize_session=False):
+        return True
+    users = db.session.query(FightEpoch.user_id).filter(FightEpoch.world_id == world_id).limit(chunk_size)
+    return bool(FightEpoch.query.filter(
+        FightEpoch.world_id == world_id, FightEpoch.user_id.in_(users)
+    ).delete(synchronize_session=False))
+
+
+class WorldDeleter:
+    """Háttérszál, ami a world_deletions sorokat darabonként feldolgozza"""
+
+    def __init__(self):
+        self.app = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self.deleted_chunks = 0
+
+    def init_app(self, app):
+        self.app = app
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='world-deleter', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """Commit után hívandó, ha schedule_delete volt"""
+        self._wake.set()
+
+    def run_pending(self):
+        """Minden függő törlés végigvitele most - a háttérszál és a mérés is ezt hívja"""
+        with self._lock, self.app.app_context():
+            chunk_size = self.app.config.get('WORLD_DELETE_CHUNK', 2000)
+            try:
+                world_ids = [world_id for (world_id,) in db.session.query(WorldDeletion.world_id).all()]
+                for world_id in world_ids:
+                    while delete_chunk(world_id, chunk_size):
+                        db.session.commit()
+                        self.deleted_chunks += 1
+                        time.sleep(CHUNK_PAUSE)
+                    WorldDeletion.query.filter_by(world_id=world_id).delete()
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        while True:
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                self.run_pending()
+            except OperationalError:
+                pass  # induláskor a tábla még nem biztos, hogy létezik - a következő körben újra
+            except Exception:
+                self.app.logger.exception('A világ háttér törlése sikertelen')
+
+
+world_deleter = WorldDeleter()
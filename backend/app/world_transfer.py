@@ -0,0 +1,404 @@
+"""
+Világ export / import - NDJSON, egy rekord soronként, kötegenként olvasva / írva
+
+Importnál minden ID új, a feltöltő az egyetlen GM, és csak a saját példányai
+kerülnek át; a rekordokat a /create/card és /create/dungeon szabályai ellenőrzik.
+"""
+import base64
+import binascii
+import hashlib
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, exists, func, or_, tuple_
+from sqlalchemy.orm import aliased
+
+from app import memberships, pictures
+from app.listing import row_key
+from app.models import (
+    db, User, World, WorldMembership, Card, CardInstance, CardPicture, Dungeon, DungeonCard
+)
+from app.utils import generate_unique_id
+
+
+FORMAT = 'damareen-world'
+VERSION = 1
+BATCH_SIZE = 1000  # ennyi sor egy lekérdezésben / INSERT-ben
+PICTURE_BATCH_SIZE = 50  # a képek nagyok, belőlük kevesebb
+CARD_NAME_MAX = 16  # cards.name hossza, mint az /edit/card-nál
+NAME_MAX = 120  # világ / kazamata név
+CARD_STAT_LIMITS = {'health': (1, 100), 'damage': (2, 100)}  # mint a /create/card-nál
+LEADER_STAT_MAX = 200  # a /create/leader az egyik statot duplázza
+INSTANCE_BONUS_MAX = 10000  # harc fejlesztésekből (győzelmenként legfeljebb +3)
+DECK_SIZE_MAX = 6
+
+
+class ImportFailed(ValueError):
+    """Hibás vagy csonka import folyam - az üzenet a hibás sor számát is tartalmazza"""
+
+
+def _line(kind, **fields):
+    return json.dumps(dict(kind=kind, **fields), ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def _batches(query, keys, batch_size=BATCH_SIZE):
+    """
+    Keyset kötegek egy oszlop-szintű queryből - minden köteg egy rövid, önálló SELECT
+
+    A keys egy (world_id, ...) index folytatása kell legyen, a végén a
+    listing.row_key() (SQLite-on a rowid, az minden index végén ott van), így
+    a köteg rendezés nélkül, az indexből jön, és a világ végén ugyanolyan
+    gyors, mint az elején.
+    """
+    query = query.add_columns(*keys)
+    last = None
+    while True:
+        page = query if last is None else query.filter(tuple_(*keys) > tuple_(*last))
+        rows = page.order_by(*keys).limit(batch_size).all()
+        if not rows:
+            return
+        yield [row[:-len(keys)] for row in rows]
+        last = tuple(rows[-1][-len(keys):])
+
+
+def _pictures(hashes):
+    """A megadott képek, PICTURE_BATCH_SIZE-onként lekérve (nagyok)"""
+    hashes = sorted(hashes)
+    for start in range(0, len(hashes), PICTURE_BATCH_SIZE):
+        yield from db.session.query(CardPicture.hash, CardPicture.mime, CardPicture.data).filter(
+            CardPicture.hash.in_(hashes[start:start + PICTURE_BATCH_SIZE])
+        )
+
+
+def _picture_groups(rows):
+    """A köteg sorai egymás utáni csoportokban, csoportonként legfeljebb PICTURE_BATCH_SIZE különböző képpel"""
+    group, hashes = [], set()
+    for row in rows:
+        if row[2] and row[2] not in hashes and len(hashes) >= PICTURE_BATCH_SIZE:
+            yield group
+            group, hashes = [], set()
+        group.append(row)
+        if row[2]:
+            hashes.add(row[2])
+    if group:
+        yield group
+
+
+def export_world(world_id):
+    """Generátor - a világ NDJSON sorai (a hívó stream_with_context-tel adja vissza)"""
+    world_id = str(world_id)
+    world = db.session.get(World, world_id)
+    counts = {'members': 0, 'pictures': 0, 'cards': 0, 'instances': 0, 'dungeons': 0}
+    yield _line('header', format=FORMAT, version=VERSION, exported_at=datetime.utcnow().isoformat())
+    yield _line('world', world_id=world.world_id, name=world.name)
+
+    members = db.session.query(WorldMembership.user_id, User.username, WorldMembership.is_master).join(
+        User, User.id == WorldMembership.user_id
+    ).filter(WorldMembership.world_id == world_id)
+    for rows in _batches(members, (WorldMembership.is_master, *row_key(WorldMembership))):
+        for user_id, username, is_master in rows:
+            yield _line('member', user_id=user_id, username=username, is_master=bool(is_master))
+        counts['members'] += len(rows)
+
+    # a kártyák képei közvetlenül a lapjaik előtt, legfeljebb PICTURE_BATCH_SIZE képes csoportokban -
+    # az import egy csoport képeit és lapjait egy tranzakcióban írja. Egy kép több csoportban is
+    # előfordulhat, az import a már meglévőt kihagyja (tartalom szerinti kulcs)
+    cards = db.session.query(Card.id, Card.name, Card.picture_hash, Card.health, Card.damage, Card.type,
+                             Card.is_leader).filter(Card.world_id == world_id)
+    for rows in _batches(cards, (Card.name, *row_key(Card))):
+        for group in _picture_groups(rows):
+            for digest, mime, data in _pictures({row[2] for row in group if row[2]}):
+                yield _line('picture', hash=digest, mime=mime, data=base64.b64encode(data).decode('ascii'))
+                counts['pictures'] += 1
+            for card_id, name, picture_hash, health, damage, card_type, is_leader in group:
+                yield _line('card', id=card_id, name=name, picture_hash=picture_hash, health=health,
+                            damage=damage, type=card_type, is_leader=is_leader or '')
+        counts['cards'] += len(rows)
+
+    owned = db.session.query(CardInstance.id, CardInstance.template_id, CardInstance.owner_id,
+                             CardInstance.health_bonus, CardInstance.damage_bonus,
+                             CardInstance.position).filter(CardInstance.world_id == world_id)
+    for rows in _batches(owned, (CardInstance.position, *row_key(CardInstance))):
+        for instance_id, template_id, owner_id, health_bonus, damage_bonus, position in rows:
+            yield _line('instance', id=instance_id, template_id=template_id, owner_id=owner_id,
+                        health_bonus=health_bonus, damage_bonus=damage_bonus, position=position)
+        counts['instances'] += len(rows)
+
+    dungeons = db.session.query(Dungeon.id, Dungeon.name).filter(Dungeon.world_id == world_id)
+    for rows in _batches(dungeons, row_key(Dungeon), BATCH_SIZE // 10):
+        card_lists = {dungeon_id: [] for dungeon_id, _ in rows}
+        for dungeon_id, card_id in db.session.query(DungeonCard.dungeon_id, DungeonCard.card_id).filter(
+            DungeonCard.dungeon_id.in_(list(card_lists))
+        ).order_by(DungeonCard.dungeon_id, DungeonCard.position):
+            card_lists[dungeon_id].append(card_id)
+        for dungeon_id, name in rows:
+            yield _line('dungeon', id=dungeon_id, name=name, card_ids=card_lists[dungeon_id])
+        counts['dungeons'] += len(rows)
+
+    yield _line('end', **counts)
+
+
+class _Importer:
+    """Egy import állapota - típusonként egy korlátos puffer, semmi ami a világ méretével nő"""
+
+    def __init__(self, gm_id):
+        self.gm_id = gm_id
+        self.world_id = generate_unique_id()
+        self.salt = generate_unique_id()
+        self.name = None
+        self.counts = {'pictures': 0, 'cards': 0, 'instances': 0, 'dungeons': 0,
+                       'skipped_members': 0, 'skipped_instances': 0}
+        self.pending = {'picture': [], 'card': [], 'instance': [], 'dungeon': []}
+        self.limits = {'picture': PICTURE_BATCH_SIZE, 'dungeon': BATCH_SIZE // 10}
+
+    def new_id(self, old_id):
+        """Régi ID -> új ID, tárolt táblázat nélkül (só + hash)"""
+        return hashlib.sha256(f'{self.salt}:{old_id}'.encode('utf-8')).hexdigest()[:32]
+
+    def add(self, kind, record):
+        if kind == 'member':
+            # a fájl nem adhat tagságot (főleg GM jogot) másnak - az importáló a végén GM lesz
+            if record['user_id'] != self.gm_id:
+                self.counts['skipped_members'] += 1
+            return
+        if kind == 'picture' and self.pending['card']:
+            self.flush('card')  # új csoport kezdődik: az előző lapjai a saját képeikkel mennek
+        self.pending[kind].append(record)
+        if len(self.pending[kind]) >= self.limits.get(kind, BATCH_SIZE):
+            self.flush(kind)
+
+    def flush(self, kind):
+        # a képek mindig az őket követő lapokkal egy tranzakcióban
+        kinds = ('picture', 'card') if kind in ('picture', 'card') else (kind,)
+        written = False
+        for each in kinds:
+            records, self.pending[each] = self.pending[each], []
+            if records:
+                getattr(self, f'_write_{each}s')(records)
+                written = True
+        if written:
+            db.session.commit()
+
+    def _write_pictures(self, records):
+        pictures.insert_pictures([{'hash': r['hash'], 'mime': r['mime'], 'data': r['data']} for r in records])
+        self.counts['pictures'] += len(records)
+
+    def _write_cards(self, records):
+        rows = [{
+            'id': self.new_id(r['id']),
+            'world_id': self.world_id,
+            'owner_id': self.gm_id,
+            'name': r['name'],
+            'picture_hash': r['picture_hash'],
+            'health': r['health'],
+            'damage': r['damage'],
+            'type': r['type'],
+            'position': 0,
+            'is_leader': self.new_id(r['is_leader']) if r['is_leader'] else '',
+        } for r in records]
+        db.session.execute(Card.__table__.insert(), rows)
+        # az INSERT után ellenőrzünk: ekkor már nálunk az írási zár, közben senki nem törölhet
+        card_ids = [row['id'] for row in rows]
+        missing = db.session.query(Card.picture_hash).filter(
+            Card.id.in_(card_ids), Card.picture_hash.isnot(None),
+            ~exists().where(CardPicture.hash == Card.picture_hash)
+        ).first()
+        if missing:
+            raise ImportFailed(f'Hibás card rekord: ismeretlen kép ({missing[0]}), a képnek a lap előtt kell jönnie')
+        duplicate = db.session.query(Card.name).filter(
+            Card.world_id == self.world_id, Card.name.in_({row['name'] for row in rows})
+        ).group_by(Card.name).having(func.count() > 1).first()
+        if duplicate:
+            raise ImportFailed(f'Hibás card rekord: több kártya ugyanazzal a névvel ({duplicate[0]})')
+        self.counts['cards'] += len(records)
+
+    def _write_instances(self, records):
+        # csak az importáló saját példányai - másnak a fájl nem adhat lapot
+        rows = [{
+            'id': self.new_id(r['id']),
+            'template_id': self.new_id(r['template_id']),
+            'world_id': self.world_id,
+            'owner_id': r['owner_id'],
+            'health_bonus': r['health_bonus'],
+            'damage_bonus': r['damage_bonus'],
+            'position': r['position'],
+        } for r in records if r['owner_id'] == self.gm_id]
+        self.counts['skipped_instances'] += len(records) - len(rows)
+        if rows:
+            db.session.execute(CardInstance.__table__.insert(), rows)
+        self.counts['instances'] += len(rows)
+
+    def _write_dungeons(self, records):
+        db.session.execute(Dungeon.__table__.insert(), [
+            {'id': self.new_id(r['id']), 'name': r['name'], 'world_id': self.world_id} for r in records
+        ])
+        rows = [{'dungeon_id': self.new_id(r['id']), 'position': i + 1, 'card_id': self.new_id(card_id)}
+                for r in records for i, card_id in enumerate(r['card_ids'])]
+        if rows:
+            db.session.execute(DungeonCard.__table__.insert(), rows)
+        self.counts['dungeons'] += len(records)
+
+    def finish(self, name):
+        for kind in self.pending:
+            self.flush(kind)
+        world = World(world_id=self.world_id, name=name or self.name)
+        db.session.add(world)
+        memberships.add_member(self.gm_id, self.world_id, is_master=True)
+        db.session.flush()
+        self._check_references()
+        db.session.commit()
+        return world
+
+    def _check_references(self):
+        """A hivatkozások a folyam lapjaira mutatnak-e, és a /create/* szabályai szerint - indexelt lekérdezések"""
+        world_id = self.world_id
+        base = aliased(Card)
+        leader = db.session.query(Card.name).outerjoin(
+            base, and_(base.id == Card.is_leader, base.world_id == world_id)
+        ).filter(Card.world_id == world_id, Card.is_leader != '', or_(base.id.is_(None), base.is_leader != '')).first()
+        if leader:
+            raise ImportFailed(f'Hibás card rekord: a vezér ({leader[0]}) nem egy sima kártyára hivatkozik')
+
+        template = db.session.query(CardInstance.id).outerjoin(
+            Card, and_(Card.id == CardInstance.template_id, Card.world_id == world_id)
+        ).filter(CardInstance.world_id == world_id, Card.id.is_(None)).first()
+        if template:
+            raise ImportFailed('Hibás instance rekord: a sablon kártya nincs a folyamban')
+
+        # kazamata lapjai: léteznek, és pontosan az utolsó vezér (1 lapnál egy sem)
+        sizes = db.session.query(DungeonCard.dungeon_id, func.count().label('size')).join(
+            Dungeon, Dungeon.id == DungeonCard.dungeon_id
+        ).filter(Dungeon.world_id == world_id).group_by(DungeonCard.dungeon_id).subquery()
+        wrong = db.session.query(Dungeon.name).join(DungeonCard, DungeonCard.dungeon_id == Dungeon.id).join(
+            sizes, sizes.c.dungeon_id == Dungeon.id
+        ).outerjoin(
+            Card, and_(Card.id == DungeonCard.card_id, Card.world_id == world_id)
+        ).filter(Dungeon.world_id == world_id, or_(
+            Card.id.is_(None),
+            (Card.is_leader != '') != and_(DungeonCard.position == sizes.c.size, sizes.c.size > 1)
+        )).first()
+        if wrong:
+            raise ImportFailed(f'Hibás dungeon rekord ({wrong[0]}): ismeretlen kártya, vagy nem csak az utolsó a vezér')
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_id(value):
+    return isinstance(value, str) and 0 < len(value) <= 32
+
+
+def _is_name(value, max_length):
+    return isinstance(value, str) and value.strip() != '' and len(value) <= max_length
+
+
+def _in_range(value, low, high):
+    return _is_int(value) and low <= value <= high
+
+
+def _check(record):
+    """Egy rekord mezőinek ellenőrzése - a hibás rekord típusát adja vissza, None ha jó"""
+    kind = record.get('kind')
+    if kind == 'member':
+        ok = _is_id(record.get('user_id'))
+    elif kind == 'picture':
+        try:
+            record['data'] = base64.b64decode(record.get('data') or '', validate=True)
+        except (binascii.Error, TypeError, ValueError):
+            return kind
+        # a hash a tartalomból jön (card_pictures kulcs), nem bízunk a kapott értékben
+        ok = record.get('hash') == pictures.picture_hash(record.get('mime'), record['data'])
+    elif kind == 'card':
+        record.setdefault('is_leader', '')
+        leader = record['is_leader'] != ''
+        ok = (_is_id(record.get('id')) and _is_name(record.get('name'), CARD_NAME_MAX)
+              and all(_in_range(record.get(field), low, LEADER_STAT_MAX if leader else high)
+                      for field, (low, high) in CARD_STAT_LIMITS.items())
+              and record.get('type') in ('t', 'f', 'v', 'l')
+              and (record.get('picture_hash') is None or isinstance(record['picture_hash'], str))
+              and (not leader or _is_id(record['is_leader'])))
+    elif kind == 'instance':
+        ok = (_is_id(record.get('id')) and _is_id(record.get('template_id')) and _is_id(record.get('owner_id'))
+              and _in_range(record.get('health_bonus'), 0, INSTANCE_BONUS_MAX)
+              and _in_range(record.get('damage_bonus'), 0, INSTANCE_BONUS_MAX)
+              and _in_range(record.get('position'), 0, DECK_SIZE_MAX))
+    elif kind == 'dungeon':
+        card_ids = record.get('card_ids')
+        ok = (_is_id(record.get('id')) and _is_name(record.get('name'), NAME_MAX)
+              and isinstance(card_ids, list) and len(card_ids) in (1, 4, 6)
+              and all(_is_id(c) for c in card_ids) and len(set(card_ids)) == len(card_ids))
+    else:
+        return kind
+    return None if ok else kind
+
+
+def import_world(lines, gm_id, name=None, background_rows=None):
+    """
+    NDJSON folyam (soronként bájt vagy str) beolvasása új világként, a gm_id lesz a GM
+
+    Kötegenként commitol. Hibánál a már beírt sorokat törli és továbbdobja
+    (hibás folyamnál ImportFailed). Visszaad: (World, számlálók)
+    """
+    importer = _Importer(gm_id)
+    try:
+        _read(importer, lines)
+        if not (name or importer.name):
+            raise ImportFailed('A világ neve hiányzik')
+        world = importer.finish(name)
+    except Exception:
+        db.session.rollback()
+        _cleanup(importer.world_id, background_rows)
+        raise
+    return world, importer.counts
+
+
+def _read(importer, lines):
+    header_seen = ended = False
+    for number, raw in enumerate(lines, start=1):
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8')
+        if not raw.strip():
+            continue
+        if ended:
+            raise ImportFailed(f'{number}. sor: adat a folyam vége után')
+        try:
+            record = json.loads(raw)
+        except ValueError:
+            raise ImportFailed(f'{number}. sor: érvénytelen JSON')
+        if not isinstance(record, dict):
+            raise ImportFailed(f'{number}. sor: a rekordnak objektumnak kell lennie')
+        kind = record.get('kind')
+        if not header_seen:
+            if kind != 'header' or record.get('format') != FORMAT:
+                raise ImportFailed('Az első sornak a damareen-world fejlécnek kell lennie')
+            if record.get('version') != VERSION:
+                raise ImportFailed(f'Nem támogatott export verzió: {record.get("version")}')
+            header_seen = True
+        elif kind == 'world':
+            importer.name = str(record.get('name') or '')[:NAME_MAX]
+        elif kind == 'end':
+            ended = True
+        else:
+            failed = _check(record)
+            if failed:
+                raise ImportFailed(f'{number}. sor: hibás {failed} rekord')
+            importer.add(kind, record)
+    if not ended:
+        raise ImportFailed('Csonka folyam: hiányzik a záró (end) rekord')
+
+
+def _cleanup(world_id, background_rows):
+    """A félbemaradt import sorainak törlése - nagy világnál háttérben"""
+    from app.principals import invalidate_principal
+    from app.world_deletion import delete_world, world_deleter
+
+    try:
+        changed_user_ids, background = delete_world(world_id, background_rows or 0)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        return
+    invalidate_principal(*changed_user_ids)
+    if background:
+        world_deleter.wake()
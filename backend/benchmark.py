@@ -0,0 +1,991 @@
+"""
+Teljesítmény mérések - kézzel futtatható script
+
+Használat:
+    python benchmark.py fight [--fights 20000]
+    python benchmark.py fight-payload
+    python benchmark.py stress-upgrades [--fights 300 --threads 32]
+    python benchmark.py auth [--requests 3000]
+    python benchmark.py login [--logins 200 --threads 32 --rounds 10]
+    python benchmark.py query-plans
+    python benchmark.py pictures [--cards 20 --players 50 --picture-kb 48]
+    python benchmark.py memberships [--users 100000]
+    python benchmark.py distribute [--targets 1 100 1000]
+    python benchmark.py delete-world [--cards 2000 --players 100]
+    python benchmark.py transfer [--cards 100000]
+    python benchmark.py clone [--cards 20000 --players 20]
+
+Minden mérés előtte/utána számot ír ki, hogy látszódjon mit nyertünk.
+"""
+import argparse
+import atexit
+import base64
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import fight_engine  # noqa: E402
+
+
+TYPES = ('t', 'f', 'v', 'l')
+
+
+def _fake_picture(size_kb=48):
+    """Kb. akkora base64 kép mint amit a frontend feltölt"""
+    raw = os.urandom(size_kb * 1024)
+    return ('data:image/png;base64,' + base64.b64encode(raw).decode('ascii')).encode('utf-8')
+
+
+def _fake_card(rng, picture, position=0):
+    """Card-szerű objektum, ugyanazokkal a mezőkkel mint a modell"""
+    card = SimpleNamespace(
+        id=f'{rng.getrandbits(128):032x}',
+        world_id='w' * 32,
+        owner_id='o' * 32,
+        name='kartya',
+        picture=picture,
+        health=rng.randint(1, 100),
+        damage=rng.randint(2, 100),
+        type=rng.choice(TYPES),
+        position=position,
+        is_leader='',
+    )
+    card.to_dict = lambda c=card: {
+        'id': c.id,
+        'world_id': c.world_id,
+        'owner_id': c.owner_id,
+        'name': c.name,
+        'picture': c.picture.decode('utf-8') if c.picture else None,
+        'health': c.health,
+        'damage': c.damage,
+        'type': c.type,
+        'position': c.position,
+        'is_leader': c.is_leader,
+    }
+    return card
+
+
+def _make_app(**config):
+    """Flask app egy friss, ideiglenes SQLite adatbázissal, config felülírásokkal"""
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    atexit.register(os.remove, path)
+    from app import create_app
+    from app.models import db
+    from app.schema import migrate
+    from config import Config
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+
+    for key, value in config.items():
+        setattr(BenchmarkConfig, key, value)
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.init_app(app)
+        migrate(db)
+    return app
+
+
+def _seed_fight(app, rng, picture, size=6):
+    """
+    Egy világ GM-mel, játékossal, size lapos kazamatával és paklival
+
+    Visszaad: (játékos token, dungeon id, kiválasztott kártya id)
+    """
+    from app.models import db, User, World, Card, CardInstance, Dungeon, WorldMembership
+    from app.dungeon_cards import set_cards
+    from app.pictures import store_picture
+    from app.utils import generate_unique_id, generate_token
+
+    with app.app_context():
+        world_id = generate_unique_id()
+        picture_hash = store_picture(picture.decode('utf-8') if picture else None)
+        gm = User(id=generate_unique_id(), username='gm_' + world_id[:8], email=f'gm_{world_id[:8]}@x.hu',
+                  password_hash='-', settings={})
+        player = User(id=generate_unique_id(), username='pl_' + world_id[:8], email=f'pl_{world_id[:8]}@x.hu',
+                      password_hash='-', settings={})
+        db.session.add_all([gm, player, World(world_id=world_id, name='bench'),
+                            WorldMembership(user_id=gm.id, world_id=world_id, is_master=True),
+                            WorldMembership(user_id=player.id, world_id=world_id, is_master=False)])
+
+        def card(name):
+            return Card(id=generate_unique_id(), world_id=world_id, owner_id=gm.id, name=name,
+                        picture_hash=picture_hash, health=rng.randint(1, 100), damage=rng.randint(2, 100),
+                        type=rng.choice(TYPES), position=0, is_leader='')
+
+        dungeon_cards = [card(f'k{i}') for i in range(size)]
+        if size > 1:
+            dungeon_cards[-1].is_leader = dungeon_cards[0].id
+        # a játékos paklija külön GM lapokból kiosztott példány
+        templates = [card(f'p{i}') for i in range(size)]
+        deck = [CardInstance(id=generate_unique_id(), template_id=t.id, world_id=world_id, owner_id=player.id,
+                             health_bonus=0, damage_bonus=0, position=i + 1) for i, t in enumerate(templates)]
+        dungeon = Dungeon(id=generate_unique_id(), name='bench', world_id=world_id)
+        db.session.add_all(dungeon_cards + templates + deck + [dungeon])
+        set_cards(dungeon.id, [c.id for c in dungeon_cards])
+        db.session.commit()
+        token = generate_token(player.id, app.config['SECRET_KEY'])
+        return token, dungeon.id, deck[0].id
+
+
+def _legacy_fight(player_cards, dungeon_cards):
+    """A régi, route-ba ágyazott harc logika - to_dict() + int() minden párra"""
+    dungeon_dicts = [c.to_dict() for c in dungeon_cards]
+    player_deck = []
+    for idx, c in enumerate(player_cards):
+        d = c.to_dict()
+        d['position'] = idx + 1
+        player_deck.append(d)
+
+    battles = []
+    beats = {'t': 'f', 'f': 'v', 'v': 'l', 'l': 't'}
+    for i in range(min(len(dungeon_dicts), len(player_deck))):
+        dc = dungeon_dicts[i]
+        pc = player_deck[i]
+        try:
+            p_damage = int(pc.get('damage', 0))
+        except Exception:
+            p_damage = 0
+        try:
+            d_damage = int(dc.get('damage', 0))
+        except Exception:
+            d_damage = 0
+        try:
+            p_health = int(pc.get('health', 0))
+        except Exception:
+            p_health = 0
+        try:
+            d_health = int(dc.get('health', 0))
+        except Exception:
+            d_health = 0
+        p_can_kill = p_damage > d_health
+        d_can_kill = d_damage > p_health
+        if p_can_kill and not d_can_kill:
+            winner, reason = 'player', 'damage'
+        elif d_can_kill and not p_can_kill:
+            winner, reason = 'dungeon', 'damage'
+        else:
+            p_type = (pc.get('type') or '').lower()
+            d_type = (dc.get('type') or '').lower()
+            if p_type and d_type and p_type != d_type and beats.get(p_type) == d_type:
+                winner, reason = 'player', 'type'
+            elif p_type and d_type and p_type != d_type and beats.get(d_type) == p_type:
+                winner, reason = 'dungeon', 'type'
+            else:
+                winner, reason = 'dungeon', 'dungeon_fallback'
+        battles.append({'position': i + 1, 'player_card': pc, 'dungeon_card': dc,
+                        'winner': winner, 'reason': reason})
+    player_wins = sum(1 for b in battles if b['winner'] == 'player')
+    return 'player' if player_wins >= len(battles) - player_wins else 'dungeon', battles
+
+
+def _engine_fight(player_cards, dungeon_cards):
+    results = fight_engine.resolve(
+        fight_engine.side_from_cards(player_cards),
+        fight_engine.side_from_cards(dungeon_cards)
+    )
+    return fight_engine.overall_winner(results), results
+
+
+def _rate(label, count, elapsed):
+    print(f'  {label:<10} {count / elapsed:>12,.0f} harc/s  ({elapsed:.3f} s)')
+
+
+def bench_fight(args):
+    """6v6 harcok másodpercenként: régi inline logika vs fight_engine"""
+    rng = random.Random(args.seed)
+    picture = _fake_picture()
+    fights = []
+    for _ in range(args.fights):
+        player = [_fake_card(rng, picture, i + 1) for i in range(6)]
+        dungeon = [_fake_card(rng, picture, i + 1) for i in range(6)]
+        fights.append((player, dungeon))
+
+    # Ugyanazt kell kiadnia a kettőnek
+    for player, dungeon in fights[:1000]:
+        old_winner, battles = _legacy_fight(player, dungeon)
+        new_winner, results = _engine_fight(player, dungeon)
+        assert old_winner == new_winner
+        assert [(b['winner'], b['reason']) for b in battles] == results
+
+    print(f'fight - {args.fights} darab 6v6 harc')
+    start = time.perf_counter()
+    for player, dungeon in fights:
+        _legacy_fight(player, dungeon)
+    _rate('előtte', args.fights, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for player, dungeon in fights:
+        _engine_fight(player, dungeon)
+    _rate('utána', args.fights, time.perf_counter() - start)
+
+
+def bench_fight_payload(args):
+    """/game/fight válasz mérete: teljes vs ?view=lean, seedelt 6v6 harcon"""
+    app = _make_app()
+    rng = random.Random(args.seed)
+    token, dungeon_id, card_id = _seed_fight(app, rng, _fake_picture(args.picture_kb))
+    client = app.test_client()
+    url = f'/game/fight?dungeon_id={dungeon_id}&selected_card_id={card_id}'
+    headers = {'Authorization': f'Bearer {token}'}
+
+    print(f'fight-payload - 6v6 harc, {args.picture_kb} KB-os képekkel')
+    for label, view in (('teljes', ''), ('lean', '&view=lean')):
+        response = client.get(url + view, headers=headers)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        print(f'  {label:<10} {len(response.get_data()):>12,} byte')
+
+
+def bench_stress_upgrades(args):
+    """
+    Sok párhuzamos nyert harc ugyanarra a kártyára - a végén pontos-e a stat
+
+    1 lapos kazamata, amit a játékos mindig megnyer (+1 damage / győzelem).
+    Hibás fejlesztésnél 1-es kóddal lép ki.
+    """
+    from app.models import db, Card, CardInstance, Dungeon
+
+    app = _make_app()
+    app.config['RATE_LIMIT_POLICIES'] = _unlimited_policies(app)
+    rng = random.Random(args.seed)
+    token, dungeon_id, card_id = _seed_fight(app, rng, None, size=1)
+    with app.app_context():
+        template = db.session.get(CardInstance, card_id).template
+        template.damage, template.health = 100, 100
+        dungeon_card = db.session.get(Card, db.session.get(Dungeon, dungeon_id).list_of_card_ids[0])
+        dungeon_card.damage, dungeon_card.health = 2, 1
+        db.session.commit()
+
+    url = f'/game/fight?dungeon_id={dungeon_id}&selected_card_id={card_id}&view=lean'
+
+    def one_fight(i):
+        # külön IP minden kérésnek, hogy a rate limit ne szóljon bele
+        environ = {'REMOTE_ADDR': f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}'}
+        response = app.test_client().get(url, headers={'Authorization': f'Bearer {token}'}, environ_base=environ)
+        return response.status_code, (response.get_json() or {}).get('data', {}).get('upgraded_card')
+
+    print(f'stress-upgrades - {args.fights} harc, {args.threads} szálon')
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        responses = list(pool.map(one_fight, range(args.fights)))
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for status, _ in responses:
+        statuses[status] = statuses.get(status, 0) + 1
+    upgraded = sum(1 for status, upgrade in responses if status == 200 and upgrade)
+    with app.app_context():
+        final_damage = db.session.get(CardInstance, card_id).damage
+
+    expected = 100 + upgraded
+    print(f'  státuszok  {statuses}')
+    print(f'  fejlesztve {upgraded} harc, {elapsed:.2f} s')
+    print(f'  damage     {final_damage} (elvárt {expected})')
+    if final_damage != expected or upgraded != args.fights:
+        print('  HIBA: elveszett fejlesztés')
+        sys.exit(1)
+    print('  OK')
+
+
+def _legacy_require_auth(f):
+    """A régi require_auth - minden kérésnél a teljes users sort tölti be"""
+    from functools import wraps
+    from flask import current_app, request
+    from app.models import db, User
+    from app.utils import decode_token, error_response
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        parts = request.headers.get('Authorization', '').split()
+        if len(parts) != 2 or parts[0].lower() != 'bearer':
+            return error_response('Érvénytelen Authorization fejléc formátum', 401)
+        payload = decode_token(parts[1], current_app.config['SECRET_KEY'])
+        if not payload:
+            return error_response('Érvénytelen vagy lejárt token', 401)
+        user = db.session.get(User, payload['user_id'])
+        if not user:
+            return error_response('Felhasználó nem található', 401)
+        request.user_id = payload['user_id']
+        request.current_user = user
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def bench_auth(args):
+    """
+    Védett endpoint (/user/is-master) késleltetése: régi require_auth vs principal cache
+
+    A régi változat egy külön útvonalon fut ugyanazzal a handlerrel.
+    A rate limitet mindkettőre kikapcsoljuk, hogy ne szóljon bele.
+    """
+    from app.principals import cache_stats
+    from app.ratelimit import Policy, ratelimit
+    from app.utils import check_master_status
+
+    unlimited = Policy(10 ** 9, 1)
+    app = _make_app(RATE_LIMIT_POLICIES={'api.is_master': unlimited, 'bench_is_master': unlimited})
+    app.add_url_rule('/bench/is-master', 'bench_is_master',
+                     ratelimit(_legacy_require_auth(check_master_status)))
+    rng = random.Random(args.seed)
+    token, _, _ = _seed_fight(app, rng, None, size=1)
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    print(f'auth - {args.requests} kérés egy védett endpointra')
+    for label, url in (('előtte', '/bench/is-master'), ('utána', '/user/is-master')):
+        query = url + '?world_id=x'
+        for _ in range(50):  # bemelegítés
+            client.get(query, headers=headers)
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            response = client.get(query, headers=headers)
+            assert response.status_code == 200, response.get_data(as_text=True)
+        elapsed = time.perf_counter() - start
+        print(f'  {label:<10} {elapsed / args.requests * 1e6:>10,.0f} µs/kérés  ({elapsed:.3f} s)')
+    for name, stats in cache_stats().items():
+        print(f'  {name:<20} {stats["hits"]} találat, {stats["misses"]} hiány')
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def _run_login_storm(args, workers):
+    """Login roham + közben /health kérések; (login eredmények, eltelt idő, health késleltetések)"""
+    import app.routes
+    from app.models import db, User
+    from app.ratelimit import Policy
+    from app.utils import generate_unique_id, hash_password
+
+    app.routes.send_login_notification_email = lambda *a, **k: True  # ne mérjük az SMTP-t
+    unlimited = Policy(10 ** 9, 1)
+    app = _make_app(
+        BCRYPT_ROUNDS=args.rounds,
+        PASSWORD_WORKERS=workers,
+        PASSWORD_QUEUE_LIMIT=None,
+        RATE_LIMIT_POLICIES={'api.login': unlimited, 'api.health_check': unlimited},
+    )
+    with app.app_context():
+        db.session.add(User(id=generate_unique_id(), username='bench', email='bench@x.hu',
+                            password_hash=hash_password('Passw0rdX'), settings={},
+                            email_verified=True))
+        db.session.commit()
+
+    done = threading.Event()
+    health_latencies = []
+
+    def probe():
+        client = app.test_client()
+        while not done.is_set():
+            start = time.perf_counter()
+            client.get('/health')
+            health_latencies.append(time.perf_counter() - start)
+            time.sleep(0.005)
+
+    def one_login(i):
+        """Egy kliens: 503-nál kicsit vár és újrapróbálja - (végső státusz, 503-ak száma)"""
+        environ = {'REMOTE_ADDR': f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}'}
+        busy = 0
+        while True:
+            response = app.test_client().post('/user/login', json={'username': 'bench', 'password': 'Passw0rdX'},
+                                              environ_base=environ)
+            if response.status_code != 503:
+                return response.status_code, busy
+            busy += 1
+            time.sleep(0.2)  # a valódi kliens a Retry-After-t várná ki, itt rövidítünk
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(one_login, range(args.logins)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    prober.join()
+    return results, elapsed, health_latencies
+
+
+def bench_login(args):
+    """
+    Login roham párhuzamosan: bcrypt a request szálon vs korlátos szálkészleten
+
+    Közben egy másik szál /health-et kérdez - azt nézzük, mennyire éhezik ki
+    az olcsó endpoint, és hány login/s megy át.
+    """
+    from app.passwords import password_hasher
+
+    print(f'login - {args.logins} login {args.threads} szálon, bcrypt költség {args.rounds}')
+    for label, workers in (('előtte', 0), ('utána', None)):
+        results, elapsed, health = _run_login_storm(args, workers)
+        ok = sum(1 for status, _ in results if status == 200)
+        busy = sum(busy for _, busy in results)
+        print(f'  {label:<10} {ok / elapsed:>8,.1f} login/s  ({ok} sikeres, {busy} db 503 újrapróbálva)')
+        print(f'  {"":<10} /health p50 {_percentile(health, 0.5) * 1000:,.1f} ms, '
+              f'p95 {_percentile(health, 0.95) * 1000:,.1f} ms ({len(health)} kérés)')
+    print(f'  szálkészlet {password_hasher.stats()}')
+
+
+# Teljes tábla olvasás, ami szándékos (SQL részlet -> indok)
+_ALLOWED_SCANS = {
+    'SCAN worlds': 'a /user/list/worlds lapozás nélkül minden világot listáz (lapozva a kulcs indexén)',
+}
+
+
+def _unlimited_policies(app):
+    """Minden endpointra végtelen rate limit - a mérést ne zavarja"""
+    from app.ratelimit import Policy
+    unlimited = Policy(10 ** 9, 1)
+    return {rule.endpoint: unlimited for rule in app.url_map.iter_rules()}
+
+
+def bench_query_plans(args):
+    """
+    EXPLAIN QUERY PLAN minden SQL-re, amit a route-ok kiadnak
+
+    Végighívja a fontos endpointokat egy seedelt világon, elkapja a kiadott
+    lekérdezéseket, és mindegyikre megnézi az SQLite tervét. Ha valamelyik
+    táblát végigolvas (SCAN) index helyett, és az nincs az engedélyezett
+    listán, 1-es kóddal lép ki.
+    """
+    import app.routes
+    from sqlalchemy import event
+    from app.listing import encode_cursor
+    from app.memberships import list_members
+    from app.models import db, User, CardInstance, Dungeon
+    from app.utils import generate_token, hash_password
+
+    for name in ('send_verification_email', 'send_login_notification_email', 'send_password_reset_email'):
+        setattr(app.routes, name, lambda *a, **k: True)
+
+    app = _make_app(BCRYPT_ROUNDS=4)
+    app.config['RATE_LIMIT_POLICIES'] = _unlimited_policies(app)
+    rng = random.Random(args.seed)
+    token, dungeon_id, card_id = _seed_fight(app, rng, _fake_picture(1))
+    with app.app_context():
+        dungeon = db.session.get(Dungeon, dungeon_id)
+        world_id = dungeon.world_id
+        player_id = db.session.get(CardInstance, card_id).owner_id
+        gm = db.session.get(User, next(uid for uid, _, is_master in list_members(world_id) if is_master))
+        gm.password_hash = hash_password('Passw0rdX')
+        db.session.commit()
+        gm_token = generate_token(gm.id, app.config['SECRET_KEY'])
+        deck = [c.id for c in CardInstance.query.filter_by(owner_id=player_id).order_by(CardInstance.position)]
+        dungeon_card = dungeon.list_of_card_ids[0]
+
+    statements = {}
+
+    with app.app_context():
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                statements.setdefault(statement, (parameters, request_label[0]))
+
+    client = app.test_client()
+    request_label = ['']
+    player = {'Authorization': f'Bearer {token}'}
+    master = {'Authorization': f'Bearer {gm_token}'}
+    w = world_id
+    calls = [
+        ('get', '/user', player, None),
+        ('get', f'/user/is-master?world_id={w}', player, None),
+        ('get', '/user/list/worlds', player, None),
+        ('get', f'/user/list/cards?world_id={w}', player, None),
+        ('get', f'/user/stats?world_id={w}', player, None),
+        ('get', f'/game/dungeon?world_id={w}', player, None),
+        ('post', '/deck', player, {'cards': deck}),
+        ('get', f'/game/fight?dungeon_id={dungeon_id}&selected_card_id={card_id}', player, None),
+        ('get', f'/game/fight?dungeon_id={dungeon_id}&selected_card_id={card_id}&view=lean', player, None),
+        ('get', f'/game/optimize?dungeon_id={dungeon_id}', player, None),
+        ('get', f'/card/picture?card_id={dungeon_card}', player, None),
+        ('get', f'/world/list/dungeons?world_id={w}', master, None),
+        ('get', f'/world/list/cards?world_id={w}', master, None),
+        ('get', f'/world/list/users?world_id={w}', master, None),
+        # lapozva: keyset feltétel + rendezés az indexből
+        ('get', f'/user/list/worlds?limit=2&cursor={encode_cursor([""])}', player, None),
+        ('get', f'/user/list/cards?world_id={w}&limit=2&cursor={encode_cursor([0, 0])}', player, None),
+        ('get', f'/world/list/dungeons?world_id={w}&limit=2&cursor={encode_cursor([0])}', master, None),
+        ('get', f'/world/list/cards?world_id={w}&limit=2&fields=id,name&cursor={encode_cursor(["", 0])}', master, None),
+        ('get', f'/world/list/users?world_id={w}&limit=2&cursor={encode_cursor([""])}', master, None),
+        ('get', f'/world/stats?world_id={w}&scope=card', master, None),
+        ('get', f'/world/balance?world_id={w}', master, None),
+        ('post', '/game/simulate', master, {'world_id': w, 'user_id': player_id}),
+        ('post', '/create/card', master, {'world_id': w, 'name': 'uj', 'type': 't', 'health': 5, 'damage': 5,
+                                          'give_to_user_ids': [player_id]}),
+        ('post', '/create/leader', master, {'world_id': w, 'card_id': dungeon_card, 'name': 'vezer',
+                                            'damage_doubled': True}),
+        ('post', '/create/dungeon', master, {'world_id': w, 'name': 'd1', 'list_of_cards_ids': [dungeon_card]}),
+        ('post', '/world/user/addcard', master, {'world_id': w, 'card_id': dungeon_card, 'user_id': player_id}),
+        ('delete', '/world/user/removecard', master, {'world_id': w, 'card_id': dungeon_card, 'user_id': player_id}),
+        ('delete', '/delete/dungeon', master, {'world_id': w, 'dungeon_id': dungeon_id}),
+        ('delete', '/delete/card', master, {'world_id': w, 'card_id': dungeon_card}),
+        ('post', '/user/login', {}, {'username': gm.username, 'password': 'rossz'}),
+        ('post', '/user/verify-email', {}, {'token': 'nincs'}),
+        ('put', '/user/password-reset', {}, {'token': 'nincs', 'password': 'Passw0rdX'}),
+        ('post', '/user/password-reset', {}, {'email': gm.email}),
+        ('delete', '/delete/world', master, {'world_id': w}),
+    ]
+    for method, url, headers, body in calls:
+        request_label[0] = f'{method.upper()} {url.split("?")[0]}'
+        response = getattr(client, method)(url, headers=headers, json=body)
+        response.get_data()  # a streamelt válasz is fusson végig
+        if response.status_code >= 500:
+            print(f'  HIBA: {request_label[0]} -> {response.status_code}')
+            sys.exit(1)
+
+    print(f'query-plans - {len(statements)} különböző lekérdezés, {len(calls)} kérésből')
+    problems = 0
+    with app.app_context(), db.engine.connect() as conn:
+        for statement, (parameters, label) in statements.items():
+            plan = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+            for row in plan:
+                detail = row[-1]
+                if not detail.startswith('SCAN '):
+                    continue  # SEARCH ... USING INDEX / PRIMARY KEY, temp b-tree, stb.
+                allowed = next((reason for prefix, reason in _ALLOWED_SCANS.items() if detail.startswith(prefix)), None)
+                if allowed:
+                    print(f'  ok (szándékos) {label:<28} {detail} - {allowed}')
+                else:
+                    problems += 1
+                    print(f'  INDEX NÉLKÜL   {label:<28} {detail}')
+                    print(f'                 {" ".join(statement.split())[:160]}')
+    if problems:
+        print(f'  HIBA: {problems} lekérdezés nem használ indexet')
+        sys.exit(1)
+    print('  OK - minden lekérdezés indexet használ')
+
+
+def bench_memberships(args):
+    """
+    Világ tagjainak listázása és világ törlés sok userrel
+
+    A régi út (minden user betöltése, world_ids JSON szűrése Pythonban) és a
+    world_memberships táblás indexelt lekérdezés összehasonlítása.
+    """
+    from app.memberships import list_members, remove_world
+    from app.models import db, User, World, WorldMembership
+
+    app = _make_app()
+    rng = random.Random(args.seed)
+    worlds = [f'w{i:05d}' for i in range(max(1, args.users // 100))]
+    with app.app_context():
+        users, rows = [], []
+        for i in range(args.users):
+            user_id = f'u{i:031d}'
+            joined = rng.sample(worlds, min(len(worlds), 3))
+            users.append({'id': user_id, 'username': f'user{i}', 'email': f'user{i}@x.hu', 'password_hash': '-',
+                          'world_ids': {w: False for w in joined}, 'settings': {}, 'membership_version': 0,
+                          'email_verified': True, 'created_at': datetime.utcnow()})
+            rows += [{'user_id': user_id, 'world_id': w, 'is_master': False} for w in joined]
+        db.session.execute(World.__table__.insert(), [{'world_id': w, 'name': w} for w in worlds])
+        db.session.execute(User.__table__.insert(), users)
+        db.session.execute(WorldMembership.__table__.insert(), rows)
+        db.session.commit()
+        target = worlds[0]
+
+        def legacy_list():
+            # mint régen a /world/list/users: minden user betöltése
+            return [(u.id, u.username) for u in User.query.all() if target in (u.legacy_world_ids or {})]
+
+        print(f'memberships - {args.users:,} user, {len(worlds):,} világ, {len(rows):,} tagság')
+        for label, fn in (('JSON scan', legacy_list), ('tábla', lambda: list_members(target))):
+            start = time.perf_counter()
+            found = fn()
+            print(f'  tagok listázása {label:<10} {(time.perf_counter() - start) * 1000:>9,.2f} ms ({len(found)} tag)')
+
+        start = time.perf_counter()
+        changed = remove_world(target)
+        db.session.commit()
+        print(f'  világ tagságok törlése     {(time.perf_counter() - start) * 1000:>9,.2f} ms ({len(changed)} user)')
+
+
+def bench_pictures(args):
+    """
+    Adatbázis méret egy seedelt világon: kép kártyánként vs card_pictures
+
+    A régi elrendezéssel (minden másolatban a base64 kép) tölt fel egy
+    világot, lemeri a méretet, lefuttatja a képek áthelyezését (4. migráció)
+    és VACUUM után újra mér.
+    """
+    from app.models import db, Card, World
+    from app.schema import move_card_pictures
+
+    app = _make_app()
+    rng = random.Random(args.seed)
+    world_id = 'w' * 32
+    with app.app_context():
+        rows = []
+        for c in range(args.cards):
+            picture = _fake_picture(args.picture_kb)
+            for owner in range(args.players + 1):  # 0 = GM eredeti lapja
+                rows.append({'id': f'{rng.getrandbits(128):032x}', 'world_id': world_id, 'owner_id': f'{owner:032d}',
+                             'name': f'k{c}', 'picture': picture, 'health': rng.randint(1, 100),
+                             'damage': rng.randint(2, 100), 'type': rng.choice(TYPES), 'position': 0,
+                             'is_leader': ''})
+        db.session.execute(World.__table__.insert(), [{'world_id': world_id, 'name': 'bench'}])
+        db.session.execute(Card.__table__.insert(), rows)
+        db.session.commit()
+
+        def measure(label):
+            with db.engine.connect() as conn:
+                conn.exec_driver_sql('VACUUM')
+                size = conn.exec_driver_sql('PRAGMA page_count').scalar() * \
+                    conn.exec_driver_sql('PRAGMA page_size').scalar()
+                tables = dict(conn.exec_driver_sql(
+                    "SELECT name, SUM(pgsize) FROM dbstat WHERE name IN ('cards', 'card_pictures') GROUP BY name"
+                ).fetchall())
+            per_card = tables.get('cards', 0) / len(rows)
+            print(f'  {label:<8} fájl {size / 1024 / 1024:>8,.2f} MB, cards tábla {per_card:>9,.0f} B/kártya, '
+                  f'card_pictures {tables.get("card_pictures", 0) / 1024 / 1024:,.2f} MB')
+            return size
+
+        print(f'pictures - {args.cards} lap x {args.players} játékos, {args.picture_kb} KB kép, {len(rows)} kártya sor')
+        before = measure('régi')
+        with db.engine.begin() as conn:
+            move_card_pictures(db, conn)
+        after = measure('új')
+        print(f'  {before / after:.1f}x kisebb adatbázis')
+
+
+def bench_distribute(args):
+    """
+    Kártya kiosztás 1/100/1000 játékosnak: /create/card és /world/user/addcard
+
+    A régi út (célpontonként lekérdezés + commit) egy külön függvényben,
+    közvetlenül az adatbázison fut, az új a valódi endpointokon. Mindkettőnél
+    az SQL utasítások és a commitok számát is kiírjuk.
+    """
+    from sqlalchemy import event
+    from app.models import db, User, World, Card, CardInstance, WorldMembership
+    from app.utils import generate_unique_id, generate_token
+
+    app = _make_app()
+    app.config['RATE_LIMIT_POLICIES'] = _unlimited_policies(app)
+    client = app.test_client()
+    players = max(args.targets)
+    world_id = generate_unique_id()
+    with app.app_context():
+        gm_id = generate_unique_id()
+        users = [{'id': gm_id, 'username': 'gm', 'email': 'gm@x.hu', 'password_hash': '-', 'world_ids': {},
+                  'settings': {}, 'membership_version': 0, 'email_verified': True, 'created_at': datetime.utcnow()}]
+        users += [{'id': f'p{i:031d}', 'username': f'player{i}', 'email': f'player{i}@x.hu', 'password_hash': '-',
+                   'world_ids': {}, 'settings': {}, 'membership_version': 0, 'email_verified': True,
+                   'created_at': datetime.utcnow()} for i in range(players)]
+        db.session.execute(World.__table__.insert(), [{'world_id': world_id, 'name': 'bench'}])
+        db.session.execute(User.__table__.insert(), users)
+        db.session.execute(WorldMembership.__table__.insert(), [
+            {'user_id': u['id'], 'world_id': world_id, 'is_master': u['id'] == gm_id} for u in users
+        ])
+        db.session.commit()
+        headers = {'Authorization': f'Bearer {generate_token(gm_id, app.config["SECRET_KEY"])}'}
+        engine = db.engine
+
+    counts = {'sql': 0, 'commit': 0}
+
+    def count_sql(*_):
+        counts['sql'] += 1
+
+    def count_commit(*_):
+        counts['commit'] += 1
+
+    event.listen(engine, 'before_cursor_execute', count_sql)
+    event.listen(engine, 'commit', count_commit)
+
+    def measure(label, fn):
+        counts.update(sql=0, commit=0)
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        print(f'  {label:<34} {elapsed * 1000:>9,.1f} ms  {counts["sql"]:>6} SQL  {counts["commit"]:>5} commit')
+
+    def new_card(name, **extra):
+        body = dict(world_id=world_id, name=name, type='t', health=10, damage=5, **extra)
+        response = client.post('/create/card', json=body, headers=headers)
+        assert response.status_code == 201, response.get_data(as_text=True)
+        return response.get_json()['data']['card']['id']
+
+    def legacy_addcard(template_id, targets):
+        # mint régen: célpontonként user + meglévő másolat lekérdezés, majd commit
+        with app.app_context():
+            template = db.session.get(Card, template_id)
+            for uid in targets:
+                db.session.get(User, uid)
+                CardInstance.query.filter_by(template_id=template_id, owner_id=uid).first()
+            for uid in targets:
+                db.session.add(CardInstance(id=generate_unique_id(), template_id=template.id, world_id=world_id,
+                                            owner_id=uid, health_bonus=0, damage_bonus=0, position=0))
+                db.session.commit()
+
+    def addcard(template_id, targets):
+        response = client.post('/world/user/addcard', json={
+            'world_id': world_id, 'card_id': template_id, 'user_ids': targets
+        }, headers=headers)
+        assert response.status_code == 201, response.get_data(as_text=True)
+
+    print(f'distribute - {players} játékos egy világban')
+    for n in args.targets:
+        targets = [f'p{i:031d}' for i in range(n)]
+        print(f' {n} célpont')
+        legacy_id, template_id = new_card(f'legacy{n}'), new_card(f'add{n}')
+        measure('régi (célpontonként commit)', lambda: legacy_addcard(legacy_id, targets))
+        measure('/world/user/addcard', lambda: addcard(template_id, targets))
+        measure('/create/card give_to_user_ids', lambda: new_card(f'create{n}', give_to_user_ids=targets))
+
+
+def bench_delete_world(args):
+    """
+    Nagy világ törlése: egy tranzakcióban vs háttérben, darabokban
+
+    Azt mérjük, meddig tartja egy tranzakció az írási zárat - ennyi ideig
+    vár minden más író (harc, kiosztás) ugyanabban az adatbázisban.
+    """
+    from sqlalchemy import event
+    from app.models import db, World, Card, CardInstance, WorldMembership
+    from app.world_deletion import delete_worlds, schedule_delete, world_deleter
+
+    app = _make_app(WORLD_DELETE_CHUNK=args.chunk)
+    rng = random.Random(args.seed)
+
+    def seed():
+        world_id = f'{rng.getrandbits(128):032x}'
+        templates = [{'id': f'{rng.getrandbits(128):032x}', 'world_id': world_id, 'owner_id': 'g' * 32,
+                      'name': f'k{i}', 'health': 10, 'damage': 5, 'type': rng.choice(TYPES), 'position': 0,
+                      'is_leader': ''} for i in range(args.cards)]
+        owned = [{'id': f'{rng.getrandbits(128):032x}', 'template_id': t['id'], 'world_id': world_id,
+                  'owner_id': f'{p:032d}', 'health_bonus': 0, 'damage_bonus': 0, 'position': 0}
+                 for t in templates for p in range(args.players)]
+        with app.app_context():
+            db.session.execute(World.__table__.insert(), [{'world_id': world_id, 'name': 'bench'}])
+            db.session.execute(WorldMembership.__table__.insert(), [
+                {'user_id': f'{p:032d}', 'world_id': world_id, 'is_master': False} for p in range(args.players)
+            ])
+            db.session.execute(Card.__table__.insert(), templates)
+            db.session.execute(CardInstance.__table__.insert(), owned)
+            db.session.commit()
+        return world_id, len(templates) + len(owned)
+
+    holds = []
+    with app.app_context():
+        engine = db.engine
+    started = {}
+    event.listen(engine, 'begin', lambda conn: started.__setitem__('t', time.perf_counter()))
+    event.listen(engine, 'commit', lambda conn: holds.append(time.perf_counter() - started.pop('t', time.perf_counter())))
+
+    print(f'delete-world - {args.cards} lap x {args.players} játékos')
+    world_id, rows = seed()
+    holds.clear()
+    with app.app_context():
+        delete_worlds([world_id])
+        db.session.commit()
+    print(f'  egy tranzakció   {rows:>9,} sor   leghosszabb zár {max(holds) * 1000:>9,.1f} ms')
+
+    world_id, rows = seed()
+    holds.clear()
+    with app.app_context():
+        schedule_delete(world_id)
+        db.session.commit()
+    request_hold = max(holds)
+    start = time.perf_counter()
+    world_deleter.run_pending()
+    elapsed = time.perf_counter() - start
+    print(f'  háttérben        {rows:>9,} sor   kérés {request_hold * 1000:,.1f} ms, '
+          f'{len(holds) - 1} darab, leghosszabb zár {max(holds[1:]) * 1000:,.1f} ms, összesen {elapsed:.2f} s')
+
+
+def bench_transfer(args):
+    """
+    Világ export / import NDJSON-ben nagy világgal - idő és csúcs memória
+
+    A memória a köteg méretével arányos kell legyen, nem a világéval.
+    """
+    import tracemalloc
+    from app.models import db, User, World, Card, CardInstance, WorldMembership
+    from app.world_transfer import export_world, import_world
+
+    app = _make_app()
+    rng = random.Random(args.seed)
+    world_id, gm_id = 'w' * 32, 'g' * 32
+    with app.app_context():
+        db.session.execute(User.__table__.insert(), [{
+            'id': gm_id, 'username': 'gm', 'email': 'gm@x.hu', 'password_hash': '-', 'world_ids': {},
+            'settings': {}, 'membership_version': 0, 'email_verified': True, 'created_at': datetime.utcnow()
+        }])
+        db.session.execute(World.__table__.insert(), [{'world_id': world_id, 'name': 'bench'}])
+        db.session.execute(WorldMembership.__table__.insert(), [
+            {'user_id': gm_id, 'world_id': world_id, 'is_master': True}
+        ])
+        for start in range(0, args.cards, 10000):
+            templates = [{'id': f'{rng.getrandbits(128):032x}', 'world_id': world_id, 'owner_id': gm_id,
+                          'name': f'k{i}', 'health': 10, 'damage': 5, 'type': rng.choice(TYPES), 'position': 0,
+                          'is_leader': ''} for i in range(start, min(args.cards, start + 10000))]
+            db.session.execute(Card.__table__.insert(), templates)
+            db.session.execute(CardInstance.__table__.insert(), [{
+                'id': f'{rng.getrandbits(128):032x}', 'template_id': t['id'], 'world_id': world_id,
+                'owner_id': gm_id, 'health_bonus': 0, 'damage_bonus': 0, 'position': 0
+            } for t in templates])
+        db.session.commit()
+
+    fd, path = tempfile.mkstemp(suffix='.ndjson')
+    os.close(fd)
+    atexit.register(os.remove, path)
+    print(f'transfer - {args.cards:,} lap + {args.cards:,} példány')
+    with app.app_context():
+        tracemalloc.start()
+        start = time.perf_counter()
+        with open(path, 'w', encoding='utf-8') as out:
+            for line in export_world(world_id):
+                out.write(line)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    print(f'  export  {elapsed:>7.2f} s   {os.path.getsize(path) / 1024 / 1024:>7,.1f} MB fájl   '
+          f'csúcs memória {peak / 1024 / 1024:,.1f} MB')
+
+    with app.app_context():
+        tracemalloc.start()
+        start = time.perf_counter()
+        with open(path, 'rb') as stream:
+            world, counts = import_world(stream, gm_id)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'  import  {elapsed:>7.2f} s   {counts["cards"]:,} lap, {counts["instances"]:,} példány   '
+              f'csúcs memória {peak / 1024 / 1024:,.1f} MB')
+
+
+def bench_clone(args):
+    """
+    Világ klónozás (/world/clone) nagy világgal - idő és SQL utasítások száma
+
+    Az utasítások száma fix, a sorok számától független.
+    """
+    from sqlalchemy import event
+    from app.models import db, User, World, Card, CardInstance, Dungeon, WorldMembership
+    from app.dungeon_cards import set_cards
+    from app.utils import generate_token
+
+    app = _make_app()
+    app.config['RATE_LIMIT_POLICIES'] = _unlimited_policies(app)
+    rng = random.Random(args.seed)
+    world_id, gm_id = 'w' * 32, 'g' * 32
+    players = [f'{p:032d}' for p in range(args.players)]
+    with app.app_context():
+        db.session.execute(User.__table__.insert(), [{
+            'id': user_id, 'username': f'u{user_id[-8:]}', 'email': f'{user_id}@x.hu', 'password_hash': '-',
+            'world_ids': {}, 'settings': {}, 'membership_version': 0, 'email_verified': True,
+            'created_at': datetime.utcnow()
+        } for user_id in [gm_id] + players])
+        db.session.execute(World.__table__.insert(), [{'world_id': world_id, 'name': 'bench'}])
+        db.session.execute(WorldMembership.__table__.insert(), [
+            {'user_id': user_id, 'world_id': world_id, 'is_master': user_id == gm_id} for user_id in [gm_id] + players
+        ])
+        templates = [{'id': f'{rng.getrandbits(128):032x}', 'world_id': world_id, 'owner_id': gm_id,
+                      'name': f'k{i}', 'health': 10, 'damage': 5, 'type': rng.choice(TYPES), 'position': 0,
+                      'is_leader': ''} for i in range(args.cards)]
+        for leader, card in zip(templates[::10], templates[1::10]):
+            leader['is_leader'] = card['id']
+        db.session.execute(Card.__table__.insert(), templates)
+        db.session.execute(CardInstance.__table__.insert(), [{
+            'id': f'{rng.getrandbits(128):032x}', 'template_id': t['id'], 'world_id': world_id, 'owner_id': p,
+            'health_bonus': 0, 'damage_bonus': 0, 'position': 0
+        } for t in templates for p in players])
+        for i in range(args.cards // 100):
+            dungeon_id = f'{rng.getrandbits(128):032x}'
+            db.session.add(Dungeon(id=dungeon_id, name=f'd{i}', world_id=world_id))
+            set_cards(dungeon_id, [t['id'] for t in rng.sample(templates, 4)])
+        db.session.commit()
+        headers = {'Authorization': f'Bearer {generate_token(gm_id, app.config["SECRET_KEY"])}'}
+        engine = db.engine
+
+    statements = [0]
+    event.listen(engine, 'before_cursor_execute', lambda *_: statements.__setitem__(0, statements[0] + 1))
+    client = app.test_client()
+    print(f'clone - {args.cards:,} lap, {args.players} játékos ({args.cards * args.players:,} példány)')
+    for include_players in (False, True):
+        statements[0] = 0
+        start = time.perf_counter()
+        response = client.post('/world/clone', json={'world_id': world_id, 'include_players': include_players},
+                               headers=headers)
+        elapsed = time.perf_counter() - start
+        assert response.status_code == 201, response.get_data(as_text=True)
+        copied = response.get_json()['data']['copied']
+        label = 'játékosokkal' if include_players else 'csak a GM lapjai'
+        print(f'  {label:<18} {elapsed * 1000:>9,.1f} ms  {statements[0]:>3} SQL  {sum(copied.values()):>10,} sor')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Damareen teljesítmény mérések')
+    parser.add_argument('--seed', type=int, default=1)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('fight', help=bench_fight.__doc__)
+    p.add_argument('--fights', type=int, default=20000)
+    p.set_defaults(func=bench_fight)
+
+    p = sub.add_parser('fight-payload', help=bench_fight_payload.__doc__)
+    p.add_argument('--picture-kb', type=int, default=48)
+    p.set_defaults(func=bench_fight_payload)
+
+    p = sub.add_parser('stress-upgrades', help='párhuzamos fejlesztések pontossága')
+    p.add_argument('--fights', type=int, default=300)
+    p.add_argument('--threads', type=int, default=32)
+    p.set_defaults(func=bench_stress_upgrades)
+
+    p = sub.add_parser('auth', help='védett endpoint késleltetése principal cache-sel és nélküle')
+    p.add_argument('--requests', type=int, default=3000)
+    p.set_defaults(func=bench_auth)
+
+    p = sub.add_parser('login', help='login áteresztés és /health késleltetés login roham alatt')
+    p.add_argument('--logins', type=int, default=200)
+    p.add_argument('--threads', type=int, default=32)
+    p.add_argument('--rounds', type=int, default=10)
+    p.set_defaults(func=bench_login)
+
+    p = sub.add_parser('query-plans', help='minden route lekérdezés indexet használ-e (EXPLAIN QUERY PLAN)')
+    p.set_defaults(func=bench_query_plans)
+
+    p = sub.add_parser('pictures', help='adatbázis méret kártyánkénti képpel vs card_pictures táblával')
+    p.add_argument('--cards', type=int, default=20)
+    p.add_argument('--players', type=int, default=50)
+    p.add_argument('--picture-kb', type=int, default=48)
+    p.set_defaults(func=bench_pictures)
+
+    p = sub.add_parser('memberships', help='világ tagok listázása/törlése sok userrel (JSON vs tábla)')
+    p.add_argument('--users', type=int, default=100000)
+    p.set_defaults(func=bench_memberships)
+
+    p = sub.add_parser('distribute', help='kártya kiosztás sok játékosnak egy tranzakcióban')
+    p.add_argument('--targets', type=int, nargs='+', default=[1, 100, 1000])
+    p.set_defaults(func=bench_distribute)
+
+    p = sub.add_parser('delete-world', help='nagy világ törlése: írási zár hossza egyben vs darabokban')
+    p.add_argument('--cards', type=int, default=2000)
+    p.add_argument('--players', type=int, default=100)
+    p.add_argument('--chunk', type=int, default=2000)
+    p.set_defaults(func=bench_delete_world)
+
+    p = sub.add_parser('transfer', help='világ export / import NDJSON-ben: idő és csúcs memória')
+    p.add_argument('--cards', type=int, default=100000)
+    p.set_defaults(func=bench_transfer)
+
+    p = sub.add_parser('clone', help='világ klónozás INSERT ... SELECT-tel: idő és SQL utasítások')
+    p.add_argument('--cards', type=int, default=20000)
+    p.add_argument('--players', type=int, default=20)
+    p.set_defaults(func=bench_clone)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
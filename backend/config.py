@@ -13,6 +13,30 @@ class Config:
     CORS_HEADERS = 'Content-Type'
     
     
+    # Rate limit háttértár: memory / sqlite / shm (az utóbbi kettő több worker folyamathoz)
+    RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND', 'memory')
+    RATELIMIT_STORAGE_PATH = os.environ.get('RATELIMIT_STORAGE_PATH')  # alapból instance/ratelimit
+    
+    
+    # Jelszó hash-elés: bcrypt költség, párhuzamos szálak (0 = request szálon), max folyamatban lévő
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+    PASSWORD_WORKERS = int(os.environ['PASSWORD_WORKERS']) if os.environ.get('PASSWORD_WORKERS') else None
+    PASSWORD_QUEUE_LIMIT = int(os.environ.get('PASSWORD_QUEUE_LIMIT', 0)) or None
+    
+    
+    # A token a világ tagságokat is hordozza, így a jogosultság ellenőrzéshez nem kell DB
+    TOKEN_MEMBERSHIP_CLAIMS = os.environ.get('TOKEN_MEMBERSHIP_CLAIMS', 'true').lower() == 'true'
+    
+    
+    # Világ törlés: ennyi lap + példány felett háttérben, darabonként ennyi sorral (rövid írási zár)
+    WORLD_DELETE_BACKGROUND_ROWS = int(os.environ.get('WORLD_DELETE_BACKGROUND_ROWS', 50000))
+    WORLD_DELETE_CHUNK = int(os.environ.get('WORLD_DELETE_CHUNK', 2000))
+    
+    
+    # GET /metrics csak ezzel a tokennel (X-Metrics-Token fejléc), ha nincs megadva, az endpoint ki van kapcsolva
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-secret-key'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
@@ -2,6 +2,7 @@ import os
 from dotenv import load_dotenv
 from app import create_app
 from app.models import db
+from app.schema import migrate
 from werkzeug.serving import ThreadedWSGIServer
 
 load_dotenv()  # .env fájlból olvassuk be a környezeti változókat
@@ -11,7 +12,7 @@ app = create_app()
 # DB inicializálás - ha nem létezik, létrehozza a táblákat
 with app.app_context():
     db.init_app(app)
-    db.create_all()
+    migrate(db)  # hiányzó táblák + régi adatbázisban az új oszlopok / indexek pótlása
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 7621))  # 7621 az alapértelmezett port